@@ -0,0 +1,106 @@
+"""Replay recorded conversations through AdvancedRAGChat.run offline and report cost per request and route.
+
+Every external interaction is served from the cassettes, with optional injected latency, so the numbers reflect the
+pipeline's own work: wall time, CPU time and peak memory allocated per request.
+
+    python benchmarks/bench_pipeline.py [--cassettes benchmarks/cassettes] [--iterations 50] [--latency none]
+
+--latency is "none", "recorded" (the durations measured while recording) or fixed seconds per interaction kind,
+e.g. "openai=0.8,google_cse=0.4,apps_script=0.6,db=0.005".
+"""
+
+import argparse
+import asyncio
+import contextlib
+import copy
+import io
+import logging
+import statistics
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+
+from cassette import (
+    Cassette,
+    CassettePlayer,
+    LatencyModel,
+    ReplayAppsScriptClient,
+    ReplayOpenAIClient,
+    ReplaySearcher,
+)
+
+from fastapi_app.rag_advanced import AdvancedRAGChat
+
+
+async def replay(cassette: Cassette, latency: LatencyModel, strict: bool) -> str:
+    player = CassettePlayer(cassette, latency=latency, strict=strict)
+    ragchat = AdvancedRAGChat(
+        searcher=ReplaySearcher(player),
+        openai_chat_client=ReplayOpenAIClient(player),
+        chat_model="gpt-4o",
+        chat_deployment=None,
+        apps_script_client=ReplayAppsScriptClient(player),
+    )
+    # The pipeline prints progress on every request
+    with contextlib.redirect_stdout(io.StringIO()):
+        await ragchat.run(copy.deepcopy(cassette.messages))
+    return ragchat.route
+
+
+async def measure(cassettes: list[Cassette], iterations: int, latency: LatencyModel, strict: bool) -> dict:
+    results = defaultdict(lambda: {"wall": [], "cpu": [], "peak_kib": []})
+    for cassette in cassettes:
+        # Warm up imports, prompt caches and the like
+        await replay(cassette, latency, strict)
+        for _ in range(iterations):
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            route = await replay(cassette, latency, strict)
+            results[route]["wall"].append((time.perf_counter() - wall_start) * 1000)
+            results[route]["cpu"].append((time.process_time() - cpu_start) * 1000)
+
+        # Allocation tracing slows everything down, so it gets its own pass
+        for _ in range(max(iterations // 10, 1)):
+            tracemalloc.start()
+            route = await replay(cassette, LatencyModel(), strict)
+            results[route]["peak_kib"].append(tracemalloc.get_traced_memory()[1] / 1024)
+            tracemalloc.stop()
+    return results
+
+
+def percentile(values: list[float], q: int) -> float:
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def report(results: dict) -> None:
+    header = f"{'route':<36}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'cpu ms':>10}{'peak KiB':>10}"
+    print(header)
+    print("-" * len(header))
+    for route, samples in sorted(results.items()):
+        print(
+            f"{route:<36}{len(samples['wall']):>6}"
+            f"{percentile(samples['wall'], 50):>10.2f}{percentile(samples['wall'], 95):>10.2f}"
+            f"{statistics.mean(samples['cpu']):>10.2f}{statistics.mean(samples['peak_kib']):>10.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark AdvancedRAGChat.run by replaying cassettes")
+    parser.add_argument("--cassettes", type=Path, default=Path(__file__).parent / "cassettes")
+    parser.add_argument("--iterations", type=int, default=50, help="Replays per cassette")
+    parser.add_argument("--latency", default="none", help="none, recorded, or kind=seconds,...")
+    parser.add_argument("--strict", action="store_true", help="Fail when a request differs from the recording")
+    args = parser.parse_args()
+
+    cassettes = [Cassette.load(path) for path in sorted(args.cassettes.glob("*.json"))]
+    if not cassettes:
+        parser.error(f"No cassettes found in {args.cassettes}")
+    results = asyncio.run(measure(cassettes, args.iterations, LatencyModel.parse(args.latency), args.strict))
+    report(results)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    main()
@@ -0,0 +1,127 @@
+"""Benchmark JSON encoding and compression of representative /chat and /packages responses.
+
+Compares the default FastAPI path (jsonable_encoder + stdlib json, as rendered by JSONResponse) with
+ORJSONResponse, and reports the bytes on the wire for each encoding the CompressionMiddleware negotiates.
+The package text is synthetic and repetitive, so it compresses better than real catalog rows do.
+
+    python benchmarks/bench_serialization.py [--iterations 200]
+"""
+
+import argparse
+import dataclasses
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from fastapi_app.api_models import ThoughtStep
+from fastapi_app.compression import brotli, compress
+from fastapi_app.postgres_models import Package
+from fastapi_app.responses import ORJSONResponse
+
+THAI_PARAGRAPH = (
+    "แพ็กเกจตรวจสุขภาพประจำปี รวมตรวจเลือด ตรวจปัสสาวะ เอกซเรย์ปอด และพบแพทย์สรุปผล "
+    "สามารถเลือกวันและเวลาได้ตามสะดวก ใช้บริการได้ที่โรงพยาบาลทุกสาขา ราคารวมค่าแพทย์และค่าบริการโรงพยาบาลแล้ว "
+)
+
+
+def make_package(index: int) -> Package:
+    # Columns like embedding are not constructor arguments
+    fields = {field.name: THAI_PARAGRAPH * 6 for field in dataclasses.fields(Package) if field.init}
+    fields.update(
+        package_name=f"ตรวจสุขภาพ แพ็กเกจที่ {index} ที่ โรงพยาบาลตัวอย่าง",
+        url=f"https://hdmall.co.th/checkup/package-{index}",
+        category="ตรวจสุขภาพ",
+        price=2990.0 + index,
+        cash_discount=100.0,
+        price_after_cash_discount=2890.0 + index,
+        price_to_reserve_for_this_package=500.0,
+    )
+    return Package(**fields)
+
+
+def make_chat_response(packages: list[Package]) -> dict:
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant for HDmall. " * 40},
+        {"role": "user", "content": [{"type": "text", "text": "อยากตรวจสุขภาพแถวรังสิต งบไม่เกิน 3000 บาท"}]},
+    ]
+    sources = [f"[{package.url}]:{package.to_str_for_narrow_rag()}\n\n" for package in packages]
+    return {
+        "id": "chatcmpl-benchmark",
+        "object": "chat.completion",
+        "model": "gpt-4o",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": THAI_PARAGRAPH * 3},
+                "context": {
+                    "data_points": {"text": sources},
+                    "thoughts": [
+                        ThoughtStep(title="Prompt to generate search arguments", description=messages, props={}),
+                        ThoughtStep(title="Google Search query", description="ตรวจสุขภาพ รังสิต", props={}),
+                        ThoughtStep(
+                            title="Google Search results", description=[p.to_dict() for p in packages], props={}
+                        ),
+                        ThoughtStep(
+                            title="Prompt to generate answer",
+                            description=[str(message) for message in messages + [{"role": "user", "content": sources}]],
+                            props={"model": "gpt-4o"},
+                        ),
+                    ],
+                },
+            }
+        ],
+        "usage": {"prompt_tokens": 5000, "completion_tokens": 300, "total_tokens": 5300},
+    }
+
+
+def time_per_call(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def bench(name: str, content, iterations: int) -> None:
+    def default_path():
+        return JSONResponse(jsonable_encoder(content)).body
+
+    def orjson_path():
+        return ORJSONResponse(content).body
+
+    def ascii_path():
+        return json.dumps(jsonable_encoder(content)).encode()
+
+    def row(label, elapsed, size):
+        print(f"  {label:<36}{elapsed:>12.3f}{size:>12}")
+
+    default_body, orjson_body, ascii_body = default_path(), orjson_path(), ascii_path()
+    print(f"\n{name}")
+    print(f"  {'encoder':<36}{'ms/response':>12}{'bytes':>12}")
+    row("jsonable_encoder + json (ascii)", time_per_call(ascii_path, iterations), len(ascii_body))
+    row("jsonable_encoder + JSONResponse", time_per_call(default_path, iterations), len(default_body))
+    row("ORJSONResponse", time_per_call(orjson_path, iterations), len(orjson_body))
+
+    print(f"  {'compression of ORJSONResponse body':<36}{'ms/response':>12}{'bytes':>12}")
+    for encoding in ["gzip"] + (["br"] if brotli is not None else []):
+        row(
+            encoding,
+            time_per_call(lambda: compress(orjson_body, encoding), iterations),
+            len(compress(orjson_body, encoding)),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark response serialization and compression")
+    parser.add_argument("--iterations", type=int, default=200, help="Encodings per measurement")
+    args = parser.parse_args()
+
+    packages = [make_package(index) for index in range(3)]
+    bench("/packages/{url}", packages[0].to_dict(), args.iterations)
+    bench("/chat (search route, full context)", make_chat_response(packages), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
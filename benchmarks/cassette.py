@@ -0,0 +1,363 @@
+"""Record and replay every external interaction of AdvancedRAGChat.run.
+
+A cassette holds one conversation turn: the input messages and, in call order, each chat completion, Google Custom
+Search result, Apps Script response and package lookup made while answering it. Recording wraps the real clients;
+replaying serves the recorded responses per kind, in order, after an optional injected latency.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from pathlib import Path
+
+import orjson
+from openai.types.chat import ChatCompletion
+
+from fastapi_app.postgres_models import PackageCard, PackageDetail, PackageView
+from fastapi_app.postgres_searcher import fanout_queries
+
+logger = logging.getLogger("ragapp")
+
+CASSETTE_VERSION = 1
+INTERACTION_KINDS = ("openai", "google_cse", "apps_script", "db")
+SEARCH_METHODS = ("google_search", "google_fanout_search", "hybrid_search", "bm25_search")
+
+
+def request_key(request) -> str:
+    return hashlib.sha1(orjson.dumps(request, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
+
+def package_to_record(package: PackageView) -> dict:
+    return package.to_dict()
+
+
+def package_from_record(record: dict, view: type[PackageView]) -> PackageView:
+    # Older cassettes recorded full packages, the view keeps its own columns
+    return view.from_dict(record)
+
+
+class Cassette:
+    def __init__(self, name: str, messages: list[dict], interactions: list[dict] | None = None, route: str = None):
+        self.name = name
+        self.messages = messages
+        self.interactions = interactions or []
+        self.route = route
+
+    def record(self, kind: str, request, response, duration: float) -> dict:
+        interaction = {
+            "kind": kind,
+            "key": request_key(request),
+            "request": request,
+            "response": response,
+            "duration": duration,
+        }
+        self.interactions.append(interaction)
+        return interaction
+
+    def save(self, path: Path) -> None:
+        data = {
+            "version": CASSETTE_VERSION,
+            "name": self.name,
+            "route": self.route,
+            "messages": self.messages,
+            "interactions": self.interactions,
+        }
+        path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2, default=str))
+
+    @classmethod
+    def load(cls, path: Path) -> "Cassette":
+        data = orjson.loads(path.read_bytes())
+        if data.get("version") != CASSETTE_VERSION:
+            raise ValueError(f"Unsupported cassette version {data.get('version')} in {path}")
+        return cls(data["name"], data["messages"], data["interactions"], data.get("route"))
+
+
+class LatencyModel:
+    """Latency injected per interaction kind on replay: none, the recorded duration, or a fixed number of seconds."""
+
+    def __init__(self, mode: str = "none", fixed: dict[str, float] | None = None):
+        self.mode = mode
+        self.fixed = fixed or {}
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        # "none", "recorded", or "openai=0.8,google_cse=0.4,apps_script=0.6,db=0.005"
+        if spec in ("none", "recorded"):
+            return cls(spec)
+        fixed = {}
+        for part in spec.split(","):
+            kind, _, seconds = part.partition("=")
+            if kind not in INTERACTION_KINDS:
+                raise ValueError(f"Unknown interaction kind {kind!r}, expected one of {INTERACTION_KINDS}")
+            fixed[kind] = float(seconds)
+        return cls("fixed", fixed)
+
+    def delay(self, interaction: dict) -> float:
+        if self.mode == "recorded":
+            return interaction.get("duration", 0.0)
+        return self.fixed.get(interaction["kind"], 0.0)
+
+
+# Recording
+
+
+class RecordingCompletions:
+    def __init__(self, completions, cassette: Cassette):
+        self.completions = completions
+        self.cassette = cassette
+
+    async def create(self, **kwargs) -> ChatCompletion:
+        start = time.perf_counter()
+        chat_completion = await self.completions.create(**kwargs)
+        self.cassette.record("openai", kwargs, chat_completion.model_dump(), time.perf_counter() - start)
+        return chat_completion
+
+
+class RecordingOpenAIClient:
+    def __init__(self, client, cassette: Cassette):
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = RecordingCompletions(client.chat.completions, cassette)
+
+
+class RecordingAppsScriptClient:
+    def __init__(self, client, cassette: Cassette):
+        self.client = client
+        self.cassette = cassette
+
+    def call(self, info: str, highlight_name: str = "", highlight_url: str = "", package_url: str = ""):
+        request = {
+            "info": info,
+            "highlight_name": highlight_name,
+            "highlight_url": highlight_url,
+            "package_url": package_url,
+        }
+        start = time.perf_counter()
+        response = self.client.call(info, highlight_name, highlight_url, package_url)
+        self.cassette.record("apps_script", request, response, time.perf_counter() - start)
+        return response
+
+
+def search_request(request: dict, price_range) -> dict:
+    # Searches without a price range keep the request of the cassettes recorded before price filtering
+    if price_range is not None:
+        request["price_range"] = price_range.to_dict()
+    return request
+
+
+class RecordingSearcher:
+    """Wraps a PostgresSearcher and records the Google links and the packages each lookup returned."""
+
+    def __init__(self, searcher, cassette: Cassette):
+        self.searcher = searcher
+        self.cassette = cassette
+        self.search_function = searcher.search_function
+        self.retrieval_mode = searcher.retrieval_mode
+        self.fallback_mode = searcher.fallback_mode
+        # Time spent in Google, so it is not counted again in the duration of the package lookup
+        self.search_seconds = 0.0
+        searcher.search_function = self.record_search
+
+    async def record_search(self, search_query, exact_term=None):
+        # Recorded when called, concurrent searches may not finish in the order they were sent
+        request = {"search_query": search_query, "exact_term": exact_term}
+        interaction = self.cassette.record("google_cse", request, None, 0.0)
+        start = time.perf_counter()
+        links = await self.search_function(search_query, exact_term=exact_term)
+        duration = time.perf_counter() - start
+        self.search_seconds += duration
+        interaction["response"], interaction["duration"] = links, duration
+        return links
+
+    async def simple_sql_search(self, filters: list[dict]) -> list[PackageDetail]:
+        start = time.perf_counter()
+        packages = await self.searcher.simple_sql_search(filters=filters)
+        response = [package_to_record(package) for package in packages if package is not None]
+        self.cassette.record(
+            "db", {"method": "simple_sql_search", "filters": filters}, response, time.perf_counter() - start
+        )
+        return packages
+
+    async def google_search(self, query_text: str, exact_term: str, top: int = 3, price_range=None):
+        start, search_seconds = time.perf_counter(), self.search_seconds
+        packages, is_package_found = await self.searcher.google_search(
+            query_text, exact_term=exact_term, top=top, price_range=price_range
+        )
+        duration = time.perf_counter() - start - (self.search_seconds - search_seconds)
+        request = search_request(
+            {"method": "google_search", "query_text": query_text, "exact_term": exact_term, "top": top}, price_range
+        )
+        response = {"packages": [package_to_record(package) for package in packages], "found": is_package_found}
+        self.cassette.record("db", request, response, duration)
+        return packages, is_package_found
+
+    async def google_fanout_search(self, query_text: str, locations: list[str], top: int = 3, price_range=None):
+        start, search_seconds = time.perf_counter(), self.search_seconds
+        packages, is_package_found = await self.searcher.google_fanout_search(
+            query_text, locations, top=top, price_range=price_range
+        )
+        # The searches overlap, so their summed time can exceed the elapsed time
+        duration = max(time.perf_counter() - start - (self.search_seconds - search_seconds), 0.0)
+        request = search_request(
+            {"method": "google_fanout_search", "query_text": query_text, "locations": locations, "top": top},
+            price_range,
+        )
+        response = {"packages": [package_to_record(package) for package in packages], "found": is_package_found}
+        self.cassette.record("db", request, response, duration)
+        return packages, is_package_found
+
+    async def hybrid_search(self, query_text: str, locations: list[str] | None = None, top: int = 3, price_range=None):
+        return await self.record_local_search("hybrid_search", query_text, locations, top, price_range)
+
+    async def bm25_search(self, query_text: str, locations: list[str] | None = None, top: int = 3, price_range=None):
+        return await self.record_local_search("bm25_search", query_text, locations, top, price_range)
+
+    async def record_local_search(
+        self, method: str, query_text: str, locations: list[str] | None, top: int, price_range=None
+    ):
+        start = time.perf_counter()
+        search = getattr(self.searcher, method)
+        packages, is_package_found = await search(query_text, locations=locations, top=top, price_range=price_range)
+        request = search_request(
+            {"method": method, "query_text": query_text, "locations": locations, "top": top}, price_range
+        )
+        response = {"packages": [package_to_record(package) for package in packages], "found": is_package_found}
+        self.cassette.record("db", request, response, time.perf_counter() - start)
+        return packages, is_package_found
+
+
+# Replaying
+
+
+class CassetteMismatch(Exception):
+    pass
+
+
+class CassettePlayer:
+    def __init__(self, cassette: Cassette, latency: LatencyModel | None = None, strict: bool = False):
+        self.cassette = cassette
+        self.latency = latency or LatencyModel()
+        self.strict = strict
+        self.positions = dict.fromkeys(INTERACTION_KINDS, 0)
+        self.by_kind = {kind: [i for i in cassette.interactions if i["kind"] == kind] for kind in INTERACTION_KINDS}
+
+    def next(self, kind: str, request) -> dict:
+        position = self.positions[kind]
+        if position >= len(self.by_kind[kind]):
+            raise CassetteMismatch(f"{self.cassette.name}: no more recorded {kind} interactions")
+        self.positions[kind] += 1
+        interaction = self.by_kind[kind][position]
+        if interaction["key"] != request_key(request):
+            message = f"{self.cassette.name}: {kind} request #{position} differs from the recording"
+            if self.strict:
+                raise CassetteMismatch(message)
+            logger.debug(message)
+        return interaction
+
+    async def next_async(self, kind: str, request) -> dict:
+        interaction = self.next(kind, request)
+        if delay := self.latency.delay(interaction):
+            await asyncio.sleep(delay)
+        return interaction
+
+    def next_blocking(self, kind: str, request) -> dict:
+        interaction = self.next(kind, request)
+        if delay := self.latency.delay(interaction):
+            # Called in a thread like the live Apps Script, so the wait blocks that thread rather than the loop
+            time.sleep(delay)
+        return interaction
+
+
+class ReplayCompletions:
+    def __init__(self, player: CassettePlayer):
+        self.player = player
+
+    async def create(self, **kwargs) -> ChatCompletion:
+        interaction = await self.player.next_async("openai", kwargs)
+        return ChatCompletion.model_validate(interaction["response"])
+
+
+class ReplayOpenAIClient:
+    def __init__(self, player: CassettePlayer):
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = ReplayCompletions(player)
+
+
+class ReplayAppsScriptClient:
+    def __init__(self, player: CassettePlayer):
+        self.player = player
+
+    def call(self, info: str, highlight_name: str = "", highlight_url: str = "", package_url: str = ""):
+        request = {
+            "info": info,
+            "highlight_name": highlight_name,
+            "highlight_url": highlight_url,
+            "package_url": package_url,
+        }
+        return self.player.next_blocking("apps_script", request)["response"]
+
+
+def replay_search_function(player: CassettePlayer):
+    async def search(search_query, exact_term=None):
+        request = {"search_query": search_query, "exact_term": exact_term}
+        return (await player.next_async("google_cse", request))["response"]
+
+    return search
+
+
+class ReplaySearcher:
+    """Serves the recorded packages without a database. The recorded CSE links are skipped over."""
+
+    def __init__(self, player: CassettePlayer):
+        self.player = player
+        # Replay the search path the cassette was recorded with
+        methods = [interaction["request"].get("method") for interaction in player.by_kind["db"]]
+        searches = [method for method in methods if method in SEARCH_METHODS]
+        self.retrieval_mode = searches[0].removesuffix("_search") if searches else "google"
+        self.fallback_mode = "bm25" if "bm25_search" in searches[1:] else "none"
+
+    async def simple_sql_search(self, filters: list[dict]) -> list[PackageDetail]:
+        interaction = await self.player.next_async("db", {"method": "simple_sql_search", "filters": filters})
+        return [package_from_record(record, PackageDetail) for record in interaction["response"]]
+
+    async def google_search(self, query_text: str, exact_term: str, top: int = 3, price_range=None):
+        request = {"search_query": query_text, "exact_term": exact_term}
+        if self.player.positions["google_cse"] < len(self.player.by_kind["google_cse"]):
+            await self.player.next_async("google_cse", request)
+        request = search_request(
+            {"method": "google_search", "query_text": query_text, "exact_term": exact_term, "top": top}, price_range
+        )
+        interaction = await self.player.next_async("db", request)
+        packages = [package_from_record(record, PackageCard) for record in interaction["response"]["packages"]]
+        return packages, interaction["response"]["found"]
+
+    async def google_fanout_search(self, query_text: str, locations: list[str], top: int = 3, price_range=None):
+        await asyncio.gather(
+            *(
+                self.player.next_async("google_cse", {"search_query": query, "exact_term": None})
+                for query, _ in fanout_queries(query_text, locations)
+            )
+        )
+        request = search_request(
+            {"method": "google_fanout_search", "query_text": query_text, "locations": locations, "top": top},
+            price_range,
+        )
+        interaction = await self.player.next_async("db", request)
+        packages = [package_from_record(record, PackageCard) for record in interaction["response"]["packages"]]
+        return packages, interaction["response"]["found"]
+
+    async def hybrid_search(self, query_text: str, locations: list[str] | None = None, top: int = 3, price_range=None):
+        return await self.replay_local_search("hybrid_search", query_text, locations, top, price_range)
+
+    async def bm25_search(self, query_text: str, locations: list[str] | None = None, top: int = 3, price_range=None):
+        return await self.replay_local_search("bm25_search", query_text, locations, top, price_range)
+
+    async def replay_local_search(
+        self, method: str, query_text: str, locations: list[str] | None, top: int, price_range=None
+    ):
+        request = search_request(
+            {"method": method, "query_text": query_text, "locations": locations, "top": top}, price_range
+        )
+        interaction = await self.player.next_async("db", request)
+        packages = [package_from_record(record, PackageCard) for record in interaction["response"]["packages"]]
+        return packages, interaction["response"]["found"]
@@ -0,0 +1,193 @@
+"""Drive /chat at a target request rate with a realistic conversation mix and report latency, throughput and memory.
+
+Requests are sent open-loop (on schedule, whether or not earlier ones finished), so a slow server shows up as
+rising latency and errors instead of a lower request rate. Per-worker memory is sampled from the gunicorn master's
+children once a second.
+
+Start the stubs and the app against them, then run the generator, e.g.:
+
+    python benchmarks/stub_server.py --port 9000 --urls urls.txt &
+    python benchmarks/loadgen.py --spawn --rps 20 --duration 60
+
+--spawn starts the app under gunicorn with src/gunicorn.conf.py, pointed at the stub server. Without it, pass the
+running app with --url and its gunicorn master with --gunicorn-pid.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import aiohttp
+import psutil
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+# Weighted mix of single-turn conversations covering the intent routes
+DEFAULT_MIX = [
+    {"name": "welcome", "weight": 10, "messages": [{"role": "user", "content": "สวัสดีค่ะ"}]},
+    {"name": "search", "weight": 30, "messages": [{"role": "user", "content": "อยากทำฟันแถวลาดพร้าว"}]},
+    {"name": "search-location", "weight": 20, "messages": [{"role": "user", "content": "ตรวจสุขภาพแถวรังสิต"}]},
+    {"name": "installments", "weight": 5, "messages": [{"role": "user", "content": "ผ่อนได้ไหมคะ"}]},
+    {"name": "coupon", "weight": 5, "messages": [{"role": "user", "content": "ใช้คูปองยังไง"}]},
+    {"name": "booking", "weight": 5, "messages": [{"role": "user", "content": "อยากเลื่อนนัดที่จองไว้"}]},
+    {"name": "generic", "weight": 10, "messages": [{"role": "user", "content": "โอเคค่ะ ขอบคุณค่ะ"}]},
+    {"name": "buy", "weight": 5, "messages": [{"role": "user", "content": "สนใจซื้อแพ็กเกจนี้ค่ะ"}]},
+    {"name": "payment", "weight": 10, "messages": [{"role": "user", "content": "ชำระเงินที่โรงพยาบาลได้ไหม"}]},
+]
+
+
+def spawn_app(port: int, workers: int | None, stub_url: str) -> subprocess.Popen:
+    env = os.environ | {
+        "OPENAI_CHAT_HOST": "openai",
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "OPENAICOM_KEY": "stub",
+        "OPENAICOM_CHAT_MODEL": os.getenv("OPENAICOM_CHAT_MODEL", "gpt-4o"),
+        "GOOGLE_SEARCH_ENDPOINT": f"{stub_url}/customsearch/v1",
+        "GOOGLE_SEARCH_API_KEY": "stub",
+        "GOOGLE_SEARCH_ENGINE_ID": "stub",
+        "APPS_SCRIPT_URL": f"{stub_url}/apps-script/exec",
+        "CHAT_CONTEXT_VERBOSITY": os.getenv("CHAT_CONTEXT_VERBOSITY", "none"),
+    }
+    command = [sys.executable, "-m", "gunicorn", "fastapi_app:create_app()", "-c", "gunicorn.conf.py"]
+    command += ["--bind", f"127.0.0.1:{port}"]
+    if workers:
+        command += ["--workers", str(workers)]
+    return subprocess.Popen(command, cwd=SRC_DIR, env=env)
+
+
+async def wait_until_ready(session: aiohttp.ClientSession, url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{url}/metrics") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"{url} did not become ready within {timeout}s")
+
+
+async def send_chat(session: aiohttp.ClientSession, url: str, conversation: dict, results: list) -> None:
+    start = time.perf_counter()
+    try:
+        async with session.post(f"{url}/chat", json={"messages": conversation["messages"]}) as response:
+            await response.read()
+            status = response.status
+    except (TimeoutError, aiohttp.ClientError) as e:
+        status = type(e).__name__
+    results.append((conversation["name"], status, time.perf_counter() - start))
+
+
+async def sample_memory(master_pid: int | None, samples: dict, stop: asyncio.Event) -> None:
+    if master_pid is None:
+        return
+    master = psutil.Process(master_pid)
+    while not stop.is_set():
+        for worker in master.children():
+            try:
+                samples[worker.pid].append(worker.memory_info().rss)
+            except psutil.NoSuchProcess:
+                pass
+        await asyncio.sleep(1)
+
+
+async def run_load(args, mix: list[dict], master_pid: int | None) -> tuple[list, dict, float]:
+    results: list = []
+    memory: dict[int, list[int]] = defaultdict(list)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.max_connections)
+    weights = [conversation.get("weight", 1) for conversation in mix]
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        await wait_until_ready(session, args.url)
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_memory(master_pid, memory, stop))
+        tasks = []
+        start = time.perf_counter()
+        total_requests = int(args.rps * args.duration)
+        for index in range(total_requests):
+            # Poisson arrivals at the target rate would be burstier; a fixed schedule keeps runs comparable
+            delay = start + index / args.rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            conversation = random.choices(mix, weights=weights)[0]
+            tasks.append(asyncio.create_task(send_chat(session, args.url, conversation, results)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await sampler
+    return results, memory, elapsed
+
+
+def percentile(values: list[float], q: int) -> float:
+    if not values:
+        return float("nan")
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def report(results: list, memory: dict, elapsed: float) -> None:
+    latencies = [latency * 1000 for _, status, latency in results if status == 200]
+    errors = Counter(status for _, status, _ in results if status != 200)
+    print(f"requests      {len(results)} in {elapsed:.1f}s")
+    print(f"throughput    {len(latencies) / elapsed:.2f} successful req/s")
+    print(f"error rate    {sum(errors.values()) / max(len(results), 1):.2%} {dict(errors) if errors else ''}")
+    print(
+        f"latency ms    p50 {percentile(latencies, 50):.0f}  p95 {percentile(latencies, 95):.0f}  "
+        f"p99 {percentile(latencies, 99):.0f}"
+    )
+    by_name = defaultdict(list)
+    for name, status, latency in results:
+        if status == 200:
+            by_name[name].append(latency * 1000)
+    for name, values in sorted(by_name.items()):
+        print(f"  {name:<20}n {len(values):>5}  p50 {percentile(values, 50):>7.0f}  p95 {percentile(values, 95):>7.0f}")
+    if memory:
+        print("worker memory (RSS MiB, start -> max)")
+        for pid, rss in sorted(memory.items()):
+            print(f"  pid {pid:<10}{rss[0] / 2**20:>8.1f} -> {max(rss) / 2**20:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /chat at a target request rate")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the app")
+    parser.add_argument("--rps", type=float, default=10, help="Target requests per second")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to send requests for")
+    parser.add_argument("--mix", type=Path, help="JSON list of {name, weight, messages}; defaults to a built-in mix")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--gunicorn-pid", type=int, help="PID of the gunicorn master, to sample worker memory")
+    parser.add_argument("--spawn", action="store_true", help="Start the app under gunicorn against the stub server")
+    parser.add_argument("--stub-url", default="http://127.0.0.1:9000", help="Stub server for --spawn")
+    parser.add_argument("--workers", type=int, help="Gunicorn workers for --spawn (default: gunicorn.conf.py)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    mix = json.loads(args.mix.read_text(encoding="utf-8")) if args.mix else DEFAULT_MIX
+    app_process = None
+    master_pid = args.gunicorn_pid
+    if args.spawn:
+        port = int(args.url.rsplit(":", 1)[1])
+        app_process = spawn_app(port, args.workers, args.stub_url)
+        master_pid = app_process.pid
+    try:
+        results, memory, elapsed = asyncio.run(run_load(args, mix, master_pid))
+    finally:
+        if app_process:
+            app_process.terminate()
+            app_process.wait()
+    report(results, memory, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Record cassettes of real conversations against the live OpenAI, Google, Apps Script and Postgres services.
+
+The conversations file is a JSON list of {"name": ..., "messages": [...]}, with messages as sent to /chat.
+Each conversation turn is written to <output-dir>/<name>.json.
+
+    python benchmarks/record_cassettes.py conversations.json --output-dir benchmarks/cassettes
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import logging
+from pathlib import Path
+
+from cassette import Cassette, RecordingAppsScriptClient, RecordingOpenAIClient, RecordingSearcher
+from dotenv import load_dotenv
+
+from fastapi_app.apps_script import AppsScriptClient
+from fastapi_app.google_search import default_client
+from fastapi_app.openai_clients import create_openai_chat_client, create_openai_embed_client
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.postgres_searcher import RETRIEVAL_MODES, PostgresSearcher
+from fastapi_app.rag_advanced import AdvancedRAGChat
+
+logger = logging.getLogger("ragapp")
+
+
+async def record(conversations: list[dict], output_dir: Path, retrieval_mode: str) -> None:
+    engine = await create_postgres_engine_from_env()
+    openai_chat_client, openai_chat_model = await create_openai_chat_client(None)
+    apps_script_client = AppsScriptClient()
+    searcher_kwargs = {"retrieval_mode": retrieval_mode}
+    if retrieval_mode == "hybrid":
+        openai_embed_client, embed_model, embed_dimensions = await create_openai_embed_client(None)
+        searcher_kwargs |= {
+            "openai_embed_client": openai_embed_client,
+            "embed_model": embed_model,
+            "embed_dimensions": embed_dimensions,
+        }
+
+    for conversation in conversations:
+        cassette = Cassette(conversation["name"], copy.deepcopy(conversation["messages"]))
+        ragchat = AdvancedRAGChat(
+            searcher=RecordingSearcher(PostgresSearcher(engine, **searcher_kwargs), cassette),
+            openai_chat_client=RecordingOpenAIClient(openai_chat_client, cassette),
+            chat_model=openai_chat_model,
+            chat_deployment=None,
+            apps_script_client=RecordingAppsScriptClient(apps_script_client, cassette),
+        )
+        await ragchat.run(copy.deepcopy(conversation["messages"]))
+        cassette.route = ragchat.route
+        cassette.save(output_dir / f"{conversation['name']}.json")
+        logger.info("Recorded %s (%s, %d interactions)", cassette.name, cassette.route, len(cassette.interactions))
+
+    await engine.dispose()
+    await default_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record cassettes of conversations against live services")
+    parser.add_argument("conversations", type=Path, help="JSON list of {name, messages}")
+    parser.add_argument("--output-dir", type=Path, default=Path(__file__).parent / "cassettes")
+    parser.add_argument("--retrieval-mode", choices=RETRIEVAL_MODES, default="google")
+    args = parser.parse_args()
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    conversations = json.loads(args.conversations.read_text(encoding="utf-8"))
+    asyncio.run(record(conversations, args.output_dir, args.retrieval_mode))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    load_dotenv(override=True)
+    main()
@@ -0,0 +1,252 @@
+"""Local stand-ins for OpenAI, Google Custom Search and the Apps Script, for load testing /chat offline.
+
+One server exposes all three:
+
+* POST /v1/chat/completions: OpenAI-compatible. Picks the tool call the router would (specify_package,
+  search_google, welcome_intent, ...) from keywords in the last user message, and answers in text otherwise.
+  Honors stream=true with server-sent events.
+* GET /customsearch/v1: Google Custom Search. Returns links from --urls (one URL per line, e.g. exported from
+  packages_all) so the app finds the packages in its database.
+* POST /apps-script/exec: the Apps Script `info` actions used by the app.
+
+Latencies are drawn per call from a distribution: "none", "fixed:S", "uniform:LO,HI" or "lognormal:MEDIAN,SIGMA".
+
+    python benchmarks/stub_server.py --port 9000 --urls urls.txt --openai-latency lognormal:0.8,0.5
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+from pathlib import Path
+
+import fastapi
+import uvicorn
+from fastapi.responses import JSONResponse, StreamingResponse
+
+THAI_ANSWER = (
+    "แนะนำแพ็กเกจนี้ค่ะ ราคารวมค่าแพทย์และค่าบริการโรงพยาบาลแล้ว สามารถเลือกวันและเวลาเข้ารับบริการได้ตามสะดวก "
+    "หากต้องการสอบถามเพิ่มเติม แจ้งแอดมินได้เลยนะคะ "
+)
+LOCATIONS = ["รังสิต", "ธัญบุรี", "ปทุมธานี", "บางนา", "สีลม", "ลาดพร้าว", "นนทบุรี", "เชียงใหม่"]
+URL_PATTERN = re.compile(r"https://hdmall\.co\.th/[^\s]+")
+
+# (keywords, tool) in priority order for the router completion
+ROUTER_RULES = [
+    (("สวัสดี", "hello", "hi "), "welcome_intent"),
+    (("จอง", "เลื่อนนัด", "booking"), "handover_to_bk"),
+    (("ผ่อน", "installment"), "installments_query"),
+    (("คูปอง", "coupon"), "coupon"),
+    (("โปรบัตร", "บัตรเครดิต", "credit card"), "payment_promo"),
+    (("จ่ายเงิน", "ชำระ", "pay "), "payment_query"),
+    (("ร้านยา", "ซื้อยา", "pharmacy"), "pharmacy"),
+    (("ซื้อ", "สนใจซื้อ", "buy"), "handover_to_cx"),
+    (("ขอบคุณ", "โอเค", "thank"), "generic_query"),
+]
+
+
+class Latency:
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(":")
+        values = [float(value) for value in params.split(",") if value]
+        if kind not in ("none", "fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution {spec!r}")
+        self.kind, self.values = kind, values
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.values[0]
+        if self.kind == "uniform":
+            return random.uniform(self.values[0], self.values[1])
+        if self.kind == "lognormal":
+            median, sigma = self.values
+            return random.lognormvariate(math.log(median), sigma)
+        return 0.0
+
+    async def wait(self) -> None:
+        if delay := self.sample():
+            await asyncio.sleep(delay)
+
+
+def last_user_text(messages: list[dict]) -> str:
+    for message in reversed(messages):
+        if message.get("role") != "user":
+            continue
+        content = message.get("content")
+        if isinstance(content, str):
+            return content
+        # The app appends sources and instructions to the last message, the user's own text comes first
+        return content[0].get("text", "") if content else ""
+    return ""
+
+
+def count_tokens(messages: list[dict]) -> int:
+    # Thai averages roughly one token per three characters
+    return max(len(json.dumps(messages, ensure_ascii=False)) // 3, 1)
+
+
+def choose_tool_call(text: str, tools: list[dict], tool_choice) -> tuple[str, dict] | None:
+    tool_names = {tool["function"]["name"] for tool in tools}
+    if isinstance(tool_choice, dict):
+        forced = tool_choice["function"]["name"]
+    elif "check_info_gathered" in tool_names:
+        forced = "check_info_gathered"
+    else:
+        forced = None
+
+    if forced == "search_google":
+        locations = [location for location in LOCATIONS if location in text]
+        query = URL_PATTERN.sub("", text)
+        for location in locations:
+            query = query.replace(location, "")
+        return "search_google", {"search_query": query.strip()[:40], "locations": locations}
+    if forced == "check_info_gathered":
+        if any(location in text for location in LOCATIONS):
+            location = next(location for location in LOCATIONS if location in text)
+            return "check_info_gathered", {"package_name": text[:30], "location": location}
+        return None
+    if forced:
+        return forced, {}
+
+    lowered = text.lower()
+    if (match := URL_PATTERN.search(text)) and "specify_package" in tool_names:
+        return "specify_package", {"url": match.group(0)}
+    for keywords, tool in ROUTER_RULES:
+        if tool in tool_names and any(keyword in lowered for keyword in keywords):
+            return tool, {}
+    return None
+
+
+def build_completion(request: dict) -> tuple[dict, str | None]:
+    messages = request.get("messages", [])
+    tool_call = choose_tool_call(last_user_text(messages), request.get("tools") or [], request.get("tool_choice"))
+    message = {"role": "assistant", "content": None}
+    if tool_call:
+        name, arguments = tool_call
+        message["tool_calls"] = [
+            {
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "type": "function",
+                "function": {"name": name, "arguments": json.dumps(arguments, ensure_ascii=False)},
+            }
+        ]
+        finish_reason = "tool_calls"
+    else:
+        message["content"] = THAI_ANSWER * random.randint(1, 4)
+        finish_reason = "stop"
+
+    prompt_tokens = count_tokens(messages)
+    completion_tokens = count_tokens([message])
+    completion = {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model") or "gpt-4o",
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+    return completion, message["content"]
+
+
+async def stream_completion(completion: dict, content: str | None, latency: Latency):
+    base = {key: completion[key] for key in ("id", "created", "model")} | {"object": "chat.completion.chunk"}
+    message = completion["choices"][0]["message"]
+    if content is None:
+        deltas = [{"role": "assistant", "content": None, "tool_calls": [{"index": 0, **message["tool_calls"][0]}]}]
+    else:
+        words = content.split(" ")
+        deltas = [{"role": "assistant", "content": ""}] + [{"content": word + " "} for word in words]
+    for delta in deltas:
+        chunk = base | {"choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        # Spread a fraction of the latency over the tokens, like a real stream
+        await asyncio.sleep(latency.sample() / 50)
+    finish_reason = completion["choices"][0]["finish_reason"]
+    chunk = base | {"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}
+    yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def create_stub_app(
+    urls: list[str], openai_latency: Latency, search_latency: Latency, apps_script_latency: Latency
+) -> fastapi.FastAPI:
+    app = fastapi.FastAPI()
+
+    @app.post("/v1/chat/completions")
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(request: fastapi.Request):
+        body = await request.json()
+        completion, content = build_completion(body)
+        if body.get("stream"):
+            return StreamingResponse(
+                stream_completion(completion, content, openai_latency), media_type="text/event-stream"
+            )
+        await openai_latency.wait()
+        return JSONResponse(completion)
+
+    @app.get("/customsearch/v1")
+    async def custom_search(q: str = "", exactTerms: str | None = None):  # noqa: N803
+        await search_latency.wait()
+        if not urls:
+            return {"items": []}
+        # The same query always returns the same links, like the real index
+        seed = int(hashlib.sha1(f"{q}|{exactTerms}".encode()).hexdigest(), 16)
+        start = seed % len(urls)
+        links = [urls[(start + offset) % len(urls)] for offset in range(min(10, len(urls)))]
+        return {"items": [{"link": link, "title": link} for link in links]}
+
+    @app.post("/apps-script/exec")
+    async def apps_script(request: fastapi.Request):
+        body = await request.json()
+        await apps_script_latency.wait()
+        info = body.get("info")
+        if info == "credit_card":
+            return [
+                {
+                    "promoName": "ผ่อน 0% 10 เดือน",
+                    "type": "installment",
+                    "keyBenefit": "0%",
+                    "url": "https://hdmall.co.th",
+                }
+            ]
+        if info == "highlight_tags":
+            return {"highlightTags": ["ตรวจสุขภาพ", "ทำฟัน", "ฉีดวัคซีน", "ทำเลสิก"]}
+        if info == "highlight":
+            return {"name": body.get("highlight_name"), "content": "โปรโมชั่นพิเศษประจำเดือน ลดสูงสุด 50%"}
+        if info == "payment_method":
+            return {"paymentMethod": "บัตรเครดิต, PromptPay, โอนผ่านธนาคาร"}
+        if info == "discount":
+            return 100 if hashlib.sha1(str(body.get("package_url")).encode()).digest()[0] % 2 else ""
+        return JSONResponse({"error": f"Unknown info {info}"}, status_code=400)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run stub OpenAI, Google Custom Search and Apps Script servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--urls", type=Path, help="File with one package URL per line, returned by the search stub")
+    parser.add_argument("--openai-latency", default="lognormal:0.8,0.4")
+    parser.add_argument("--search-latency", default="lognormal:0.4,0.3")
+    parser.add_argument("--apps-script-latency", default="lognormal:0.6,0.3")
+    args = parser.parse_args()
+
+    urls = [line.strip() for line in args.urls.read_text().splitlines() if line.strip()] if args.urls else []
+    app = create_stub_app(
+        urls, Latency(args.openai_latency), Latency(args.search_latency), Latency(args.apps_script_latency)
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import asyncio
 import contextlib
 import logging
 import os
@@ -9,9 +10,24 @@ from dotenv import load_dotenv
 from environs import Env
 from opentelemetry.instrumentation.sqlalchemy import SQLAlchemyInstrumentor
 
+from .apps_script import APPS_SCRIPT_URL, AppsScriptClient
+from .bm25_index import build_index_from_db, keep_index_fresh
+from .catalog import CatalogSnapshot, keep_snapshot_fresh, update_snapshot_age
+from .category_index import build_category_index_from_db, keep_category_index_fresh
+from .circuit_breaker import configure_breakers
+from .compression import CompressionMiddleware
+from .gazetteer import LOCATION_EXPANSIONS, get_gazetteer
 from .globals import global_storage
-from .openai_clients import create_openai_chat_client
+from .google_quota import GoogleQuota
+from .google_search import GoogleSearchClient, SearchResultCache
+from .highlight_campaigns import keep_highlights_fresh, load_highlight_index
+from .metrics import monitor_event_loop
+from .openai_clients import create_openai_chat_client, create_openai_embed_client
+from .payment_sync import keep_payment_data_fresh
 from .postgres_engine import create_postgres_engine_from_env
+from .postgres_searcher import RETRIEVAL_FALLBACKS, RETRIEVAL_MODES, SQL_SEARCH_MODES
+from .shared_catalog import SharedCatalog
+from .trace_store import create_trace_store_from_env
 
 logger = logging.getLogger("ragapp")
 
@@ -35,17 +51,106 @@ async def lifespan(app: fastapi.FastAPI):
     except Exception as e:
         logger.warning("Failed to authenticate to Azure: %s", e)
 
+    configure_breakers(
+        failure_threshold=int(os.getenv("CIRCUIT_BREAKER_FAILURES", "5")),
+        reset_timeout=float(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", "30")),
+    )
     engine = await create_postgres_engine_from_env(azure_credential)
     global_storage.engine = engine
+    global_storage.trace_store = create_trace_store_from_env(engine)
+    global_storage.apps_script_client = AppsScriptClient(
+        url=os.getenv("APPS_SCRIPT_URL", APPS_SCRIPT_URL),
+        timeout=float(os.getenv("APPS_SCRIPT_TIMEOUT_SECONDS", "15")),
+    )
+    global_storage.google_search_client = GoogleSearchClient(
+        timeout=float(os.getenv("GOOGLE_SEARCH_TIMEOUT_SECONDS", "5")),
+        cache=SearchResultCache.from_env(),
+        quota=GoogleQuota.from_env(engine),
+    )
 
     openai_chat_client, openai_chat_model = await create_openai_chat_client(azure_credential)
     global_storage.openai_chat_client = openai_chat_client
     global_storage.openai_chat_model = openai_chat_model
 
+    global_storage.retrieval_mode = os.getenv("RETRIEVAL_MODE", "google")
+    if global_storage.retrieval_mode not in RETRIEVAL_MODES:
+        raise ValueError(f"RETRIEVAL_MODE must be one of {RETRIEVAL_MODES}")
+    if global_storage.retrieval_mode == "hybrid":
+        openai_embed_client, openai_embed_model, openai_embed_dimensions = await create_openai_embed_client(
+            azure_credential
+        )
+        global_storage.openai_embed_client = openai_embed_client
+        global_storage.openai_embed_model = openai_embed_model
+        global_storage.openai_embed_dimensions = openai_embed_dimensions
+        if os.getenv("OPENAI_EMBED_HOST") == "azure":
+            global_storage.openai_embed_deployment = os.getenv("AZURE_OPENAI_EMBED_DEPLOYMENT")
+
+    global_storage.retrieval_fallback = os.getenv("RETRIEVAL_FALLBACK", "none")
+    if global_storage.retrieval_fallback not in RETRIEVAL_FALLBACKS:
+        raise ValueError(f"RETRIEVAL_FALLBACK must be one of {RETRIEVAL_FALLBACKS}")
+    if global_storage.google_search_client.quota is not None and global_storage.retrieval_fallback == "none":
+        # Searches over the Google budget go to the local catalog instead
+        logger.info("GOOGLE_SEARCH_DAILY_QUOTA is set, falling back to BM25 searches over it")
+        global_storage.retrieval_fallback = "bm25"
+    global_storage.sql_search_mode = os.getenv("SQL_SEARCH_MODE", "like")
+    if global_storage.sql_search_mode not in SQL_SEARCH_MODES:
+        raise ValueError(f"SQL_SEARCH_MODE must be one of {SQL_SEARCH_MODES}")
+    global_storage.section_token_budget = int(os.getenv("CONTEXT_SECTION_TOKEN_BUDGET", "0"))
+    global_storage.location_expansion = os.getenv("LOCATION_EXPANSION", "llm")
+    if global_storage.location_expansion not in LOCATION_EXPANSIONS:
+        raise ValueError(f"LOCATION_EXPANSION must be one of {LOCATION_EXPANSIONS}")
+    if global_storage.location_expansion == "gazetteer":
+        # Load it before the first request rather than during it
+        get_gazetteer()
+    global_storage.price_filter = os.getenv("PRICE_FILTER", "false").lower() == "true"
+    background_tasks = []
+    catalog_snapshot_mode = os.getenv("CATALOG_SNAPSHOT", "false").lower()
+    if catalog_snapshot_mode in ("true", "shared"):
+        # Serve package lookups from memory, kept up to date by Postgres notifications. "shared" maps one
+        # catalog file into every worker instead of each worker keeping its own copy.
+        global_storage.catalog_snapshot = SharedCatalog() if catalog_snapshot_mode == "shared" else CatalogSnapshot()
+        await global_storage.catalog_snapshot.load(engine)
+        check_interval = float(os.getenv("CATALOG_VERSION_CHECK_SECONDS", "60"))
+        background_tasks.append(
+            asyncio.create_task(keep_snapshot_fresh(engine, global_storage.catalog_snapshot, check_interval))
+        )
+        background_tasks.append(asyncio.create_task(update_snapshot_age(global_storage.catalog_snapshot)))
+    if "bm25" in (global_storage.retrieval_mode, global_storage.retrieval_fallback):
+        global_storage.bm25_index = await build_index_from_db(engine)
+        refresh_interval = float(os.getenv("BM25_REFRESH_SECONDS", "600"))
+        background_tasks.append(asyncio.create_task(keep_index_fresh(engine, global_storage, refresh_interval)))
+    if os.getenv("CATEGORY_INDEX", "false").lower() == "true":
+        global_storage.category_index = await build_category_index_from_db(engine)
+        refresh_interval = float(os.getenv("CATEGORY_INDEX_REFRESH_SECONDS", "600"))
+        background_tasks.append(
+            asyncio.create_task(keep_category_index_fresh(engine, global_storage, refresh_interval))
+        )
+    if os.getenv("HIGHLIGHT_SYNC", "false").lower() == "true":
+        # Until the first sync, highlights keep coming from the Apps Script
+        global_storage.highlight_index = await load_highlight_index(engine)
+        sync_interval = float(os.getenv("HIGHLIGHT_SYNC_SECONDS", "3600"))
+        background_tasks.append(
+            asyncio.create_task(
+                keep_highlights_fresh(engine, global_storage, global_storage.apps_script_client, sync_interval)
+            )
+        )
+    if os.getenv("PAYMENT_SYNC", "false").lower() == "true":
+        sync_interval = float(os.getenv("PAYMENT_SYNC_SECONDS", "3600"))
+        # Past two sync intervals a sync was missed, and the Apps Script is called instead
+        global_storage.payment_max_age = 2 * sync_interval
+        background_tasks.append(
+            asyncio.create_task(keep_payment_data_fresh(engine, global_storage.apps_script_client, sync_interval))
+        )
+
     if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
         SQLAlchemyInstrumentor().instrument(engine=engine.sync_engine)
+
+    background_tasks.append(asyncio.create_task(monitor_event_loop(engine)))
     yield
 
+    for task in background_tasks:
+        task.cancel()
+    await global_storage.google_search_client.close()
     await engine.dispose()
 
 
@@ -66,6 +171,7 @@ def create_app():
         configure_azure_monitor(logger_name="ragapp")
 
     app = fastapi.FastAPI(docs_url="/docs", lifespan=lifespan)
+    app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024")))
 
     from . import api_routes  # noqa
     from . import frontend_routes  # noqa
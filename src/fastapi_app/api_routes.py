@@ -1,41 +1,94 @@
+import os
+import time
+
 import fastapi
-from sqlalchemy import select
 from sqlalchemy.ext.asyncio import async_sessionmaker
 
 from fastapi_app.api_models import ChatRequest
+from fastapi_app.circuit_breaker import CircuitOpenError, health
 from fastapi_app.globals import global_storage
-from fastapi_app.postgres_models import Package
+from fastapi_app.metrics import CHAT_REQUEST_LATENCY, ROUTE_REQUESTS, render_metrics
+from fastapi_app.package_repository import PackageRepository
 from fastapi_app.postgres_searcher import PostgresSearcher
 from fastapi_app.rag_advanced import AdvancedRAGChat
+from fastapi_app.responses import ORJSONResponse
+from fastapi_app.trace_store import CONTEXT_VERBOSITY_LEVELS, shape_context
+from fastapi_app.usage import usage_ledger
 from fastapi_app.utils import remove_markdown_elements, update_urls_with_utm
 
 router = fastapi.APIRouter()
 
 
-@router.get("/packages/{url}")
+@router.get("/packages/{url}", response_class=ORJSONResponse)
 async def package_handler(url: str):
     """A simple API to get an package by URL."""
-    async_session_maker = async_sessionmaker(global_storage.engine, expire_on_commit=False)
-    async with async_session_maker() as session:
-        package = (await session.scalars(select(Package).where(Package.url == url))).first()
-        return package.to_dict()
+    repository = PackageRepository(
+        async_sessionmaker(global_storage.engine, expire_on_commit=False), snapshot=global_storage.catalog_snapshot
+    )
+    # Also finds the package when the URL has UTM parameters, a trailing slash or http
+    package = await repository.get(url)
+    if package is None:
+        raise fastapi.HTTPException(status_code=404, detail="Package not found")
+    return ORJSONResponse(package.to_dict())
 
 
-@router.post("/chat")
+@router.post("/chat", response_class=ORJSONResponse)
 async def chat_handler(chat_request: ChatRequest):
     """API to chat with the RAG model."""
     messages = [message.model_dump() for message in chat_request.messages]
 
-    searcher = PostgresSearcher(global_storage.engine)
+    # How much of the pipeline trace to send back: none, summary or full (retrievable later via /traces)
+    context_verbosity = chat_request.context.get("overrides", {}).get("context_verbosity") or os.getenv(
+        "CHAT_CONTEXT_VERBOSITY", "full"
+    )
+    if context_verbosity not in CONTEXT_VERBOSITY_LEVELS:
+        raise fastapi.HTTPException(
+            status_code=400, detail=f"context_verbosity must be one of {CONTEXT_VERBOSITY_LEVELS}"
+        )
+
+    searcher = PostgresSearcher(
+        global_storage.engine,
+        search_function=global_storage.google_search_client.search,
+        retrieval_mode=global_storage.retrieval_mode,
+        openai_embed_client=global_storage.openai_embed_client,
+        embed_model=global_storage.openai_embed_model,
+        embed_deployment=global_storage.openai_embed_deployment,
+        embed_dimensions=global_storage.openai_embed_dimensions,
+        bm25_index=global_storage.bm25_index,
+        fallback_mode=global_storage.retrieval_fallback,
+        catalog_snapshot=global_storage.catalog_snapshot,
+        sql_search_mode=global_storage.sql_search_mode,
+        detail_fields=bool(global_storage.section_token_budget),
+        google_quota=global_storage.google_search_client.quota,
+    )
 
     ragchat = AdvancedRAGChat(
         searcher=searcher,
         openai_chat_client=global_storage.openai_chat_client,
         chat_model=global_storage.openai_chat_model,
         chat_deployment=global_storage.openai_chat_deployment,
+        apps_script_client=global_storage.apps_script_client,
+        section_token_budget=global_storage.section_token_budget,
+        location_expansion=global_storage.location_expansion,
+        price_filter=global_storage.price_filter,
+        category_index=global_storage.category_index,
+        highlight_index=global_storage.highlight_index,
+        payment_max_age=global_storage.payment_max_age,
     )
 
-    chat_resp = await ragchat.run(messages)
+    start = time.perf_counter()
+    route = "error"
+    try:
+        chat_resp = await ragchat.run(messages)
+        route = ragchat.route
+    except CircuitOpenError as e:
+        # OpenAI is down for this worker, tell the client when to retry rather than time out
+        raise fastapi.HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": str(max(int(e.retry_in), 1))}
+        ) from e
+    finally:
+        ROUTE_REQUESTS.labels(route).inc()
+        CHAT_REQUEST_LATENCY.labels(route).observe(time.perf_counter() - start)
     chat_resp_content = chat_resp["choices"][0]["message"]["content"]
 
     # Update URLs with UTM parameters
@@ -49,5 +102,53 @@ async def chat_handler(chat_request: ChatRequest):
     # Update the chat response with the modified content
     chat_resp["choices"][0]["message"]["content"] = chat_resp_content
 
+    context = chat_resp["choices"][0]["context"]
+    trace_id = global_storage.trace_store.put(route, context)
+    chat_resp["choices"][0]["context"] = shape_context(context, context_verbosity, trace_id)
+
     # Format markdown responses by removing any text wrapped in **
-    return chat_resp
+    return ORJSONResponse(chat_resp)
+
+
+@router.get("/traces/{trace_id}")
+async def trace_handler(trace_id: str):
+    """Full context of a recent /chat response, by the trace id returned in its context."""
+    trace = await global_storage.trace_store.get(trace_id)
+    if trace is None:
+        raise fastapi.HTTPException(status_code=404, detail="Trace not found")
+    return trace
+
+
+@router.get("/metrics")
+async def metrics_handler():
+    """Prometheus scrape endpoint, aggregated across all gunicorn workers."""
+    content, content_type = render_metrics()
+    return fastapi.Response(content=content, media_type=content_type)
+
+
+@router.get("/health")
+async def health_handler():
+    """Circuit breaker state of the external dependencies of this worker, "degraded" while any is not closed,
+    and the Google search budget spent today when there is one."""
+    status = health()
+    if (quota := global_storage.google_search_client.quota) is not None:
+        try:
+            status["google_quota"] = await quota.status()
+        except Exception as e:
+            status["google_quota"] = {"error": str(e)}
+    return status
+
+
+@router.get("/usage")
+async def usage_handler():
+    """Rolling token usage, estimated cost and latency per route and stage for this worker."""
+    return usage_ledger.summary()
+
+
+@router.get("/categories", response_class=ORJSONResponse)
+async def categories_handler():
+    """Package count and search URL of every category, largest first, when the category index is enabled."""
+    if global_storage.category_index is None:
+        raise fastapi.HTTPException(status_code=404, detail="The category index is not enabled")
+    facets = sorted(global_storage.category_index.facets.values(), key=lambda facet: -facet.package_count)
+    return ORJSONResponse([facet.to_dict() for facet in facets])
@@ -0,0 +1,85 @@
+import logging
+import threading
+from collections import OrderedDict
+
+import requests
+
+from fastapi_app.circuit_breaker import CircuitOpenError, get_breaker
+from fastapi_app.metrics import observe_stage, record_external_error
+
+logger = logging.getLogger("ragapp")
+
+APPS_SCRIPT_URL = (
+    "https://script.google.com/macros/s/AKfycbw18wXh1o6xiD2WY3wcvkQXGZNn4AY2loJjdEqfBGC22xtluoz27L7VeiAyrcMRsFf6fw/exec"
+)
+
+
+class AppsScriptUnavailable(CircuitOpenError, requests.exceptions.RequestException):
+    """The Apps Script circuit is open and there is no earlier answer to the call, handled as a request error."""
+
+
+class AppsScriptClient:
+    """Client for the Google Apps Script serving promos, highlight campaigns, payment methods and discounts.
+
+    The last answer to each call is kept, and served instead when the Apps Script fails or its circuit is open."""
+
+    def __init__(self, url: str = APPS_SCRIPT_URL, max_last_answers: int = 1024, timeout: float = 15):
+        self.url = url
+        # Seconds to connect and then to wait between bytes of the answer, a hung call would hold its thread
+        self.timeout = timeout
+        # Reuse connections across calls instead of a new TLS handshake per request
+        self.session = requests.Session()
+        self.breaker = get_breaker("apps_script")
+        self.last_answers: OrderedDict[tuple[str, str, str, str], object] = OrderedDict()
+        self.max_last_answers = max_last_answers
+        # Calls also run in threads, e.g. during the catalog syncs
+        self.lock = threading.Lock()
+
+    def last_answer(self, key: tuple[str, str, str, str], error: requests.exceptions.RequestException):
+        with self.lock:
+            answer = self.last_answers.get(key, error)
+        if answer is error:
+            raise error
+        logger.info("Serving the last %s answer of the Apps Script: %s", key[0], error)
+        return answer
+
+    def call(
+        self,
+        info: str,
+        highlight_name: str = "",
+        highlight_url: str = "",
+        package_url: str = "",
+        use_last_answer: bool = True,
+    ):
+        """The answer of the Apps Script. Without use_last_answer, failures are raised rather than served from
+        the last answers, e.g. for syncs that must not store stale data as fresh."""
+        body = {
+            "info": info,
+            "highlight_name": highlight_name,
+            "highlight_url": highlight_url,
+            "package_url": package_url,
+        }
+        key = (info, highlight_name, highlight_url, package_url)
+        if not self.breaker.allow():
+            error = AppsScriptUnavailable("apps_script", self.breaker.retry_in())
+            if not use_last_answer:
+                raise error
+            return self.last_answer(key, error)
+        try:
+            with observe_stage(f"apps_script_{info}"):
+                res = self.session.post(url=self.url, json=body, timeout=self.timeout)
+            res.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            record_external_error("apps_script")
+            self.breaker.record_failure()
+            if not use_last_answer:
+                raise
+            return self.last_answer(key, e)
+        self.breaker.record_success()
+        answer = res.json()
+        with self.lock:
+            self.last_answers[key] = answer
+            self.last_answers.move_to_end(key)
+            while len(self.last_answers) > self.max_last_answers:
+                self.last_answers.popitem(last=False)
+        return answer
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import math
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+from sqlalchemy import text
+
+from fastapi_app.price_filter import PriceRange
+
+logger = logging.getLogger("ragapp")
+
+# Thai is written without spaces between words, so Thai runs are indexed as overlapping character bi- and
+# trigrams, which match any word of the query without a dictionary. Latin words and numbers are kept whole.
+TOKEN_PATTERN = re.compile(r"[\u0e00-\u0e7f]+|[a-z0-9]+")
+THAI_NGRAM_SIZES = (2, 3)
+
+# Weight of each indexed column in the term frequency of a package
+FIELD_WEIGHTS = {
+    "package_name": 3.0,
+    "category": 2.0,
+    "shop_name": 1.5,
+    "locations": 1.0,
+    "hdcare_summary": 0.5,
+}
+
+CATALOG_QUERY = text(f"SELECT url, price, {', '.join(FIELD_WEIGHTS)} FROM packages_all ORDER BY url")
+CATALOG_FINGERPRINT_QUERY = text(
+    f"SELECT md5(string_agg(md5(concat_ws('|', url, price, {', '.join(FIELD_WEIGHTS)})), '' ORDER BY url)) "
+    "FROM packages_all"
+)
+
+
+def tokenize(value: str | None) -> list[str]:
+    if not value:
+        return []
+    tokens = []
+    for run in TOKEN_PATTERN.findall(value.lower()):
+        if run[0] < "\u0e00":
+            tokens.append(run)
+        elif len(run) <= min(THAI_NGRAM_SIZES):
+            tokens.append(run)
+        else:
+            for size in THAI_NGRAM_SIZES:
+                tokens.extend(run[i : i + size] for i in range(len(run) - size + 1))
+    return tokens
+
+
+class BM25Index:
+    """In-memory BM25 index over the package catalog.
+
+    Each term maps to a pair of arrays: the ids of the packages containing it and the precomputed BM25 weight of
+    the term in each, so a query only sums a few array slices.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        locations: list[str],
+        postings: dict,
+        fingerprint: str | None = None,
+        prices: np.ndarray | None = None,
+    ):
+        self.urls = urls
+        self.locations = locations
+        # Price of each package, NaN if unknown
+        self.prices = prices if prices is not None else np.full(len(urls), np.nan, dtype=np.float32)
+        self.postings = postings
+        self.fingerprint = fingerprint
+        self.location_masks: dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    @classmethod
+    def build(cls, records: list[dict], k1: float = 1.2, b: float = 0.75, fingerprint: str | None = None):
+        term_frequencies = []
+        for record in records:
+            frequencies = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokenize(record.get(field)):
+                    frequencies[token] += weight
+            term_frequencies.append(frequencies)
+
+        lengths = np.array([sum(frequencies.values()) for frequencies in term_frequencies], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) else 0.0
+        length_norms = k1 * (1 - b + b * lengths / average_length) if average_length else np.full_like(lengths, k1)
+
+        doc_ids, frequencies_by_term = defaultdict(list), defaultdict(list)
+        for doc_id, frequencies in enumerate(term_frequencies):
+            for term, frequency in frequencies.items():
+                doc_ids[term].append(doc_id)
+                frequencies_by_term[term].append(frequency)
+
+        postings = {}
+        document_count = len(records)
+        for term, ids in doc_ids.items():
+            ids = np.array(ids, dtype=np.int32)
+            frequencies = np.array(frequencies_by_term[term], dtype=np.float32)
+            idf = math.log(1 + (document_count - len(ids) + 0.5) / (len(ids) + 0.5))
+            weights = idf * frequencies * (k1 + 1) / (frequencies + length_norms[ids])
+            postings[term] = (ids, weights.astype(np.float32))
+
+        urls = [record["url"] for record in records]
+        locations = [record.get("locations") or "" for record in records]
+        prices = np.array(
+            [np.nan if record.get("price") is None else record["price"] for record in records], dtype=np.float32
+        )
+        return cls(urls, locations, postings, fingerprint, prices)
+
+    def location_mask(self, location: str) -> np.ndarray:
+        mask = self.location_masks.get(location)
+        if mask is None:
+            mask = np.fromiter((location in locations for locations in self.locations), dtype=bool, count=len(self))
+            self.location_masks[location] = mask
+        return mask
+
+    def search(
+        self,
+        query: str,
+        locations: list[str] | None = None,
+        top: int = 10,
+        location_boost: float = 1.0,
+        price_range: PriceRange | None = None,
+    ) -> list[tuple[str, float]]:
+        """Return the (url, score) of the best matching packages, boosting packages in one of the locations and
+        leaving out the packages outside the price range."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in set(tokenize(query)):
+            if posting := self.postings.get(term):
+                ids, weights = posting
+                scores[ids] += weights
+        if locations:
+            in_location = np.zeros(len(self), dtype=bool)
+            for location in locations:
+                in_location |= self.location_mask(location)
+            scores[in_location] *= 1 + location_boost
+        if price_range is not None:
+            scores[~price_range.mask(self.prices)] = 0
+
+        matches = np.flatnonzero(scores)
+        if len(matches) > top:
+            matches = matches[np.argpartition(scores[matches], -top)[-top:]]
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+        return [(self.urls[doc_id], float(scores[doc_id])) for doc_id in matches]
+
+
+async def get_catalog_fingerprint(engine) -> str | None:
+    async with engine.connect() as conn:
+        return (await conn.execute(CATALOG_FINGERPRINT_QUERY)).scalar()
+
+
+async def build_index_from_db(engine) -> BM25Index:
+    async with engine.connect() as conn:
+        fingerprint = (await conn.execute(CATALOG_FINGERPRINT_QUERY)).scalar()
+        records = [dict(row) for row in (await conn.execute(CATALOG_QUERY)).mappings()]
+    # Building takes seconds on a large catalog, a thread lets the event loop keep serving requests meanwhile
+    index = await asyncio.to_thread(BM25Index.build, records, fingerprint=fingerprint)
+    logger.info("Built the BM25 index over %d packages with %d terms", len(index), len(index.postings))
+    return index
+
+
+async def keep_index_fresh(engine, storage, interval: float = 600) -> None:
+    """Rebuild storage.bm25_index whenever the catalog changes, checking every interval seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            fingerprint = await get_catalog_fingerprint(engine)
+            if storage.bm25_index is None or fingerprint != storage.bm25_index.fingerprint:
+                storage.bm25_index = await build_index_from_db(engine)
+        except Exception as e:
+            logger.warning("Failed to refresh the BM25 index: %s", e)
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import re
+import time
+from collections import defaultdict
+
+from prometheus_client import Gauge
+from sqlalchemy import String, any_, bindparam, select, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from fastapi_app.package_repository import normalize_package_url
+from fastapi_app.postgres_models import Package
+
+logger = logging.getLogger("ragapp")
+
+# Set up by setup_postgres_database: a trigger on packages_all bumps the version sequence and sends the URL of
+# every changed row on the channel ("*" after a TRUNCATE)
+CHANGES_CHANNEL = "packages_all_changed"
+VERSION_QUERY = text("SELECT last_value FROM packages_all_version")
+# Above this many changed rows, reloading everything is cheaper than reloading row by row
+MAX_INCREMENTAL_CHANGES = 500
+# Columns that simple_sql_search filters can be evaluated on in memory
+FILTERABLE_COLUMNS = ("url", "package_name", "category", "shop_name", "brand", "locations")
+
+CATALOG_SNAPSHOT_PACKAGES = Gauge(
+    "ragapp_catalog_snapshot_packages",
+    "Packages in the in-memory catalog snapshot",
+    multiprocess_mode="liveall",
+)
+CATALOG_SNAPSHOT_AGE = Gauge(
+    "ragapp_catalog_snapshot_age_seconds",
+    "Seconds since the catalog snapshot was last confirmed up to date",
+    multiprocess_mode="livemax",
+)
+
+
+def like_to_regex(pattern: str, ignore_case: bool) -> re.Pattern:
+    regex = "".join(".*" if char == "%" else "." if char == "_" else re.escape(char) for char in pattern)
+    return re.compile(regex, re.S | (re.I if ignore_case else 0))
+
+
+def build_predicate(column: str, operator: str, value: str):
+    if operator in ("LIKE", "ILIKE"):
+        pattern = like_to_regex(value, ignore_case=operator == "ILIKE")
+        return lambda package: pattern.fullmatch(getattr(package, column) or "") is not None
+    if operator == "=":
+        return lambda package: getattr(package, column) == value
+    return None
+
+
+def filter_packages(packages, filters: list[dict], use_or: bool = False, limit: int = 10) -> list | None:
+    """Packages matching simple_sql_search filters, or None when a filter can't be evaluated in memory. Without
+    filters nothing matches, as in simple_sql_search."""
+    if not filters:
+        return []
+    predicates = []
+    for filter in filters:
+        column, operator, value = filter["column"], filter["comparison_operator"].upper(), filter["value"]
+        predicate = build_predicate(column, operator, value) if column in FILTERABLE_COLUMNS else None
+        if predicate is None or not isinstance(value, str):
+            return None
+        predicates.append(predicate)
+    combine = any if use_or else all
+    matches = []
+    for package in packages:
+        if combine(predicate(package) for predicate in predicates):
+            matches.append(package)
+            if len(matches) == limit:
+                break
+    return matches
+
+
+class CatalogSnapshot:
+    """Every package of packages_all in memory, by URL, category and shop.
+
+    The Package objects are shared by all requests of the worker and must not be modified.
+    """
+
+    def __init__(self):
+        self.packages: dict[str, Package] = {}
+        self.by_category: dict[str, set[str]] = defaultdict(set)
+        self.by_shop: dict[str, set[str]] = defaultdict(set)
+        self.version: int | None = None
+        self.checked_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self.packages)
+
+    def get(self, url: str) -> Package | None:
+        return self.packages.get(normalize_package_url(url))
+
+    def in_category(self, category: str) -> list[Package]:
+        return [self.packages[url] for url in sorted(self.by_category.get(category, ()))]
+
+    def of_shop(self, shop_name: str) -> list[Package]:
+        return [self.packages[url] for url in sorted(self.by_shop.get(shop_name, ()))]
+
+    def filter(self, filters: list[dict], use_or: bool = False, limit: int = 10) -> list[Package] | None:
+        return filter_packages((self.packages[url] for url in sorted(self.packages)), filters, use_or, limit)
+
+    def put(self, package: Package) -> None:
+        self.remove(package.url)
+        url = normalize_package_url(package.url)
+        self.packages[url] = package
+        self.by_category[package.category].add(url)
+        self.by_shop[package.shop_name].add(url)
+
+    def remove(self, url: str) -> None:
+        url = normalize_package_url(url)
+        package = self.packages.pop(url, None)
+        if package is not None:
+            self.by_category[package.category].discard(url)
+            self.by_shop[package.shop_name].discard(url)
+
+    def mark_checked(self, version: int | None) -> None:
+        self.version = version
+        self.checked_at = time.monotonic()
+        CATALOG_SNAPSHOT_PACKAGES.set(len(self))
+        CATALOG_SNAPSHOT_AGE.set(0)
+
+    async def load(self, engine) -> None:
+        async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+            version = await get_catalog_version(session)
+            packages = (await session.scalars(select(Package))).all()
+        self.packages.clear()
+        self.by_category.clear()
+        self.by_shop.clear()
+        for package in packages:
+            self.put(package)
+        self.mark_checked(version)
+        logger.info("Loaded %d packages into the catalog snapshot (version %s)", len(self), version)
+
+    async def reload_urls(self, engine, urls: set[str]) -> None:
+        async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+            version = await get_catalog_version(session)
+            urls_param = bindparam("urls", list(urls), type_=ARRAY(String))
+            packages = (await session.scalars(select(Package).where(Package.url == any_(urls_param)))).all()
+        for url in urls:
+            self.remove(url)
+        for package in packages:
+            self.put(package)
+        self.mark_checked(version)
+        logger.info("Reloaded %d changed packages into the catalog snapshot", len(urls))
+
+    async def check_version(self, engine) -> None:
+        async with engine.connect() as conn:
+            version = await get_catalog_version(conn)
+        if version != self.version:
+            await self.load(engine)
+        else:
+            self.mark_checked(version)
+
+
+async def get_catalog_version(conn) -> int | None:
+    try:
+        return (await conn.execute(VERSION_QUERY)).scalar()
+    except Exception as e:
+        # The version sequence only exists once setup_postgres_database has run
+        logger.warning("Could not read the catalog version: %s", e)
+        await conn.rollback()
+        return None
+
+
+async def keep_snapshot_fresh(engine, snapshot: CatalogSnapshot, interval: float = 60) -> None:
+    """Apply the changes notified by Postgres to the snapshot, and compare versions every interval seconds
+    to catch changes missed while not listening. Runs until cancelled."""
+    changes: asyncio.Queue[str] = asyncio.Queue()
+    while True:
+        try:
+            async with engine.connect() as conn:
+                listener = (await conn.get_raw_connection()).driver_connection
+                await listener.add_listener(CHANGES_CHANNEL, lambda *args: changes.put_nowait(args[3]))
+                await snapshot.check_version(engine)
+                while not listener.is_closed():
+                    try:
+                        urls = {await asyncio.wait_for(changes.get(), timeout=interval)}
+                    except asyncio.TimeoutError:
+                        await snapshot.check_version(engine)
+                        continue
+                    while not changes.empty():
+                        urls.add(changes.get_nowait())
+                    if "*" in urls or len(urls) > MAX_INCREMENTAL_CHANGES:
+                        await snapshot.load(engine)
+                    else:
+                        await snapshot.reload_urls(engine, urls)
+        except Exception as e:
+            logger.warning("Catalog snapshot listener failed, retrying in %ss: %s", interval, e)
+            await asyncio.sleep(interval)
+
+
+async def update_snapshot_age(snapshot: CatalogSnapshot, interval: float = 5) -> None:
+    while True:
+        CATALOG_SNAPSHOT_AGE.set(time.monotonic() - snapshot.checked_at)
+        await asyncio.sleep(interval)
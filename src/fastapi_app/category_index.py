@@ -0,0 +1,115 @@
+import asyncio
+import bisect
+import logging
+from dataclasses import dataclass, field
+from urllib.parse import quote_plus
+
+from sqlalchemy import select
+
+from fastapi_app.catalog import get_catalog_version
+from fastapi_app.postgres_models import Package
+
+logger = logging.getLogger("ragapp")
+
+SEARCH_URL = "https://hdmall.co.th/search?q="
+# Cheapest packages kept per category for the alternatives
+TOP_PACKAGES = 20
+
+
+def category_search_url(category: str) -> str:
+    """The hdmall.co.th search URL of a category. Reserved ASCII characters like "&" and "+" are escaped and spaces
+    become "+", but Thai is kept as is: it is valid in a URL and costs a fraction of the tokens of its escapes."""
+    return SEARCH_URL + "".join(char if ord(char) > 127 else quote_plus(char) for char in category)
+
+
+@dataclass
+class CategoryFacet:
+    """A category of the catalog: its package count, search URL and cheapest packages as parallel lists."""
+
+    name: str
+    search_url: str
+    package_count: int = 0
+    prices: list[float] = field(default_factory=list)
+    urls: list[str] = field(default_factory=list)
+    package_names: list[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "search_url": self.search_url, "package_count": self.package_count}
+
+
+class CategoryIndex:
+    """Facets of the catalog by category, built in one pass over packages_all and rebuilt when it changes."""
+
+    def __init__(self, facets: dict[str, CategoryFacet], version: int | None = None):
+        self.facets = facets
+        self.version = version
+
+    def __len__(self) -> int:
+        return len(self.facets)
+
+    @classmethod
+    def build(cls, rows, top_packages: int = TOP_PACKAGES, version: int | None = None) -> "CategoryIndex":
+        """Build from (category, url, package_name, price) rows."""
+        by_category: dict[str, list[tuple[float, str, str]]] = {}
+        counts: dict[str, int] = {}
+        for category, url, package_name, price in rows:
+            if not category:
+                continue
+            counts[category] = counts.get(category, 0) + 1
+            if price is not None and price == price:
+                by_category.setdefault(category, []).append((price, url, package_name))
+        facets = {}
+        for category, count in counts.items():
+            cheapest = sorted(by_category.get(category, []))[:top_packages]
+            facets[category] = CategoryFacet(
+                name=category,
+                search_url=category_search_url(category),
+                package_count=count,
+                prices=[price for price, _, _ in cheapest],
+                urls=[url for _, url, _ in cheapest],
+                package_names=[package_name for _, _, package_name in cheapest],
+            )
+        return cls(facets, version)
+
+    def search_url(self, category: str) -> str:
+        facet = self.facets.get(category)
+        return facet.search_url if facet is not None else category_search_url(category)
+
+    def cheaper_alternatives(
+        self, category: str, below_price: float, exclude_urls: set[str] = frozenset(), limit: int = 3
+    ) -> list[tuple[str, str, float]]:
+        """The (url, package_name, price) of the cheapest packages of the category under below_price."""
+        facet = self.facets.get(category)
+        if facet is None:
+            return []
+        end = bisect.bisect_left(facet.prices, below_price)
+        alternatives = []
+        for position in range(end):
+            if facet.urls[position] not in exclude_urls:
+                alternatives.append((facet.urls[position], facet.package_names[position], facet.prices[position]))
+                if len(alternatives) == limit:
+                    break
+        return alternatives
+
+
+async def build_category_index_from_db(engine) -> CategoryIndex:
+    async with engine.connect() as conn:
+        version = await get_catalog_version(conn)
+        rows = (await conn.execute(select(Package.category, Package.url, Package.package_name, Package.price))).all()
+    index = CategoryIndex.build(rows, version=version)
+    logger.info("Built the category index over %d packages in %d categories", len(rows), len(index))
+    return index
+
+
+async def keep_category_index_fresh(engine, storage, interval: float = 600) -> None:
+    """Rebuild storage.category_index when the catalog version changes, checking every interval seconds until
+    cancelled. Without a version sequence in the database, it is rebuilt every interval."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with engine.connect() as conn:
+                version = await get_catalog_version(conn)
+            if version is None or storage.category_index is None or version != storage.category_index.version:
+                storage.category_index = await build_category_index_from_db(engine)
+        except Exception as e:
+            logger.warning("Failed to refresh the category index: %s", e)
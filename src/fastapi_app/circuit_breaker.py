@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+
+from fastapi_app.metrics import record_breaker_rejection, record_breaker_state
+
+logger = logging.getLogger("ragapp")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+# External dependencies with a breaker, named as in the external call error metrics
+DEPENDENCIES = ("openai", "google_cse", "apps_script")
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+    def __init__(self, dependency: str, retry_in: float):
+        super().__init__(f"The {dependency} circuit is open, retrying it in {retry_in:.0f}s")
+        self.dependency = dependency
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Stops calling a dependency after failure_threshold consecutive failures. After reset_timeout seconds one
+    trial call is let through (half-open): its success closes the breaker again, its failure reopens it.
+
+    State is per worker, so a dependency failing for one worker is not called by it until it recovers. It is
+    shared by the threads of the worker too, the Apps Script being called from threads."""
+
+    def __init__(self, dependency: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.dependency = dependency
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        # When the trial call of the half-open state started, so that a trial that never reports back is replaced
+        self.trial_started_at: float | None = None
+        self.lock = threading.Lock()
+        record_breaker_state(dependency, self.state)
+
+    def set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning("The %s circuit breaker went from %s to %s", self.dependency, self.state, state)
+            self.state = state
+            record_breaker_state(self.dependency, state)
+
+    def retry_in(self) -> float:
+        return max(self.opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        """Whether to call the dependency now. In half-open state only the one trial call is allowed."""
+        with self.lock:
+            if not self.failure_threshold or self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.retry_in() == 0:
+                self.set_state(HALF_OPEN)
+            now = time.monotonic()
+            if self.state == HALF_OPEN and (
+                self.trial_started_at is None or now - self.trial_started_at >= self.reset_timeout
+            ):
+                self.trial_started_at = now
+                return True
+        record_breaker_rejection(self.dependency)
+        return False
+
+    def check(self) -> None:
+        """Raise CircuitOpenError unless the dependency may be called now."""
+        if not self.allow():
+            raise CircuitOpenError(self.dependency, self.retry_in())
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.trial_started_at = None
+            self.set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            self.trial_started_at = None
+            if self.failure_threshold and (self.state == HALF_OPEN or self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self.set_state(OPEN)
+
+    def to_dict(self) -> dict:
+        status = {"state": self.state, "consecutive_failures": self.failures}
+        if self.state != CLOSED:
+            status["retry_in_seconds"] = round(self.retry_in(), 1)
+        return status
+
+
+breakers = {dependency: CircuitBreaker(dependency) for dependency in DEPENDENCIES}
+
+
+def get_breaker(dependency: str) -> CircuitBreaker:
+    return breakers[dependency]
+
+
+def configure_breakers(failure_threshold: int, reset_timeout: float) -> None:
+    """Apply the settings to every breaker, a failure_threshold of 0 turning them off."""
+    for breaker in breakers.values():
+        breaker.failure_threshold = failure_threshold
+        breaker.reset_timeout = reset_timeout
+
+
+def health() -> dict:
+    """The breaker state of every dependency, "degraded" while any of them is not closed."""
+    dependencies = {dependency: breaker.to_dict() for dependency, breaker in breakers.items()}
+    degraded = any(breaker.state != CLOSED for breaker in breakers.values())
+    return {"status": "degraded" if degraded else "ok", "dependencies": dependencies}
@@ -0,0 +1,35 @@
+import openai
+
+from .metrics import LLM_TOKENS, observe_stage, record_external_error
+
+# Models that accept the dimensions parameter
+SUPPORTED_DIMENSIONS_MODEL = {
+    "text-embedding-ada-002": False,
+    "text-embedding-3-small": True,
+    "text-embedding-3-large": True,
+}
+
+
+async def compute_text_embeddings(
+    texts: list[str],
+    openai_client,
+    embed_model: str,
+    embed_deployment: str | None = None,  # Not needed for non-Azure OpenAI
+    embedding_dimensions: int = 1536,
+) -> list[list[float]]:
+    dimensions_args = {"dimensions": embedding_dimensions} if SUPPORTED_DIMENSIONS_MODEL.get(embed_model) else {}
+    try:
+        with observe_stage("embed"):
+            embedding_response = await openai_client.embeddings.create(
+                model=embed_deployment if embed_deployment else embed_model, input=texts, **dimensions_args
+            )
+    except openai.OpenAIError:
+        record_external_error("openai_embed")
+        raise
+    if embedding_response.usage:
+        LLM_TOKENS.labels("embed", "prompt").inc(embedding_response.usage.prompt_tokens)
+    return [item.embedding for item in sorted(embedding_response.data, key=lambda item: item.index)]
+
+
+async def compute_text_embedding(q: str, openai_client, embed_model: str, **kwargs) -> list[float]:
+    return (await compute_text_embeddings([q], openai_client, embed_model, **kwargs))[0]
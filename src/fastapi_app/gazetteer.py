@@ -0,0 +1,143 @@
+import functools
+import json
+import os
+import re
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+# Neighbours precomputed per place, and how far a neighbour may be to expand a location to it
+NEIGHBOURS = 8
+MAX_NEIGHBOUR_KM = 25.0
+# How many neighbours a location expands to, like the list the search tool used to ask the LLM for
+DEFAULT_EXPANSION = 4
+# "llm" lets the search tool ask the LLM for the surrounding districts, "gazetteer" only asks for the location and
+# expands it with the bundled gazetteer
+LOCATION_EXPANSIONS = ("llm", "gazetteer")
+# Words written before place names, e.g. "อ.ธัญบุรี" or "เขตบางนา", dropped before matching
+PLACE_PREFIXES = re.compile(r"^(อำเภอ|อ\.|เขต|จังหวัด|จ\.|แขวง|ตำบล|ต\.|amphoe|khet|district|province)")
+SPACES = re.compile(r"\s+")
+# Aliases that are also common words or parts of words ("เลย" is "at all"), only matched as a whole location string
+EXACT_ONLY_ALIASES = {"เลย", "ตาก", "น่าน", "loei", "nan", "tak", "ari"}
+
+
+def normalize_place(text: str) -> str:
+    return PLACE_PREFIXES.sub("", SPACES.sub("", text.lower()))
+
+
+def default_gazetteer_path() -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.json")
+
+
+class Gazetteer:
+    """Thai provinces and districts with their aliases, coordinates and nearest neighbours, as NumPy arrays.
+
+    The neighbours are computed once when loading, so expanding a location and ranking packages by distance are
+    dictionary and array lookups.
+    """
+
+    def __init__(self, places: list[dict], neighbours: int = NEIGHBOURS):
+        self.names = [place["name"] for place in places]
+        self.provinces = [place["province"] for place in places]
+        self.is_district = np.array([place["kind"] == "district" for place in places], dtype=bool)
+        self.coordinates = np.radians(np.array([(place["lat"], place["lon"]) for place in places], dtype=np.float64))
+        # Normalized aliases to place positions, the first place listing an alias keeping it
+        self.aliases: dict[str, int] = {}
+        for position, place in enumerate(places):
+            for alias in (place["name"], place["en"], *place["aliases"]):
+                self.aliases.setdefault(normalize_place(alias), position)
+        # Longest alias first, so that "เมืองปทุมธานี" is found in a text before "ปทุมธานี"
+        searchable = sorted(set(self.aliases) - EXACT_ONLY_ALIASES, key=len, reverse=True)
+        self.alias_pattern = re.compile("|".join(re.escape(alias) for alias in searchable))
+
+        distances = self.distances_from(np.arange(len(places)))
+        # Only districts are neighbours: a province centroid duplicates its capital district
+        distances[:, ~self.is_district] = np.inf
+        np.fill_diagonal(distances, np.inf)
+        neighbours = min(neighbours, len(places) - 1)
+        self.neighbours = np.argsort(distances, axis=1, kind="stable")[:, :neighbours].astype(np.int32)
+        self.neighbour_km = np.take_along_axis(distances, self.neighbours, axis=1).astype(np.float32)
+
+    @classmethod
+    def from_file(cls, path: str | None = None) -> "Gazetteer":
+        with open(path or default_gazetteer_path(), encoding="utf-8") as file:
+            return cls(json.load(file))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def distances_from(self, positions: np.ndarray) -> np.ndarray:
+        """Haversine distances in km from each of the places at positions to every place."""
+        latitudes, longitudes = self.coordinates[:, 0], self.coordinates[:, 1]
+        from_latitudes, from_longitudes = latitudes[positions, None], longitudes[positions, None]
+        a = (
+            np.sin((latitudes - from_latitudes) / 2) ** 2
+            + np.cos(from_latitudes) * np.cos(latitudes) * np.sin((longitudes - from_longitudes) / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+    def resolve(self, location: str) -> int | None:
+        """The position of the place a location string names, or of the first place mentioned in it."""
+        key = normalize_place(location)
+        if (position := self.aliases.get(key)) is not None:
+            return position
+        match = self.alias_pattern.search(key)
+        return None if match is None else self.aliases[match.group()]
+
+    def places_in(self, text: str) -> list[int]:
+        """The positions of the places mentioned in a text, e.g. the locations of a package."""
+        matches = self.alias_pattern.finditer(SPACES.sub("", text.lower()))
+        return list(dict.fromkeys(self.aliases[match.group()] for match in matches))
+
+    def expand(
+        self, locations: list[str], neighbours: int = DEFAULT_EXPANSION, max_km: float = MAX_NEIGHBOUR_KM
+    ) -> list[str]:
+        """The locations as given followed by the names of the places they resolve to, e.g. "ธัญบุรี" for "รังสิต",
+        and the districts closest to them, nearest first, without repeats. Unknown locations are kept as is."""
+        expanded = list(dict.fromkeys(location for location in locations if location))
+        seen = {normalize_place(location) for location in expanded}
+
+        def add(position: int) -> bool:
+            key = normalize_place(self.names[position])
+            if key in seen:
+                return False
+            seen.add(key)
+            expanded.append(self.names[position])
+            return True
+
+        for location in locations:
+            if not location or (position := self.resolve(location)) is None:
+                continue
+            add(position)
+            added = 0
+            for neighbour, km in zip(self.neighbours[position], self.neighbour_km[position]):
+                if added == neighbours or km > max_km:
+                    break
+                added += add(neighbour)
+        return expanded
+
+    def distance_km(self, origin: int, text: str) -> float:
+        """Distance from the place at origin to the closest place mentioned in a text, inf if it mentions none."""
+        positions = places_in_cached(self, text)
+        if not positions:
+            return float("inf")
+        return float(self.distances_from(np.array([origin]))[0, list(positions)].min())
+
+    def rank_by_distance(self, packages: list, location: str) -> list:
+        """The packages nearest to the location first, by the places in their locations field. The order is kept
+        for packages at the same distance or without a known place, and when the location is not known."""
+        origin = self.resolve(location) if location else None
+        if origin is None:
+            return packages
+        return sorted(packages, key=lambda package: self.distance_km(origin, package.locations or ""))
+
+
+@functools.lru_cache(maxsize=4096)
+def places_in_cached(gazetteer: Gazetteer, text: str) -> tuple[int, ...]:
+    # Packages are searched over and over, so their locations are matched once
+    return tuple(gazetteer.places_in(text))
+
+
+@functools.cache
+def get_gazetteer() -> Gazetteer:
+    return Gazetteer.from_file()
@@ -8,6 +8,20 @@ class Global:
         self.openai_embed_dimensions = None
         self.openai_chat_deployment = None
         self.openai_embed_deployment = None
+        self.trace_store = None
+        self.apps_script_client = None
+        self.google_search_client = None
+        self.retrieval_mode = "google"
+        self.retrieval_fallback = "none"
+        self.bm25_index = None
+        self.catalog_snapshot = None
+        self.sql_search_mode = "like"
+        self.section_token_budget = 0
+        self.location_expansion = "llm"
+        self.price_filter = False
+        self.category_index = None
+        self.highlight_index = None
+        self.payment_max_age = 0
 
 
 global_storage = Global()
@@ -0,0 +1,106 @@
+import logging
+import os
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text
+
+from fastapi_app.metrics import record_google_quota
+
+logger = logging.getLogger("ragapp")
+
+# The Custom Search daily quota resets at midnight Pacific Time
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+RESERVE_QUERY = """
+    INSERT INTO google_search_quota (day, spent) VALUES (:day, 1)
+    ON CONFLICT (day) DO UPDATE SET spent = google_search_quota.spent + 1
+    WHERE google_search_quota.spent < :allowance
+    RETURNING spent
+"""
+EXHAUST_QUERY = """
+    INSERT INTO google_search_quota (day, spent) VALUES (:day, :daily_limit)
+    ON CONFLICT (day) DO UPDATE SET spent = GREATEST(google_search_quota.spent, :daily_limit)
+"""
+
+
+def quota_day(now: datetime) -> tuple[date, float]:
+    """The quota day of the moment, and the share of it elapsed."""
+    local = now.astimezone(QUOTA_TIMEZONE)
+    midnight = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    return local.date(), (local - midnight) / timedelta(days=1)
+
+
+class GoogleQuota:
+    """The daily Custom Search budget, counted in Postgres so that all workers share it.
+
+    Spending is paced over the quota day: by a given time, the budget allowed is the share of the day elapsed
+    plus a burst share of the daily limit, so that a busy morning cannot spend the quota the afternoon needs.
+    Requests over the allowance are not sent, and the search falls back to the local catalog."""
+
+    def __init__(self, engine, daily_limit: int, burst_share: float = 0.1):
+        self.engine = engine
+        self.daily_limit = daily_limit
+        self.burst_share = burst_share
+
+    @classmethod
+    def from_env(cls, engine) -> "GoogleQuota | None":
+        daily_limit = int(os.getenv("GOOGLE_SEARCH_DAILY_QUOTA", "0"))
+        if not daily_limit:
+            return None
+        return cls(engine, daily_limit, float(os.getenv("GOOGLE_SEARCH_QUOTA_BURST", "0.1")))
+
+    def allowance(self, elapsed: float) -> int:
+        """Requests allowed by the time the share elapsed of the day has passed."""
+        return min(self.daily_limit, int(self.daily_limit * (elapsed + self.burst_share)))
+
+    async def reserve(self) -> bool:
+        """Count one request against today's budget, or return False if the budget allowed so far is spent.
+        If the count itself fails, the request is allowed rather than the search lost."""
+        day, elapsed = quota_day(datetime.now(QUOTA_TIMEZONE))
+        try:
+            async with self.engine.begin() as conn:
+                spent = (
+                    await conn.execute(text(RESERVE_QUERY), {"day": day, "allowance": self.allowance(elapsed)})
+                ).scalar()
+        except Exception as e:
+            logger.warning("Could not count the Google search against the quota: %s", e)
+            return True
+        record_google_quota(spent)
+        return spent is not None
+
+    async def exhaust(self) -> None:
+        """Mark today's quota as spent, when Google says it is before the count does."""
+        day, _ = quota_day(datetime.now(QUOTA_TIMEZONE))
+        try:
+            async with self.engine.begin() as conn:
+                await conn.execute(text(EXHAUST_QUERY), {"day": day, "daily_limit": self.daily_limit})
+        except Exception as e:
+            logger.warning("Could not mark the Google search quota as spent: %s", e)
+
+    async def spent(self, day: date) -> int:
+        async with self.engine.connect() as conn:
+            spent = (
+                await conn.execute(text("SELECT spent FROM google_search_quota WHERE day = :day"), {"day": day})
+            ).scalar()
+        return spent or 0
+
+    async def remaining(self) -> int:
+        """Requests still allowed now, the whole allowance if the count cannot be read."""
+        day, elapsed = quota_day(datetime.now(QUOTA_TIMEZONE))
+        try:
+            spent = await self.spent(day)
+        except Exception as e:
+            logger.warning("Could not read the Google search quota: %s", e)
+            spent = 0
+        return max(self.allowance(elapsed) - spent, 0)
+
+    async def status(self) -> dict:
+        day, elapsed = quota_day(datetime.now(QUOTA_TIMEZONE))
+        spent = await self.spent(day)
+        return {
+            "day": day.isoformat(),
+            "spent": spent,
+            "allowed": self.allowance(elapsed),
+            "limit": self.daily_limit,
+        }
@@ -1,51 +1,216 @@
+import asyncio
+import json
+import logging
 import os
+import sqlite3
+import tempfile
+import time
+from collections import OrderedDict
 
-import requests
+import aiohttp
 from dotenv import load_dotenv
 
+from fastapi_app.circuit_breaker import get_breaker
+from fastapi_app.google_quota import GoogleQuota
+from fastapi_app.metrics import observe_stage, record_cache_lookup, record_external_error
+from fastapi_app.single_flight import SingleFlight
+
 # Load the environment variables
 load_dotenv()
 
+logger = logging.getLogger("ragapp")
+
+GOOGLE_SEARCH_ENDPOINT = "https://www.googleapis.com/customsearch/v1"
+
+
+def default_cache_path() -> str:
+    return os.getenv(
+        "GOOGLE_SEARCH_CACHE_PATH", os.path.join(tempfile.gettempdir(), "ragapp-cache", "google_search.sqlite")
+    )
+
+
+class SearchResultCache:
+    """Links of past (query, exact term) searches: an LRU in memory in front of a SQLite file shared by the
+    workers of the host, both expiring entries after ttl seconds. Failed searches are not cached."""
+
+    def __init__(self, path: str | None = None, ttl: float = 86400, max_entries: int = 1024):
+        self.path = path or default_cache_path()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory: OrderedDict[tuple[str, str], tuple[float, list[str]]] = OrderedDict()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_results "
+                "(query TEXT, exact_term TEXT, links TEXT, expires_at REAL, PRIMARY KEY (query, exact_term))"
+            )
+
+    @classmethod
+    def from_env(cls) -> "SearchResultCache":
+        return cls(ttl=float(os.getenv("GOOGLE_SEARCH_CACHE_TTL_SECONDS", "86400")))
+
+    def connect(self) -> sqlite3.Connection:
+        # Several workers write to the file, wait for each other's writes instead of failing
+        return sqlite3.connect(self.path, timeout=5)
+
+    def read(self, key: tuple[str, str], expired: bool = False) -> tuple[float, list[str]] | None:
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT expires_at, links FROM search_results WHERE query = ? AND exact_term = ? AND expires_at > ?",
+                (*key, 0 if expired else time.time()),
+            ).fetchone()
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def write(self, key: tuple[str, str], expires_at: float, links: list[str]) -> None:
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO search_results VALUES (?, ?, ?, ?)",
+                (*key, json.dumps(links, ensure_ascii=False), expires_at),
+            )
+            conn.execute("DELETE FROM search_results WHERE expires_at <= ?", (time.time(),))
+
+    def remember(self, key: tuple[str, str], expires_at: float, links: list[str]) -> None:
+        self.memory[key] = (expires_at, links)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    async def get(self, query: str, exact_term: str | None, expired: bool = False) -> list[str] | None:
+        """The cached links of the search, also when they have expired with expired, e.g. while Google is down.
+        Expired entries last until they are evicted from memory or the next write cleans up the file."""
+        key = (query, exact_term or "")
+        entry = self.memory.get(key)
+        if entry is not None and (expired or entry[0] > time.time()):
+            self.memory.move_to_end(key)
+            record_cache_lookup("google_search_memory", True)
+            return entry[1]
+        record_cache_lookup("google_search_memory", False)
+        try:
+            entry = await asyncio.to_thread(self.read, key, expired)
+        except sqlite3.Error as e:
+            logger.warning("Could not read the Google search cache: %s", e)
+            entry = None
+        record_cache_lookup("google_search_disk", entry is not None)
+        if entry is None:
+            return None
+        self.remember(key, *entry)
+        return entry[1]
+
+    async def put(self, query: str, exact_term: str | None, links: list[str]) -> None:
+        key, expires_at = (query, exact_term or ""), time.time() + self.ttl
+        self.remember(key, expires_at, links)
+        try:
+            await asyncio.to_thread(self.write, key, expires_at, links)
+        except sqlite3.Error as e:
+            logger.warning("Could not write the Google search cache: %s", e)
+
 
-def google_search_function(search_query, exact_term=None):
-    if not search_query:
-        return []
-    # Replace with your actual API key
-    api_key = os.environ["GOOGLE_SEARCH_API_KEY"]
-
-    # Custom search engine ID
-    cx = os.environ["GOOGLE_SEARCH_ENGINE_ID"]
-
-    # Construct the URL
-    if exact_term:
-        url = (
-            f"https://www.googleapis.com/customsearch/v1?key={api_key}&cx={cx}&q={search_query}&exactTerms={exact_term}"
-        )
-    else:
-        url = f"https://www.googleapis.com/customsearch/v1?key={api_key}&cx={cx}&q={search_query}"
-    # Send the GET request
-    response = requests.get(url)
-
-    links = []
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse the JSON response
-        data = response.json()
-        for item in data.get("items", []):
-            link = item.get("link")
-            if link:
-                links.append(link)
-
-        if len(links) < 1 and exact_term:
-            # Exact term could not find results -> try again without
-            return google_search_function(search_query=search_query, exact_term=None)
+class GoogleSearchClient:
+    """Async Google Custom Search client, keeping its connections open between searches."""
 
+    def __init__(
+        self,
+        api_key: str | None = None,
+        cx: str | None = None,
+        endpoint: str | None = None,
+        timeout: float = 5,
+        cache: SearchResultCache | None = None,
+        quota: GoogleQuota | None = None,
+    ):
+        self.api_key = api_key or os.getenv("GOOGLE_SEARCH_API_KEY", "")
+        # Custom search engine ID
+        self.cx = cx or os.getenv("GOOGLE_SEARCH_ENGINE_ID", "")
+        # Custom Search endpoint, overridable e.g. to point at a local stub for load tests
+        self.endpoint = endpoint or os.getenv("GOOGLE_SEARCH_ENDPOINT", GOOGLE_SEARCH_ENDPOINT)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.cache = cache
+        # Daily budget of requests, past which searches fall back to the local catalog
+        self.quota = quota
+        self.session: aiohttp.ClientSession | None = None
+        self.breaker = get_breaker("google_cse")
+        # Identical searches of concurrent requests share one lookup
+        self.in_flight = SingleFlight("google_search")
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+
+    async def expired_links(self, search_query: str, exact_term: str | None) -> list[str] | None:
+        """The cached links of the search even if expired, served when Google cannot be asked."""
+        if self.cache is None:
+            return None
+        return await self.cache.get(search_query, exact_term, expired=True)
+
+    async def fetch(self, search_query: str, exact_term: str | None = None) -> list[str] | None:
+        """The result links of one Custom Search request, or None if it failed, shared with the identical
+        searches in flight."""
+        return await self.in_flight.do((search_query, exact_term or ""), self.request, search_query, exact_term)
+
+    async def request(self, search_query: str, exact_term: str | None = None) -> list[str] | None:
+        """The result links of one Custom Search request, or None if it failed. While the Google circuit is open
+        or the daily budget is spent, expired cached links are served instead, if any."""
+        if self.cache is not None and (links := await self.cache.get(search_query, exact_term)) is not None:
+            return links
+        if not self.breaker.allow():
+            return await self.expired_links(search_query, exact_term)
+        if self.quota is not None and not await self.quota.reserve():
+            logger.info("Over the Google search budget, not searching for %r", search_query)
+            return await self.expired_links(search_query, exact_term)
+        if self.session is None:
+            # Created on first use, inside the event loop that serves the requests
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+        params = {"key": self.api_key, "cx": self.cx, "q": search_query}
+        if exact_term:
+            params["exactTerms"] = exact_term
+        try:
+            with observe_stage("google_cse"):
+                async with self.session.get(self.endpoint, params=params) as response:
+                    response.raise_for_status()
+                    data = await response.json()
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            logger.warning("Google search failed: %r", e)
+            record_external_error("google_cse")
+            if isinstance(e, aiohttp.ClientResponseError) and e.status == 429 and self.quota is not None:
+                # The daily quota ran out before our count of it did
+                await self.quota.exhaust()
+            else:
+                self.breaker.record_failure()
+            return await self.expired_links(search_query, exact_term)
+        self.breaker.record_success()
+        links = [item["link"] for item in data.get("items", []) if item.get("link")]
+        if self.cache is not None:
+            await self.cache.put(search_query, exact_term, links)
         return links
-    else:
-        return {"error": "Google search failed"}
 
+    async def search(self, search_query: str, exact_term: str | None = None) -> list[str] | dict:
+        """The result links for the query, restricted to results containing exact_term when there are any."""
+        if not search_query:
+            return []
+        if exact_term:
+            # The query without the exact term is only sent when the exact one finds nothing: sending both at once
+            # would save a round trip on those misses but double the quota spent on every search with locations
+            exact_links = await self.fetch(search_query, exact_term)
+            if exact_links:
+                return exact_links
+        links = await self.fetch(search_query)
+        if links is None:
+            return {"error": "Google search failed"}
+        return links
 
-if __name__ == "__main__":
+
+default_client = GoogleSearchClient()
+
+
+async def google_search_function(search_query, exact_term=None):
+    return await default_client.search(search_query, exact_term=exact_term)
+
+
+async def main():
     search_query = "ลดขนาดหน้าอก"
-    result = google_search_function(search_query)
+    result = await google_search_function(search_query)
     print(result)
+    await default_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
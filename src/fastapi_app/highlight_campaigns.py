@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+import requests
+from sqlalchemy import delete, func, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from fastapi_app.package_repository import normalize_package_url
+from fastapi_app.postgres_models import HighlightCampaign, HighlightSync, Package
+
+logger = logging.getLogger("ragapp")
+
+# Share of character bigrams a search query must have in common with a tag to match it
+MIN_TAG_SIMILARITY = 0.6
+# Key of the Postgres advisory lock held by the worker syncing the campaigns
+SYNC_LOCK_KEY = 4614
+# How often the workers check whether the campaigns were synced again
+CHECK_INTERVAL = 300
+
+
+def normalize_name(name: str) -> str:
+    # Thai is written without spaces, so spacing differences are ignored altogether
+    return "".join(name.lower().split())
+
+
+def bigrams(name: str) -> set[str]:
+    return {name[i : i + 2] for i in range(len(name) - 1)} or {name}
+
+
+class HighlightIndex:
+    """The highlight campaigns synced from the Apps Script, matched locally by package URL, tag name, then the
+    tag closest to the search query."""
+
+    def __init__(self, tags: list[str], by_tag: dict[str, object], by_url: dict[str, object], synced_at=None):
+        self.tags = tags
+        self.by_tag = {normalize_name(tag): campaign for tag, campaign in by_tag.items()}
+        self.by_url = {normalize_package_url(url): campaign for url, campaign in by_url.items()}
+        self.synced_at = synced_at
+        self.tag_bigrams = {tag: bigrams(tag) for tag in self.by_tag}
+        # Longest tag first, so that the most specific tag contained in a query wins
+        self.tags_by_length = sorted(self.by_tag, key=len, reverse=True)
+
+    def __len__(self) -> int:
+        return len(self.by_tag) + len(self.by_url)
+
+    def tags_text(self) -> str:
+        """The tag list of the query prompt, as get_highlight_tags formats it."""
+        return "\n".join(self.tags)
+
+    def match(self, highlight_name: str = "", highlight_url: str = ""):
+        """The campaign of the package URL, else of the tag the name is, contains or most resembles, else ""."""
+        if highlight_url and (campaign := self.by_url.get(normalize_package_url(highlight_url))):
+            return campaign
+        if not highlight_name:
+            return ""
+        name = normalize_name(highlight_name)
+        if campaign := self.by_tag.get(name):
+            return campaign
+        for tag in self.tags_by_length:
+            if tag in name and self.by_tag[tag]:
+                return self.by_tag[tag]
+        name_bigrams = bigrams(name)
+        best_tag, best_similarity = None, MIN_TAG_SIMILARITY
+        for tag, tag_bigrams in self.tag_bigrams.items():
+            # Dice coefficient of the bigram sets
+            similarity = 2 * len(name_bigrams & tag_bigrams) / (len(name_bigrams) + len(tag_bigrams))
+            if similarity >= best_similarity and self.by_tag[tag]:
+                best_tag, best_similarity = tag, similarity
+        return self.by_tag[best_tag] if best_tag is not None else ""
+
+
+async def load_highlight_index(engine) -> HighlightIndex | None:
+    """The synced campaigns, or None if they were never synced."""
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+        rows = (await session.scalars(select(HighlightCampaign).order_by(HighlightCampaign.position))).all()
+        synced_at = (await session.execute(select(HighlightSync.completed_at))).scalar()
+    if not rows:
+        return None
+    tags = [row.key for row in rows if row.kind == "tag"]
+    by_tag = {row.key: row.campaign for row in rows if row.kind == "tag"}
+    by_url = {row.key: row.campaign for row in rows if row.kind == "url" and row.campaign}
+    return HighlightIndex(tags, by_tag, by_url, synced_at=synced_at)
+
+
+async def get_last_sync(engine) -> datetime | None:
+    """When the last sync run completed."""
+    async with engine.connect() as conn:
+        return (await conn.execute(select(HighlightSync.completed_at))).scalar()
+
+
+async def sync_highlight_campaigns(engine, apps_script_client, concurrency: int = 4) -> int:
+    """Fetch the campaign of every highlight tag and package URL from the Apps Script and upsert them. A failed
+    fetch keeps the previous row, with its old sync time, until the next run, and tags and packages gone are
+    deleted."""
+    data = await asyncio.to_thread(apps_script_client.call, "highlight_tags", use_last_answer=False)
+    tags = list(dict.fromkeys(data.get("highlightTags") or []))
+    async with engine.connect() as conn:
+        urls = (await conn.execute(select(Package.url))).scalars().all()
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(kind: str, key: str, position: int) -> dict | None:
+        arguments = {"highlight_name": key} if kind == "tag" else {"highlight_url": key}
+        async with semaphore:
+            try:
+                campaign = await asyncio.to_thread(
+                    apps_script_client.call, "highlight", **arguments, use_last_answer=False
+                )
+            except requests.exceptions.RequestException as e:
+                logger.warning("Could not fetch the highlight campaign of %s %s: %s", kind, key, e)
+                return None
+        return {"kind": kind, "key": key, "position": position, "campaign": campaign or None}
+
+    fetched = await asyncio.gather(
+        *(fetch("tag", tag, position) for position, tag in enumerate(tags)),
+        *(fetch("url", url, 0) for url in urls),
+    )
+    rows = [row for row in fetched if row is not None]
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+        if rows:
+            statement = insert(HighlightCampaign)
+            statement = statement.on_conflict_do_update(
+                index_elements=[HighlightCampaign.kind, HighlightCampaign.key],
+                set_={
+                    "position": statement.excluded.position,
+                    "campaign": statement.excluded.campaign,
+                    "synced_at": func.now(),
+                },
+            )
+            await session.execute(statement, rows)
+        current = [("tag", tag) for tag in tags] + [("url", url) for url in urls]
+        await session.execute(
+            delete(HighlightCampaign).where(tuple_(HighlightCampaign.kind, HighlightCampaign.key).not_in(current))
+        )
+        statement = insert(HighlightSync).values(id=1, completed_at=func.now())
+        await session.execute(
+            statement.on_conflict_do_update(index_elements=[HighlightSync.id], set_={"completed_at": func.now()})
+        )
+        await session.commit()
+    logger.info("Synced %d of %d highlight tags and package URLs", len(rows), len(fetched))
+    return len(rows)
+
+
+async def keep_highlights_fresh(engine, storage, apps_script_client, interval: float = 3600) -> None:
+    """Sync the campaigns from the Apps Script once the last sync run is older than interval seconds, in one
+    worker at a time, and reload storage.highlight_index when they were synced. Runs until cancelled."""
+
+    def is_stale(last_sync: datetime | None) -> bool:
+        return last_sync is None or datetime.now(timezone.utc) - last_sync > timedelta(seconds=interval)
+
+    while True:
+        try:
+            if is_stale(await get_last_sync(engine)):
+                async with engine.connect() as conn:
+                    # Session-level lock, held on this connection while the sync writes through others
+                    locked = await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": SYNC_LOCK_KEY})
+                    if locked.scalar():
+                        try:
+                            # Another worker may have synced between the check and the lock
+                            if is_stale(await get_last_sync(engine)):
+                                await sync_highlight_campaigns(engine, apps_script_client)
+                        finally:
+                            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SYNC_LOCK_KEY})
+            last_sync = await get_last_sync(engine)
+            if last_sync is not None and (
+                storage.highlight_index is None or storage.highlight_index.synced_at != last_sync
+            ):
+                storage.highlight_index = await load_highlight_index(engine)
+        except Exception as e:
+            logger.warning("Failed to refresh the highlight campaigns: %s", e)
+        await asyncio.sleep(min(interval, CHECK_INTERVAL))
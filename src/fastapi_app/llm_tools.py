@@ -6,7 +6,24 @@ from openai.types.chat import (
 )
 
 
-def build_google_search_function() -> list[ChatCompletionToolParam]:
+def build_google_search_function(expand_locations: bool = True) -> list[ChatCompletionToolParam]:
+    if expand_locations:
+        locations_description = """
+                            Translate all inputs to thai.
+                            A list of nearby districts(Amphoes) from what the user provides.
+                            For example, if the user says `รังสิต`, the locations should be 
+                            [`รังสิต`, `ธัญบุรี`, `เมืองปทุมธานี`, `คลองหลวง`, `ลำลูกกา`]. The location the user provided should
+                            be the first in the response and followed by areas surrounding it.
+                            Only parse this property if the user specifies an area, not a specific place.
+                            """
+    else:
+        # The surrounding districts are added from the gazetteer, see gazetteer.py
+        locations_description = """
+                            Translate all inputs to thai.
+                            The areas (districts, provinces or neighbourhoods) the user provides, only their names,
+                            e.g. [`รังสิต`] if the user says `แถวรังสิต`. Do not add the areas surrounding them.
+                            Only parse this property if the user specifies an area, not a specific place.
+                            """
     return [
         {
             "type": "function",
@@ -25,14 +42,7 @@ def build_google_search_function() -> list[ChatCompletionToolParam]:
                             "items": {
                                 "type": "string",
                             },
-                            "description": """
-                            Translate all inputs to thai.
-                            A list of nearby districts(Amphoes) from what the user provides.
-                            For example, if the user says `รังสิต`, the locations should be 
-                            [`รังสิต`, `ธัญบุรี`, `เมืองปทุมธานี`, `คลองหลวง`, `ลำลูกกา`]. The location the user provided should
-                            be the first in the response and followed by areas surrounding it.
-                            Only parse this property if the user specifies an area, not a specific place.
-                            """,
+                            "description": locations_description,
                         },
                     },
                 },
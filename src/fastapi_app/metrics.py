@@ -0,0 +1,174 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+logger = logging.getLogger("ragapp")
+
+# Prometheus metrics for the chat pipeline.
+# When PROMETHEUS_MULTIPROC_DIR is set (see gunicorn.conf.py), every worker writes its samples to
+# memory-mapped files in that directory and /metrics aggregates them, so any worker can serve a scrape.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 34, 60)
+
+CHAT_REQUEST_LATENCY = Histogram(
+    "ragapp_chat_request_seconds",
+    "End-to-end latency of /chat requests",
+    ["route"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_LATENCY = Histogram(
+    "ragapp_stage_seconds",
+    "Latency of a single stage of the chat pipeline",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+ROUTE_REQUESTS = Counter(
+    "ragapp_route_requests_total",
+    "Chat requests by intent route",
+    ["route"],
+)
+LLM_TOKENS = Counter(
+    "ragapp_llm_tokens_total",
+    "LLM tokens by pipeline stage and kind (prompt, completion, cached)",
+    ["stage", "kind"],
+)
+EXTERNAL_CALL_ERRORS = Counter(
+    "ragapp_external_call_errors_total",
+    "Failed calls to external dependencies",
+    ["dependency"],
+)
+CIRCUIT_BREAKER_STATE = Gauge(
+    "ragapp_circuit_breaker_state",
+    "Circuit breaker state by dependency: 0 closed, 1 half-open, 2 open (the worst across workers)",
+    ["dependency"],
+    multiprocess_mode="livemax",
+)
+CIRCUIT_BREAKER_REJECTIONS = Counter(
+    "ragapp_circuit_breaker_rejections_total",
+    "Calls to external dependencies skipped because their circuit breaker was open",
+    ["dependency"],
+)
+GOOGLE_QUOTA_SPENT = Gauge(
+    "ragapp_google_quota_spent",
+    "Custom Search requests spent today, as last seen by the worker",
+    multiprocess_mode="livemax",
+)
+GOOGLE_QUOTA_OVERFLOWS = Counter(
+    "ragapp_google_quota_overflows_total",
+    "Custom Search requests not sent because the daily budget allowed so far was spent",
+)
+COALESCED_CALLS = Counter(
+    "ragapp_coalesced_calls_total",
+    "Lookups served by an identical lookup already in flight instead of their own call",
+    ["lookup"],
+)
+CACHE_REQUESTS = Counter(
+    "ragapp_cache_requests_total",
+    "Cache lookups by cache and result (hit, miss)",
+    ["cache", "result"],
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "ragapp_db_pool_connections",
+    "Database connection pool usage by state",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+EVENT_LOOP_LAG = Gauge(
+    "ragapp_event_loop_lag_seconds",
+    "Delay between when the event loop monitor should have woken up and when it did",
+    multiprocess_mode="livemax",
+)
+
+
+@contextlib.contextmanager
+def observe_stage(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+
+def record_llm_usage(stage: str, usage) -> None:
+    if usage is None:
+        return
+    LLM_TOKENS.labels(stage, "prompt").inc(usage.prompt_tokens or 0)
+    LLM_TOKENS.labels(stage, "completion").inc(usage.completion_tokens or 0)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) if details else None
+    if cached_tokens:
+        LLM_TOKENS.labels(stage, "cached").inc(cached_tokens)
+
+
+def record_external_error(dependency: str) -> None:
+    EXTERNAL_CALL_ERRORS.labels(dependency).inc()
+
+
+BREAKER_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def record_breaker_state(dependency: str, state: str) -> None:
+    CIRCUIT_BREAKER_STATE.labels(dependency).set(BREAKER_STATE_VALUES[state])
+
+
+def record_breaker_rejection(dependency: str) -> None:
+    CIRCUIT_BREAKER_REJECTIONS.labels(dependency).inc()
+
+
+def record_google_quota(spent: int | None) -> None:
+    """Record a Custom Search request within the budget, with the spend so far, or an overflow with None."""
+    if spent is None:
+        GOOGLE_QUOTA_OVERFLOWS.inc()
+    else:
+        GOOGLE_QUOTA_SPENT.set(spent)
+
+
+def record_coalesced_calls(lookup: str, count: int = 1) -> None:
+    COALESCED_CALLS.labels(lookup).inc(count)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def update_db_pool_metrics(engine) -> None:
+    pool = engine.sync_engine.pool
+    # Pools without a fixed size (e.g. NullPool) do not expose these counters
+    if not hasattr(pool, "checkedout"):
+        return
+    DB_POOL_CONNECTIONS.labels("checked_out").set(pool.checkedout())
+    DB_POOL_CONNECTIONS.labels("checked_in").set(pool.checkedin())
+    DB_POOL_CONNECTIONS.labels("overflow").set(max(pool.overflow(), 0))
+    DB_POOL_CONNECTIONS.labels("size").set(pool.size())
+
+
+async def monitor_event_loop(engine, interval: float = 1.0) -> None:
+    """Measure event loop lag and sample the DB pool of this worker until cancelled."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.set(max(loop.time() - expected, 0.0))
+        if engine is not None:
+            update_db_pool_metrics(engine)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
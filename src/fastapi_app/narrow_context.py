@@ -0,0 +1,119 @@
+import os
+import re
+from collections import Counter
+
+import tiktoken
+
+# Fields of the narrow context, most important first: what the package is and what it costs, what it includes,
+# then background about the condition or procedure. Fields past the token budget are left out.
+NARROW_CONTEXT_FIELDS = (
+    "package_name",
+    "package_picture",
+    "url",
+    "price",
+    "cash_discount",
+    "installment_month",
+    "price_after_cash_discount",
+    "installment_limit",
+    "price_to_reserve_for_this_package",
+    "brand",
+    "min_max_age",
+    "locations",
+    "package_details",
+    "price_details",
+    "important_info",
+    "hdcare_summary",
+    "common_question",
+    "faq",
+    "general_info",
+    "how_to_diagnose",
+    "early_signs_for_diagnosis",
+    "know_this_disease",
+    "courses_of_action",
+    "signals_to_proceed_surgery",
+    "get_to_know_this_surgery",
+    "comparisons",
+    "getting_ready",
+    "recovery",
+    "side_effects",
+    "review_4_5_stars",
+)
+# The free text fields, from which repeated lines and boilerplate are removed; the fields before are kept as is
+TEXT_FIELDS = NARROW_CONTEXT_FIELDS[NARROW_CONTEXT_FIELDS.index("package_details") :]
+DEFAULT_TOKEN_BUDGET = 1500
+# Values the catalog export uses for a missing field
+EMPTY_VALUES = {"", "none", "nan", "null", "-", "n/a"}
+# A field cut to fit the budget is only kept if this many of its tokens fit
+MIN_TRUNCATED_TOKENS = 50
+WHITESPACE = re.compile(r"\s+")
+
+
+def get_encoding(model: str | None = None) -> tiktoken.Encoding:
+    """The tokenizer of the chat model, the one configured for the app by default."""
+    if model is None:
+        if os.getenv("OPENAI_CHAT_HOST") == "azure":
+            model = os.getenv("AZURE_OPENAI_CHAT_MODEL")
+        else:
+            model = os.getenv("OPENAICOM_CHAT_MODEL")
+    try:
+        return tiktoken.encoding_for_model(model or "")
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def is_empty(value) -> bool:
+    return value is None or str(value).strip().lower() in EMPTY_VALUES
+
+
+def normalize_line(line: str) -> str:
+    return WHITESPACE.sub(" ", line).strip()
+
+
+def find_boilerplate(packages, min_share: float = 0.5, min_packages: int = 3) -> set[str]:
+    """Lines found in at least min_share of the packages, like disclaimers appended to every package."""
+    if min_share <= 0:
+        return set()
+    counts = Counter()
+    for package in packages:
+        lines = set()
+        for field in TEXT_FIELDS:
+            value = getattr(package, field)
+            if not is_empty(value):
+                lines.update(normalize_line(line) for line in str(value).splitlines())
+        counts.update(lines - {""})
+    threshold = max(min_packages, min_share * len(packages))
+    return {line for line, count in counts.items() if count >= threshold}
+
+
+def build_narrow_context(
+    package, encoding: tiktoken.Encoding, token_budget: int = DEFAULT_TOKEN_BUDGET, boilerplate: set[str] = frozenset()
+) -> str:
+    """The narrow RAG context of a package: its non-empty fields in priority order, without lines repeated from
+    earlier fields or found in the boilerplate, cut to token_budget tokens."""
+    parts, seen, used = [], set(), 0
+    for field in NARROW_CONTEXT_FIELDS:
+        value = getattr(package, field)
+        if is_empty(value):
+            continue
+        if field in TEXT_FIELDS:
+            lines = []
+            for line in str(value).splitlines():
+                key = normalize_line(line)
+                if not key or key in seen or key in boilerplate:
+                    continue
+                seen.add(key)
+                lines.append(line.rstrip())
+            if not lines:
+                continue
+            value = "\n".join(lines)
+        part = f"    {field}: {value}\n"
+        tokens = encoding.encode(part)
+        if used + len(tokens) > token_budget:
+            remaining = token_budget - used
+            if remaining >= MIN_TRUNCATED_TOKENS:
+                parts.append(encoding.decode(tokens[: remaining - 1], errors="ignore").rstrip() + "…\n")
+            break
+        parts.append(part)
+        used += len(tokens)
+    # Same layout as Package.to_str_for_narrow_rag
+    return "\n" + "".join(parts) + "    "
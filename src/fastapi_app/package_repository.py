@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from sqlalchemy import String, any_, bindparam, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from fastapi_app.postgres_models import Package, PackageView
+from fastapi_app.single_flight import SingleFlight
+
+if TYPE_CHECKING:
+    from fastapi_app.catalog import CatalogSnapshot
+
+# Package loads in flight in this worker, by view and canonical URL, shared by the repositories of all requests
+package_loads = SingleFlight("package_lookup")
+
+
+def normalize_package_url(url: str) -> str:
+    """Canonical form of a package URL: https, no trailing slash, no fragment and no utm_* parameters."""
+    parts = urlsplit(url.strip())
+    query = urlencode([(key, value) for key, value in parse_qsl(parts.query) if not key.startswith("utm_")])
+    return urlunsplit(("https", parts.netloc.lower(), parts.path.rstrip("/"), query, ""))
+
+
+def url_variants(url: str) -> list[str]:
+    """The forms a package URL may be stored in, the canonical one first."""
+    canonical = normalize_package_url(url)
+    parts = urlsplit(canonical)
+    variants = [canonical]
+    for scheme in ("https", "http"):
+        for path in (parts.path, parts.path + "/"):
+            variant = urlunsplit((scheme, parts.netloc, path, parts.query, ""))
+            if variant not in variants:
+                variants.append(variant)
+    if url not in variants:
+        variants.append(url)
+    return variants
+
+
+class PackageRepository:
+    """Loads packages by URL in batches, one query per batch, remembering every package it has loaded.
+
+    Meant to live for one request: the same package is never fetched twice while answering it. With a catalog
+    snapshot, packages are served from memory without querying the database.
+
+    Given a view, such as PackageCard, only the columns of the view are loaded, into records of the view.
+    """
+
+    def __init__(self, async_session_maker: async_sessionmaker, snapshot: CatalogSnapshot | None = None):
+        self.async_session_maker = async_session_maker
+        self.snapshot = snapshot
+        # Per view (Package for full rows): canonical URL -> package, or None when it is known not to exist
+        self.identity_maps: dict[type, dict[str, Package | PackageView | None]] = defaultdict(dict)
+
+    async def get_many(
+        self, urls: list[str], view: type[PackageView] | None = None
+    ) -> list[Package | PackageView | None]:
+        """Return the package of each URL, in the order given, with None for the URLs without one."""
+        if self.snapshot is not None:
+            packages = [self.snapshot.get(url) for url in urls]
+            if view is None:
+                return packages
+            return [None if package is None else view.from_package(package) for package in packages]
+        identity_map = self.identity_maps[view or Package]
+        missing = {normalize_package_url(url) for url in urls} - identity_map.keys()
+        if missing:
+            # URLs another request is loading in the same view are awaited rather than loaded again
+            loaded = await package_loads.do_many(((view, canonical) for canonical in missing), self.load)
+            for (_, canonical), package in loaded.items():
+                identity_map[canonical] = package
+        return [identity_map[normalize_package_url(url)] for url in urls]
+
+    async def load(self, keys: list[tuple[type[PackageView] | None, str]]) -> dict:
+        """Load the packages of (view, canonical URL) keys of one view in one query, None for those not found."""
+        view = keys[0][0]
+        variants = {variant: canonical for _, canonical in keys for variant in url_variants(canonical)}
+        async with self.async_session_maker() as session:
+            # A single array parameter, so the statement is the same whatever the number of URLs
+            urls_param = bindparam("urls", list(variants), type_=ARRAY(String))
+            where = Package.url == any_(urls_param)
+            if view is None:
+                packages = (await session.scalars(select(Package).where(where))).all()
+            else:
+                packages = [view(*row) for row in await session.execute(view.select().where(where))]
+        found = {}
+        # Prefer the row stored under the canonical URL when several variants exist
+        for package in sorted(packages, key=lambda package: package.url != variants[package.url]):
+            found.setdefault(variants[package.url], package)
+        return {key: found.get(key[1]) for key in keys}
+
+    def remember(self, packages: list[Package | PackageView]) -> None:
+        for package in packages:
+            self.identity_maps[type(package)].setdefault(normalize_package_url(package.url), package)
+
+    async def get(self, url: str, view: type[PackageView] | None = None) -> Package | PackageView | None:
+        return (await self.get_many([url], view))[0]
+
+    async def get_found(self, urls: list[str], view: type[PackageView] | None = None) -> list[Package | PackageView]:
+        """Return the distinct packages found for the URLs, in the order given."""
+        packages, seen = [], set()
+        for package in await self.get_many(urls, view):
+            if package is not None and package.url not in seen:
+                seen.add(package.url)
+                packages.append(package)
+        return packages
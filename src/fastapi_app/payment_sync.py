@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+import requests
+from sqlalchemy import func, select, text, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from fastapi_app.postgres_models import Package
+from fastapi_app.update_narrow_context import update_narrow_contexts
+
+logger = logging.getLogger("ragapp")
+
+# Key of the Postgres advisory lock held by the worker syncing the payment data
+SYNC_LOCK_KEY = 4615
+# How often the workers check whether the payment data is due for a sync
+CHECK_INTERVAL = 300
+
+
+def as_datetime(value) -> datetime | None:
+    # Catalog snapshots decoded from JSON hold the sync time as an ISO string
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def is_payment_synced(package, max_age: float) -> bool:
+    """Whether the synced payment data of the package is at most max_age seconds old, never with max_age 0."""
+    synced_at = as_datetime(getattr(package, "payment_synced_at", None))
+    if not max_age or synced_at is None:
+        return False
+    return datetime.now(timezone.utc) - synced_at <= timedelta(seconds=max_age)
+
+
+def parse_cash_discount(data) -> float:
+    """The cash discount in baht from the Apps Script "discount" answer, 0 when there is none."""
+    try:
+        return float(data) if data else 0.0
+    except (TypeError, ValueError):
+        logger.warning("Unexpected cash discount %r", data)
+        return 0.0
+
+
+async def fetch_payment_data(apps_script_client, url: str, price: float | None) -> dict | None:
+    """The synced columns of one package, or None if the Apps Script could not be reached or gave an unexpected
+    answer."""
+    try:
+        discount, payment = await asyncio.gather(
+            asyncio.to_thread(apps_script_client.call, "discount", package_url=url, use_last_answer=False),
+            asyncio.to_thread(apps_script_client.call, "payment_method", package_url=url, use_last_answer=False),
+        )
+    except requests.exceptions.RequestException as e:
+        logger.warning("Could not fetch the payment data of %s: %s", url, e)
+        return None
+    if payment is not None and not isinstance(payment, dict):
+        # An error message or other unexpected answer, the package keeps its previous data
+        logger.warning("Unexpected payment method answer for %s: %r", url, payment)
+        return None
+    cash_discount = parse_cash_discount(discount)
+    return {
+        "url": url,
+        "cash_discount": cash_discount,
+        "price_after_cash_discount": price - cash_discount if price is not None else None,
+        "payment_method": payment.get("paymentMethod") if payment else None,
+        "payment_synced_at": datetime.now(timezone.utc),
+    }
+
+
+async def sync_payment_data(engine, apps_script_client, concurrency: int = 8, batch_size: int = 200) -> int:
+    """Fetch the cash discount and payment methods of every package from the Apps Script and write them to
+    packages_all, one batch at a time. Packages that could not be fetched keep their previous data and sync time.
+
+    The precomputed narrow contexts embed the cash discount and the price after it, so they are recomputed after."""
+    async with engine.connect() as conn:
+        packages = (await conn.execute(select(Package.url, Package.price))).all()
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(url: str, price: float | None) -> dict | None:
+        async with semaphore:
+            return await fetch_payment_data(apps_script_client, url, price)
+
+    synced = 0
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+        for start in range(0, len(packages), batch_size):
+            batch = packages[start : start + batch_size]
+            rows = [row for row in await asyncio.gather(*(fetch(url, price) for url, price in batch)) if row]
+            if rows:
+                # Bulk update by primary key, one executemany, committed per batch so a failure keeps the progress
+                await session.execute(update(Package), rows)
+                await session.commit()
+            synced += len(rows)
+    logger.info("Synced the payment data of %d of %d packages", synced, len(packages))
+    if synced:
+        await update_narrow_contexts(engine, precomputed_only=True)
+    return synced
+
+
+async def get_last_sync(engine) -> datetime | None:
+    """When the payment data was last synced."""
+    async with engine.connect() as conn:
+        return (await conn.execute(select(func.max(Package.payment_synced_at)))).scalar()
+
+
+async def keep_payment_data_fresh(engine, apps_script_client, interval: float = 3600) -> None:
+    """Sync the payment data once it is older than interval seconds, in one worker at a time. Runs until cancelled."""
+
+    def is_due(last_sync: datetime | None) -> bool:
+        return last_sync is None or datetime.now(timezone.utc) - last_sync > timedelta(seconds=interval)
+
+    while True:
+        try:
+            if is_due(await get_last_sync(engine)):
+                async with engine.connect() as conn:
+                    # Session-level lock, held on this connection while the sync writes through others
+                    locked = await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": SYNC_LOCK_KEY})
+                    if locked.scalar():
+                        try:
+                            # Another worker may have synced between the check and the lock
+                            if is_due(await get_last_sync(engine)):
+                                await sync_payment_data(engine, apps_script_client)
+                        finally:
+                            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SYNC_LOCK_KEY})
+        except Exception as e:
+            logger.warning("Failed to sync the payment data: %s", e)
+        await asyncio.sleep(min(interval, CHECK_INTERVAL))
@@ -1,9 +1,22 @@
 from __future__ import annotations
 
-from dataclasses import asdict
+from dataclasses import fields
+from datetime import date, datetime
 
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import Computed, DateTime, Index, Select, case, func, select
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.orm import DeclarativeBase, Mapped, MappedAsDataclass, mapped_column
 
+# Matches text-embedding-ada-002 and text-embedding-3-small; other models must be asked for 1536 dimensions
+EMBEDDING_DIMENSIONS = 1536
+# Postgres has no Thai text search parser, so the 'simple' configuration indexes whitespace-separated words as-is
+FULLTEXT_CONFIG = "simple"
+FULLTEXT_EXPRESSION = (
+    f"to_tsvector('{FULLTEXT_CONFIG}', coalesce(package_name, '') || ' ' || coalesce(category, '') || ' ' "
+    "|| coalesce(brand, '') || ' ' || coalesce(shop_name, '') || ' ' || coalesce(locations, ''))"
+)
+
 
 # Define the models
 class Base(DeclarativeBase, MappedAsDataclass):
@@ -44,9 +57,47 @@ class Package(Base):
     side_effects: Mapped[str] = mapped_column()
     review_4_5_stars: Mapped[str] = mapped_column()
     faq: Mapped[str] = mapped_column()
+    # The rendered narrow RAG context, precomputed by update_narrow_context.py
+    narrow_context: Mapped[str | None] = mapped_column(nullable=True, default=None, repr=False)
+    # Synced from the Apps Script by payment_sync.py along with cash_discount and price_after_cash_discount
+    payment_method: Mapped[str | None] = mapped_column(nullable=True, default=None, repr=False)
+    payment_synced_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True, default=None, repr=False
+    )
+    # Search columns, deferred so that loading a package does not pull them
+    embedding: Mapped[list[float] | None] = mapped_column(
+        Vector(EMBEDDING_DIMENSIONS), nullable=True, deferred=True, init=False, default=None, repr=False
+    )
+    search_vector: Mapped[str | None] = mapped_column(
+        TSVECTOR, Computed(FULLTEXT_EXPRESSION, persisted=True), deferred=True, init=False, repr=False
+    )
+
+    __table_args__ = (
+        Index(
+            "hnsw_index_for_cosine_packages_all_embedding",
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_cosine_ops"},
+        ),
+        Index("ix_packages_all_search_vector", "search_vector", postgresql_using="gin"),
+        # Serves the price ranges of hybrid_search
+        Index("ix_packages_all_price", "price"),
+        # Trigram indexes, which serve the '%...%' LIKE filters and similarity matches of simple_sql_search
+        Index("ix_packages_all_url_trgm", "url", postgresql_using="gin", postgresql_ops={"url": "gin_trgm_ops"}),
+        Index(
+            "ix_packages_all_package_name_trgm",
+            "package_name",
+            postgresql_using="gin",
+            postgresql_ops={"package_name": "gin_trgm_ops"},
+        ),
+    )
 
     def to_dict(self):
-        return asdict(self)
+        return {field.name: getattr(self, field.name) for field in fields(self) if field.name not in SEARCH_COLUMNS}
+
+    def to_str_for_embedding(self):
+        return f"{self.package_name} {self.category} {self.brand} {self.shop_name} {self.locations}"
 
     def to_str_for_broad_rag(self):
         return f"""
@@ -58,6 +109,8 @@ class Package(Base):
     """
 
     def to_str_for_narrow_rag(self):
+        if self.narrow_context:
+            return self.narrow_context
         return f"""
     package_name: {self.package_name}
     package_picture: {self.package_picture}
@@ -90,3 +143,149 @@ class Package(Base):
     review_4_5_stars: {self.review_4_5_stars}
     faq: {self.faq}
     """
+
+
+SEARCH_COLUMNS = ("embedding", "search_vector")
+
+
+class PackageView:
+    """The columns of a package one context view needs, as a plain record instead of a full ORM instance."""
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for column, value in zip(self.__slots__, values, strict=True):
+            setattr(self, column, value)
+
+    @classmethod
+    def select(cls) -> Select:
+        """Select just the columns of the view, each result row being the arguments of the constructor."""
+        return select(*(getattr(Package, column) for column in cls.__slots__))
+
+    @classmethod
+    def from_package(cls, package: Package) -> PackageView:
+        return cls(*(getattr(package, column) for column in cls.__slots__))
+
+    @classmethod
+    def from_dict(cls, values: dict) -> PackageView:
+        return cls(*(values.get(column) for column in cls.__slots__))
+
+    def to_dict(self):
+        return {column: getattr(self, column) for column in self.__slots__}
+
+    def __repr__(self):
+        return f"{type(self).__name__}(url={self.url!r})"
+
+
+class PackageCard(PackageView):
+    """The broad view: a few columns for each result of a search."""
+
+    __slots__ = ("url", "package_name", "locations", "price", "category")
+
+    to_str_for_broad_rag = Package.to_str_for_broad_rag
+
+
+class PackageDetail(PackageView):
+    """The narrow view: everything the answer about a specified package is based on."""
+
+    # Read even when the context is precomputed
+    context_columns = ("url", "package_name", "category", "narrow_context", "cash_discount", "payment_synced_at")
+
+    __slots__ = (
+        "package_name",
+        "package_picture",
+        "url",
+        "price",
+        "cash_discount",
+        "installment_month",
+        "price_after_cash_discount",
+        "installment_limit",
+        "price_to_reserve_for_this_package",
+        "category",
+        "brand",
+        "min_max_age",
+        "locations",
+        "price_details",
+        "package_details",
+        "important_info",
+        "general_info",
+        "early_signs_for_diagnosis",
+        "how_to_diagnose",
+        "hdcare_summary",
+        "common_question",
+        "know_this_disease",
+        "courses_of_action",
+        "signals_to_proceed_surgery",
+        "get_to_know_this_surgery",
+        "comparisons",
+        "getting_ready",
+        "recovery",
+        "side_effects",
+        "review_4_5_stars",
+        "faq",
+        "narrow_context",
+        "payment_synced_at",
+    )
+
+    @classmethod
+    def select(cls, with_fields: bool = False) -> Select:
+        """The other columns are only needed to render the context of packages without a precomputed one, unless
+        with_fields, for section selection to read every section rather than the ones the context budget kept."""
+        if with_fields:
+            return super().select()
+        columns = [
+            getattr(Package, column)
+            if column in cls.context_columns
+            else case((Package.narrow_context.is_(None), getattr(Package, column))).label(column)
+            for column in cls.__slots__
+        ]
+        return select(*columns)
+
+    to_str_for_narrow_rag = Package.to_str_for_narrow_rag
+
+
+class PackagePayment(PackageView):
+    """The payment data of a package, synced by payment_sync.py."""
+
+    __slots__ = ("url", "price", "cash_discount", "price_after_cash_discount", "payment_method", "payment_synced_at")
+
+
+class ChatTrace(Base):
+    __tablename__ = "chat_traces"
+    trace_id: Mapped[str] = mapped_column(primary_key=True)
+    route: Mapped[str | None] = mapped_column()
+    trace: Mapped[dict] = mapped_column(JSONB)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), index=True, init=False
+    )
+
+
+class GoogleSearchQuota(Base):
+    """Custom Search requests spent per quota day, shared by all workers. See google_quota.py."""
+
+    __tablename__ = "google_search_quota"
+    day: Mapped[date] = mapped_column(primary_key=True)
+    spent: Mapped[int] = mapped_column(default=0)
+
+
+class HighlightCampaign(Base):
+    """A highlight campaign as the Apps Script returns it for a tag or a package URL, synced by
+    sync_highlight_campaigns.py. Tags without a campaign are kept, with campaign None, for the query prompt."""
+
+    __tablename__ = "highlight_campaigns"
+    # "tag" or "url"
+    kind: Mapped[str] = mapped_column(primary_key=True)
+    key: Mapped[str] = mapped_column(primary_key=True)
+    # Order of the tags in the Apps Script list
+    position: Mapped[int] = mapped_column(default=0)
+    campaign: Mapped[dict | list | None] = mapped_column(JSONB, nullable=True, default=None)
+    synced_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
+
+
+class HighlightSync(Base):
+    """When the last highlight campaign sync completed, failed fetches included, in a single row. The campaigns
+    that failed keep their old sync time, so the oldest of those says nothing about when the last run was."""
+
+    __tablename__ = "highlight_sync"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    completed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
@@ -1,68 +1,280 @@
-from sqlalchemy import String, select, text
+import asyncio
+import logging
+from collections import defaultdict
+
+from sqlalchemy import ColumnElement, Float, String, and_, func, or_, text
 from sqlalchemy.ext.asyncio import async_sessionmaker
 
+from fastapi_app.bm25_index import BM25Index
+from fastapi_app.catalog import CatalogSnapshot
+from fastapi_app.embeddings import compute_text_embedding
+from fastapi_app.google_quota import GoogleQuota
 from fastapi_app.google_search import google_search_function
-from fastapi_app.postgres_models import Package
+from fastapi_app.package_repository import PackageRepository, normalize_package_url
+from fastapi_app.postgres_models import FULLTEXT_CONFIG, Package, PackageCard, PackageDetail
+from fastapi_app.price_filter import PriceRange
+
+logger = logging.getLogger("ragapp")
+
+# Columns and operators simple_sql_search filters may use; anything else is ignored
+FILTER_COLUMNS = {
+    name: getattr(Package, name)
+    for name in (
+        "url",
+        "package_name",
+        "category",
+        "brand",
+        "shop_name",
+        "locations",
+        "price",
+        "cash_discount",
+        "price_after_cash_discount",
+    )
+}
+FILTER_OPERATORS = ("=", "!=", "<>", "<", "<=", ">", ">=", "LIKE", "ILIKE")
+# Columns with a pg_trgm index, see setup_postgres_database.py
+TRIGRAM_COLUMNS = ("url", "package_name")
+# "like" runs the filters as given, "similarity" also matches similar URLs and package names and ranks by similarity
+SQL_SEARCH_MODES = ("like", "similarity")
+
+# "google" maps Google Custom Search results to packages, "google_fanout" too but with one query per location,
+# "hybrid" searches packages_all itself, "bm25" searches the in-process BM25 index of the catalog
+RETRIEVAL_MODES = ("google", "google_fanout", "hybrid", "bm25")
+# Per-location queries of google_fanout_search: at most this many locations, and searches in flight at once,
+# enough for all of them to run in one wave
+MAX_FANOUT_LOCATIONS = 4
+MAX_FANOUT_CONCURRENCY = 5
+# Weight in the rank fusion of the query without location, the locations being weighted 1, 1/2, 1/3...
+FANOUT_BASE_WEIGHT = 0.5
+# Retriever to use when the primary one finds nothing, e.g. once the daily Google quota is spent
+RETRIEVAL_FALLBACKS = ("none", "bm25")
+
+
+def fanout_queries(search_query: str, locations: list[str]) -> list[tuple[str, float]]:
+    """The (query, weight) of each search of google_fanout_search, the base query first.
+
+    The location queries carry no exact term: the quoted location already narrows them, and with one the search
+    would send a second, relaxed request whenever the exact one finds nothing."""
+    queries = [(search_query, FANOUT_BASE_WEIGHT)]
+    for position, location in enumerate(locations[:MAX_FANOUT_LOCATIONS]):
+        queries.append((f'{search_query} "{location}"', 1 / (position + 1)))
+    return queries
+
+
+def filter_by_price(packages: list, price_range: PriceRange | None) -> list:
+    if price_range is None:
+        return packages
+    return [package for package in packages if price_range.contains(package.price)]
 
 
 class PostgresSearcher:
     def __init__(
         self,
         engine,
+        search_function=google_search_function,
+        retrieval_mode: str = "google",
+        openai_embed_client=None,
+        embed_model: str | None = None,
+        embed_deployment: str | None = None,  # Not needed for non-Azure OpenAI
+        embed_dimensions: int = 1536,
+        bm25_index: BM25Index | None = None,
+        fallback_mode: str = "none",
+        catalog_snapshot: CatalogSnapshot | None = None,
+        sql_search_mode: str = "like",
+        detail_fields: bool = False,
+        google_quota: GoogleQuota | None = None,
     ):
         self.async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
+        # Searchers are created per request, so packages loaded by one search are reused by the next
+        self.repository = PackageRepository(self.async_session_maker, snapshot=catalog_snapshot)
+        # Async function returning the result links for a query, swappable e.g. to replay recorded Google results
+        self.search_function = search_function
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {retrieval_mode!r}, expected one of {RETRIEVAL_MODES}")
+        self.retrieval_mode = retrieval_mode
+        self.openai_embed_client = openai_embed_client
+        self.embed_model = embed_model
+        self.embed_deployment = embed_deployment
+        self.embed_dimensions = embed_dimensions
+        if fallback_mode not in RETRIEVAL_FALLBACKS:
+            raise ValueError(f"Unknown retrieval fallback {fallback_mode!r}, expected one of {RETRIEVAL_FALLBACKS}")
+        self.bm25_index = bm25_index
+        self.fallback_mode = fallback_mode if bm25_index is not None else "none"
+        if sql_search_mode not in SQL_SEARCH_MODES:
+            raise ValueError(f"Unknown SQL search mode {sql_search_mode!r}, expected one of {SQL_SEARCH_MODES}")
+        self.sql_search_mode = sql_search_mode
+        # Load every field of the specified packages even when their context is precomputed, for section selection
+        self.detail_fields = detail_fields
+        # Daily Google budget, which the fan-out searches size their number of queries by
+        self.google_quota = google_quota
+
+    def build_filter_clause(self, filters: list[dict] | None, use_or: bool = False) -> ColumnElement | None:
+        """Combine the filters into a WHERE clause with bound values, skipping unknown columns and operators."""
+        clauses = []
+        for filter in filters or []:
+            column = FILTER_COLUMNS.get(filter["column"])
+            operator = filter["comparison_operator"].upper()
+            if column is None or operator not in FILTER_OPERATORS:
+                logger.warning("Ignoring filter %s %s", filter["column"], filter["comparison_operator"])
+                continue
+            clauses.append(column.op(operator, is_comparison=True)(filter["value"]))
+        if not clauses:
+            return None
+        return or_(*clauses) if use_or else and_(*clauses)
 
-    def build_filter_clause(self, filters, use_or=False) -> tuple[str, str]:
-        if filters is None:
-            return "", ""
-        filter_clauses = []
-        for filter in filters:
-            if isinstance(filter["value"], str):
-                filter["value"] = f"'{filter['value']}'"
-            filter_clauses.append(f"{filter['column']} {filter['comparison_operator']} {filter['value']}")
-        filter_clause = f" {'OR' if use_or else 'AND'} ".join(filter_clauses)
-        if len(filter_clause) > 0:
-            return f"WHERE {filter_clause}", f"AND {filter_clause}"
-        return "", ""
-
-    async def simple_sql_search(self, filters: list[dict]) -> list[Package]:
+    def build_similarity_terms(self, filters: list[dict]) -> list[tuple[ColumnElement, str]]:
+        """The (column, text) pairs of the LIKE filters on trigram-indexed columns, without their wildcards."""
+        terms = []
+        for filter in filters or []:
+            operator = filter["comparison_operator"].upper()
+            if (
+                filter["column"] in TRIGRAM_COLUMNS
+                and operator in ("LIKE", "ILIKE")
+                and isinstance(filter["value"], str)
+            ):
+                if term := filter["value"].strip("%"):
+                    terms.append((FILTER_COLUMNS[filter["column"]], term))
+        return terms
+
+    async def simple_sql_search(self, filters: list[dict], limit: int = 10) -> list[PackageDetail]:
         """
         Search items by simple SQL query with filters.
+        In similarity mode, LIKE filters on the URL or package name also match similar text, best match first.
         """
-        filter_clause_where, _ = self.build_filter_clause(filters, use_or=True)
-        sql = f"""
-        SELECT url FROM packages_all
-        {filter_clause_where}
-        LIMIT 10
-        """
+        similarity_terms = self.build_similarity_terms(filters) if self.sql_search_mode == "similarity" else []
+        if self.repository.snapshot is not None and not similarity_terms:
+            packages = self.repository.snapshot.filter(filters, use_or=True, limit=limit)
+            if packages is not None:
+                return [PackageDetail.from_package(package) for package in packages]
 
-        async with self.async_session_maker() as session:
-            results = (await session.execute(text(sql).columns(url=String))).fetchall()
+        filter_clause = self.build_filter_clause(filters, use_or=True)
+        if filter_clause is None and not similarity_terms:
+            # Without a usable filter any package would match, leave it to the other searches
+            return []
+        sql = PackageDetail.select(with_fields=self.detail_fields)
+        if similarity_terms:
+            # "%" is the pg_trgm similarity operator, which the trigram indexes serve like ILIKE
+            fuzzy_clauses = [column.op("%", is_comparison=True)(term) for column, term in similarity_terms]
+            filter_clause = or_(filter_clause, *fuzzy_clauses) if filter_clause is not None else or_(*fuzzy_clauses)
+            similarity = func.greatest(*[func.similarity(column, term) for column, term in similarity_terms])
+            sql = sql.order_by(similarity.desc())
+        if filter_clause is not None:
+            sql = sql.where(filter_clause)
 
-            # Convert results to Package models
-            items = []
-            for result in results:
-                item_url = result.url
-                package = await session.execute(select(Package).where(Package.url == item_url))
-                items.append(package.scalar())
-            return items
+        async with self.async_session_maker() as session:
+            packages = [PackageDetail(*row) for row in await session.execute(sql.limit(limit))]
+        self.repository.remember(packages)
+        return packages
 
-    async def google_search(self, query_text: str, exact_term: str, top: int = 3) -> list[str]:
+    async def google_search(
+        self, query_text: str, exact_term: str, top: int = 3, price_range: PriceRange | None = None
+    ) -> tuple[list[PackageCard], bool]:
         """
         Search items by query text using Google search.
         """
-        results = google_search_function(query_text, exact_term=exact_term)
+        results = await self.search_function(query_text, exact_term=exact_term)
+        # The search function returns an error dict instead of links when the request fails
+        links = results if isinstance(results, list) else []
+        packages = filter_by_price(await self.repository.get_found(links, view=PackageCard), price_range)[:top]
+        return packages, bool(packages)
+
+    async def google_fanout_search(
+        self,
+        query_text: str,
+        locations: list[str],
+        top: int = 3,
+        rrf_k: int = 60,
+        price_range: PriceRange | None = None,
+    ) -> tuple[list[PackageCard], bool]:
+        """
+        Search items with Google once without and once per location, concurrently, and fuse the results with
+        Reciprocal Rank Fusion, the locations mentioned first weighing more.
+        """
+        if self.google_quota is not None:
+            # Every query may cost a request of the paced daily budget, and they are sent at once: when little of
+            # it is left, the locations mentioned last are dropped instead of the budget being spent on them
+            locations = locations[: max(await self.google_quota.remaining() - 1, 0)]
+        semaphore = asyncio.Semaphore(MAX_FANOUT_CONCURRENCY)
+
+        async def search(query: str) -> list[str]:
+            async with semaphore:
+                results = await self.search_function(query)
+            return results if isinstance(results, list) else []
+
+        queries = fanout_queries(query_text, locations)
+        results = await asyncio.gather(*(search(query) for query, _ in queries))
+        scores, links = defaultdict(float), {}
+        for (_, weight), result_links in zip(queries, results):
+            for rank, link in enumerate(result_links, start=1):
+                url = normalize_package_url(link)
+                scores[url] += weight / (rrf_k + rank)
+                links.setdefault(url, link)
+        fused_links = [links[url] for url in sorted(scores, key=scores.get, reverse=True)]
+        packages = filter_by_price(await self.repository.get_found(fused_links, view=PackageCard), price_range)[:top]
+        return packages, bool(packages)
+
+    async def hybrid_search(
+        self,
+        query_text: str,
+        locations: list[str] | None = None,
+        top: int = 3,
+        rrf_k: int = 60,
+        price_range: PriceRange | None = None,
+    ) -> tuple[list[PackageCard], bool]:
+        """
+        Search items by vector similarity and full text, fused with Reciprocal Rank Fusion.
+        """
+        query_vector = await compute_text_embedding(
+            query_text,
+            self.openai_embed_client,
+            self.embed_model,
+            embed_deployment=self.embed_deployment,
+            embedding_dimensions=self.embed_dimensions,
+        )
+        location_clause = "AND locations ILIKE ANY(:location_patterns)" if locations else ""
+        price_clause, price_params = price_range.sql_clause("price") if price_range is not None else ("", {})
+        vector_query = f"""
+            SELECT url, RANK () OVER (ORDER BY embedding <=> CAST(:embedding AS vector)) AS rank
+                FROM packages_all
+                WHERE embedding IS NOT NULL {location_clause}{price_clause}
+                ORDER BY embedding <=> CAST(:embedding AS vector)
+                LIMIT 20
+            """
+        fulltext_query = f"""
+            SELECT url, RANK () OVER (ORDER BY ts_rank_cd(search_vector, query) DESC) AS rank
+                FROM packages_all, plainto_tsquery('{FULLTEXT_CONFIG}', :query) query
+                WHERE search_vector @@ query {location_clause}{price_clause}
+                ORDER BY ts_rank_cd(search_vector, query) DESC
+                LIMIT 20
+            """
+        hybrid_query = f"""
+        WITH vector_search AS ({vector_query}), fulltext_search AS ({fulltext_query})
+        SELECT COALESCE(vector_search.url, fulltext_search.url) AS url,
+            COALESCE(1.0 / (:k + vector_search.rank), 0.0) +
+            COALESCE(1.0 / (:k + fulltext_search.rank), 0.0) AS score
+        FROM vector_search
+        FULL OUTER JOIN fulltext_search ON vector_search.url = fulltext_search.url
+        ORDER BY score DESC
+        LIMIT :top
+        """
+        params = {"embedding": str(query_vector), "query": query_text, "k": rrf_k, "top": top, **price_params}
+        if locations:
+            params["location_patterns"] = [f"%{location}%" for location in locations]
+
         async with self.async_session_maker() as session:
-            items = []
-            for result in results:
-                package = await session.execute(select(Package).where(Package.url == result))
-                package = package.scalar()
-                if package:
-                    items.append(package)
-            if items:
-                is_package_found = True
-                packages = items[:top]
-            else:
-                is_package_found = False
-                packages = []
-            return packages, is_package_found
+            results = (await session.execute(text(hybrid_query).columns(url=String, score=Float), params)).fetchall()
+        packages = await self.repository.get_found([result.url for result in results], view=PackageCard)
+        return packages, bool(packages)
+
+    async def bm25_search(
+        self, query_text: str, locations: list[str] | None = None, top: int = 3, price_range: PriceRange | None = None
+    ) -> tuple[list[PackageCard], bool]:
+        """
+        Search items with the in-process BM25 index, without any network call but the package lookup.
+        """
+        if self.bm25_index is None:
+            return [], False
+        results = self.bm25_index.search(query_text, locations=locations, top=top, price_range=price_range)
+        urls = [url for url, _ in results]
+        packages = await self.repository.get_found(urls, view=PackageCard)
+        return packages, bool(packages)
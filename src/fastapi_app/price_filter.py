@@ -0,0 +1,106 @@
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+THAI_DIGITS = str.maketrans("๐๑๒๓๔๕๖๗๘๙", "0123456789")
+MULTIPLIERS = {"k": 1_000, "พัน": 1_000, "หมื่น": 10_000, "แสน": 100_000, "ล้าน": 1_000_000}
+# An amount: a number, not part of a URL, a phone number or a word, with thousands separators or a multiplier
+# ("3,000", "3k", "1.5 หมื่น") and a currency, captured as (number, multiplier, currency)
+AMOUNT_BODY = rf"(\d[\d,]*(?:\.\d+)?)(?!\d)\s*({'|'.join(MULTIPLIERS)})?(?![a-z0-9])\s*(บาท|baht|thb|฿)?"
+AMOUNT = rf"(?<![a-z0-9/._-]){AMOUNT_BODY}"
+PRICE_WORD = r"\s*(?:ราคา|price)?\s*"
+RANGE_PATTERN = re.compile(rf"{AMOUNT}\s*(?:-|–|~|ถึง|to|and)\s*{AMOUNT_BODY}(?![-\d])")
+MAXIMUM_PATTERN = re.compile(
+    r"(?:ไม่เกิน|(?<!ไม่)ต่ำกว่า|(?<!ไม่)น้อยกว่า|ไม่ถึง|ไม่แพงกว่า|ภายใน|งบ(?:ประมาณ)?|under|below|less than|"
+    rf"cheaper than|at most|max(?:imum)?|up to|within|budget(?: of| is)?|<=?){PRICE_WORD}{AMOUNT}"
+)
+MINIMUM_PATTERN = re.compile(
+    rf"(?:ไม่ต่ำกว่า|ไม่น้อยกว่า|มากกว่า|(?<!ไม่)เกิน|สูงกว่า|ตั้งแต่|over|above|more than|at least|from|>=?){PRICE_WORD}{AMOUNT}"
+)
+MINIMUM_SUFFIX_PATTERN = re.compile(rf"{AMOUNT}\s*(?:ขึ้นไป|or more|and up|\+)")
+AROUND_PATTERN = re.compile(rf"(?:(?<!งบ)ประมาณ|ราวๆ?|around|about|approximately|~){PRICE_WORD}{AMOUNT}")
+AMOUNT_PATTERN = re.compile(AMOUNT)
+# Smaller amounts without a currency or multiplier are rather counts, ages or months ("ผ่อน 10 เดือน")
+MIN_PLAIN_AMOUNT = 100
+# Share of an approximate budget ("ประมาณ 3000") allowed either way
+AROUND_TOLERANCE = 0.2
+
+
+@dataclass(frozen=True)
+class PriceRange:
+    """Bounds on the package price in baht, None for an open end."""
+
+    minimum: float | None = None
+    maximum: float | None = None
+
+    def contains(self, price: float | None) -> bool:
+        if price is None or price != price:
+            return False
+        return (self.minimum is None or price >= self.minimum) and (self.maximum is None or price <= self.maximum)
+
+    def mask(self, prices: np.ndarray) -> np.ndarray:
+        """Which of the prices are in the range, NaN prices never being."""
+        mask = ~np.isnan(prices)
+        if self.minimum is not None:
+            mask &= prices >= self.minimum
+        if self.maximum is not None:
+            mask &= prices <= self.maximum
+        return mask
+
+    def sql_clause(self, column: str) -> tuple[str, dict]:
+        """The range as an "AND ..." condition on column with its parameters, served by a btree index on it."""
+        clause, params = "", {}
+        if self.minimum is not None:
+            clause += f" AND {column} >= :min_price"
+            params["min_price"] = self.minimum
+        if self.maximum is not None:
+            clause += f" AND {column} <= :max_price"
+            params["max_price"] = self.maximum
+        return clause, params
+
+    def to_dict(self) -> dict:
+        return {"minimum": self.minimum, "maximum": self.maximum}
+
+
+def parse_amount(number: str, multiplier: str | None, currency: str | None = None) -> float | None:
+    """The amount in baht, or None if it does not look like a price."""
+    amount = float(number.replace(",", "")) * MULTIPLIERS.get(multiplier or "", 1)
+    if multiplier is None and currency is None and amount < MIN_PLAIN_AMOUNT:
+        return None
+    return amount
+
+
+def parse_price_range(text: str | None, bare_amount_is_maximum: bool = False) -> PriceRange | None:
+    """The price range asked for in a message, e.g. "ไม่เกิน 3,000 บาท", "1-2 หมื่น" or "over 5k", or None.
+
+    With bare_amount_is_maximum, a lone amount ("3000 บาท") is read as a maximum, as in a budget."""
+    if not text:
+        return None
+    text = text.translate(THAI_DIGITS).lower()
+
+    if match := RANGE_PATTERN.search(text):
+        low_number, low_multiplier, low_currency, high_number, high_multiplier, high_currency = match.groups()
+        # "1-3 พัน" multiplies both ends, "1000-3000 บาท" prices both
+        low = parse_amount(low_number, low_multiplier or high_multiplier, low_currency or high_currency)
+        high = parse_amount(high_number, high_multiplier, high_currency)
+        if low is not None and high is not None and low <= high:
+            return PriceRange(low, high)
+
+    maximum = parse_amount(*match.groups()) if (match := MAXIMUM_PATTERN.search(text)) else None
+    minimum = None
+    for pattern in (MINIMUM_PATTERN, MINIMUM_SUFFIX_PATTERN):
+        if (match := pattern.search(text)) and (minimum := parse_amount(*match.groups())) is not None:
+            break
+    if minimum is not None and maximum is not None and minimum > maximum:
+        minimum = None
+    if minimum is not None or maximum is not None:
+        return PriceRange(minimum, maximum)
+
+    if (match := AROUND_PATTERN.search(text)) and (amount := parse_amount(*match.groups())) is not None:
+        return PriceRange(amount * (1 - AROUND_TOLERANCE), amount * (1 + AROUND_TOLERANCE))
+    if bare_amount_is_maximum:
+        for match in AMOUNT_PATTERN.finditer(text):
+            if (amount := parse_amount(*match.groups())) is not None:
+                return PriceRange(maximum=amount)
+    return None
@@ -1,17 +1,31 @@
+import asyncio
 import copy
 import json
 import logging
 import pathlib
+import time
 from collections.abc import AsyncGenerator
 from typing import Any
 
+import openai
 import requests
 from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletion
 from openai_messages_token_helper import get_token_limit
-from tenacity import before_sleep_log, retry, stop_after_attempt, wait_random_exponential
+from tenacity import (
+    before_sleep_log,
+    retry,
+    retry_if_not_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 
 from .api_models import ThoughtStep
+from .apps_script import AppsScriptClient
+from .category_index import CategoryIndex, category_search_url
+from .circuit_breaker import CircuitOpenError, get_breaker
+from .gazetteer import get_gazetteer
+from .highlight_campaigns import HighlightIndex
 from .llm_tools import (
     build_check_info_gathered_function,
     build_clear_history_function,
@@ -45,12 +59,25 @@ from .llm_tools import (
     is_pharmacy,
     is_welcome_intent,
 )
-from .postgres_searcher import PostgresSearcher
+from .metrics import observe_stage, record_external_error, record_llm_usage
+from .payment_sync import is_payment_synced
+from .postgres_models import PackagePayment
+from .postgres_searcher import PostgresSearcher, fanout_queries
+from .price_filter import parse_price_range
+from .section_selection import question_text, select_sections
+from .single_flight import SingleFlight
+from .usage import RequestUsage, usage_ledger
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Apps Script calls in flight in this worker, shared by the requests asking the same at the same time
+apps_script_calls = SingleFlight("apps_script")
+
+# OpenAI errors counting towards its circuit breaker: the endpoint is unreachable, overloaded or failing
+OPENAI_OUTAGE_ERRORS = (openai.APIConnectionError, openai.InternalServerError, openai.RateLimitError)
+
 
 class AdvancedRAGChat:
     def __init__(
@@ -60,12 +87,36 @@ class AdvancedRAGChat:
         openai_chat_client: AsyncOpenAI,
         chat_model: str,
         chat_deployment: str | None,  # Not needed for non-Azure OpenAI
+        apps_script_client: AppsScriptClient | None = None,
+        section_token_budget: int = 0,
+        location_expansion: str = "llm",
+        price_filter: bool = False,
+        category_index: CategoryIndex | None = None,
+        highlight_index: HighlightIndex | None = None,
+        payment_max_age: float = 0,
     ):
         self.searcher = searcher
+        self.apps_script_client = apps_script_client or AppsScriptClient()
         self.openai_chat_client = openai_chat_client
         self.chat_model = chat_model
         self.chat_deployment = chat_deployment
         self.chat_token_limit = get_token_limit(chat_model, default_to_minimum=True)
+        # Tokens of package context kept for a question about a specified package, 0 to keep all of it
+        self.section_token_budget = section_token_budget
+        # "llm" has the search tool list the districts around the user's location, "gazetteer" adds them locally
+        self.location_expansion = location_expansion
+        # Keep only the search results in the price range the user asks for, e.g. "ไม่เกิน 3000 บาท"
+        self.price_filter = price_filter
+        # Search URLs and cheapest packages by category, to suggest cheaper alternatives to the search results
+        self.category_index = category_index
+        # Highlight campaigns synced into Postgres, matched locally instead of calling the Apps Script per request
+        self.highlight_index = highlight_index
+        # Seconds the payment data synced into packages_all is used for before calling the Apps Script, 0 to always call
+        self.payment_max_age = payment_max_age
+        # Intent route taken by the last run(), e.g. "search" or "QISCUS_INTEGRATION_TO_BK"
+        self.route = None
+        # Token usage of every completion made while answering the request
+        self.usage = RequestUsage()
         current_dir = pathlib.Path(__file__).parent
         self.specify_package_prompt_template = open(current_dir / "prompts/specify_package.txt").read()
         self.query_prompt_template = open(current_dir / "prompts/query.txt").read()
@@ -83,9 +134,29 @@ class AdvancedRAGChat:
         wait=wait_random_exponential(min=1, max=60),
         stop=stop_after_attempt(6),
         before_sleep=before_sleep_log(logger, logging.WARNING),
+        # Once the breaker opens, fail the request at once instead of waiting through the remaining attempts
+        retry=retry_if_not_exception_type(CircuitOpenError),
     )
-    async def openai_chat_completion(self, *args, **kwargs) -> ChatCompletion:
-        return await self.openai_chat_client.chat.completions.create(*args, **kwargs)
+    async def openai_chat_completion(self, *args, stage: str = "answer", **kwargs) -> ChatCompletion:
+        breaker = get_breaker("openai")
+        breaker.check()
+        start = time.perf_counter()
+        try:
+            with observe_stage(f"llm_{stage}"):
+                chat_completion = await self.openai_chat_client.chat.completions.create(*args, **kwargs)
+        except OPENAI_OUTAGE_ERRORS:
+            record_external_error("openai")
+            breaker.record_failure()
+            raise
+        except openai.OpenAIError:
+            # The endpoint answered, the request itself was wrong
+            record_external_error("openai")
+            breaker.record_success()
+            raise
+        breaker.record_success()
+        record_llm_usage(stage, chat_completion.usage)
+        self.usage.add(stage, chat_completion.model, chat_completion.usage, time.perf_counter() - start)
+        return chat_completion
 
     @retry(
         wait=wait_random_exponential(min=1, max=10),
@@ -93,13 +164,8 @@ class AdvancedRAGChat:
         before_sleep=before_sleep_log(logger, logging.WARNING),
     )
     def get_payment_promos(self):
-        url = "https://script.google.com/macros/s/AKfycbw18wXh1o6xiD2WY3wcvkQXGZNn4AY2loJjdEqfBGC22xtluoz27L7VeiAyrcMRsFf6fw/exec"
-
         try:
-            body = {"info": "credit_card", "highlight_name": "", "highlight_url": "", "package_url": ""}
-            res = requests.post(url=url, json=body)
-            res.raise_for_status()
-            data = res.json()
+            data = self.apps_script_client.call("credit_card")
 
             payment_promos = "\n".join(
                 f"""
@@ -122,18 +188,10 @@ class AdvancedRAGChat:
         before_sleep=before_sleep_log(logger, logging.WARNING),
     )
     def get_highlight_info(self, highlight_name, highlight_url):
-        url = "https://script.google.com/macros/s/AKfycbw18wXh1o6xiD2WY3wcvkQXGZNn4AY2loJjdEqfBGC22xtluoz27L7VeiAyrcMRsFf6fw/exec"
-
+        if self.highlight_index is not None:
+            return self.highlight_index.match(highlight_name=highlight_name, highlight_url=highlight_url)
         try:
-            body = {
-                "info": "highlight",
-                "highlight_name": highlight_name,
-                "highlight_url": highlight_url,
-                "package_url": "",
-            }
-            res = requests.post(url=url, json=body)
-            res.raise_for_status()
-            return res.json()
+            return self.apps_script_client.call("highlight", highlight_name=highlight_name, highlight_url=highlight_url)
         except requests.exceptions.RequestException as e:
             print(f"Error: {e}")
             return ""
@@ -144,18 +202,10 @@ class AdvancedRAGChat:
         before_sleep=before_sleep_log(logger, logging.WARNING),
     )
     def get_highlight_tags(self):
-        url = "https://script.google.com/macros/s/AKfycbw18wXh1o6xiD2WY3wcvkQXGZNn4AY2loJjdEqfBGC22xtluoz27L7VeiAyrcMRsFf6fw/exec"
-
+        if self.highlight_index is not None:
+            return self.highlight_index.tags_text()
         try:
-            body = {
-                "info": "highlight_tags",
-                "highlight_name": "",
-                "highlight_url": "",
-                "package_url": "",
-            }
-            res = requests.post(url=url, json=body)
-            res.raise_for_status()
-            data = res.json()
+            data = self.apps_script_client.call("highlight_tags")
             highlight_tags = data.get("highlightTags")
             highlight_tags = "\n".join(tag for tag in highlight_tags)
             return highlight_tags
@@ -169,13 +219,8 @@ class AdvancedRAGChat:
         before_sleep=before_sleep_log(logger, logging.WARNING),
     )
     def get_payment_method(self, package_url: str):
-        url = "https://script.google.com/macros/s/AKfycbw18wXh1o6xiD2WY3wcvkQXGZNn4AY2loJjdEqfBGC22xtluoz27L7VeiAyrcMRsFf6fw/exec"
-
         try:
-            body = {"info": "payment_method", "highlight_name": "", "highlight_url": "", "package_url": package_url}
-            res = requests.post(url=url, json=body)
-            res.raise_for_status()
-            data = res.json()
+            data = self.apps_script_client.call("payment_method", package_url=package_url)
             res = data.get("paymentMethod")
             return res
         except requests.exceptions.RequestException as e:
@@ -188,13 +233,8 @@ class AdvancedRAGChat:
         before_sleep=before_sleep_log(logger, logging.WARNING),
     )
     def get_cash_discount(self, package_url: str):
-        url = "https://script.google.com/macros/s/AKfycbw18wXh1o6xiD2WY3wcvkQXGZNn4AY2loJjdEqfBGC22xtluoz27L7VeiAyrcMRsFf6fw/exec"
-
         try:
-            body = {"info": "discount", "highlight_name": "", "highlight_url": "", "package_url": package_url}
-            res = requests.post(url=url, json=body)
-            res.raise_for_status()
-            data = res.json()
+            data = self.apps_script_client.call("discount", package_url=package_url)
             if data:
                 return data
             else:
@@ -203,52 +243,144 @@ class AdvancedRAGChat:
             print(f"Error: {e}")
             return ""
 
+    async def payment_method_of(self, package_url: str):
+        """The payment methods of the package from its synced row, or from the Apps Script when that is stale."""
+        if self.payment_max_age and package_url:
+            package = await self.searcher.repository.get(package_url, PackagePayment)
+            if package is not None and is_payment_synced(package, self.payment_max_age):
+                return package.payment_method or ""
+        return await asyncio.to_thread(self.get_payment_method, package_url)
+
+    async def cash_discount_of(self, package):
+        """The cash discount of a loaded package from its synced row, or from the Apps Script when that is stale."""
+        if is_payment_synced(package, self.payment_max_age):
+            # Whole baht as the Apps Script returns them, no discount as ""
+            discount = package.cash_discount or 0
+            return "" if not discount else int(discount) if float(discount).is_integer() else discount
+        return await asyncio.to_thread(self.get_cash_discount, package_url=package.url)
+
+    def category_search_url(self, category: str) -> str:
+        if self.category_index is not None:
+            return self.category_index.search_url(category)
+        return category_search_url(category)
+
+    def cheaper_alternatives(self, packages: list) -> str:
+        """A source listing the cheapest packages of the category of the first result that cost less than the
+        results in it, or "" if there are none."""
+        category = packages[0].category
+        prices = [package.price for package in packages if package.category == category and package.price]
+        if not prices:
+            return ""
+        alternatives = self.category_index.cheaper_alternatives(
+            category, min(prices), exclude_urls={package.url for package in packages}
+        )
+        if not alternatives:
+            return ""
+        lines = "".join(
+            f"""
+    package_name: {package_name}
+    url: {url}
+    price: {price}
+    """
+            for url, package_name, price in alternatives
+        )
+        return f"[Cheaper alternatives in {category}, more at {self.category_search_url(category)}]:{lines}\n\n"
+
     async def google_search(self, messages):
         # Generate an optimized keyword search query based on the chat history and the last question
         query_messages = copy.deepcopy(messages)
 
-        highlight_tags = self.get_highlight_tags()
+        # In a thread, so that concurrent requests neither wait on each other nor fetch the tags twice
+        highlight_tags = await apps_script_calls.do(
+            (id(self.apps_script_client), "highlight_tags"), asyncio.to_thread, self.get_highlight_tags
+        )
         query_messages.insert(0, {"role": "system", "content": self.query_prompt_template})
         query_messages[-1]["content"].append({"type": "text", "text": "\n\TAGS:\n" + highlight_tags})
         query_response_token_limit = 500
 
         query_chat_completion: ChatCompletion = await self.openai_chat_completion(
+            stage="query",
             messages=query_messages,
             model=self.chat_deployment if self.chat_deployment else self.chat_model,
             temperature=0.0,
             max_tokens=query_response_token_limit,
             n=1,
-            tools=build_google_search_function(),
+            tools=build_google_search_function(expand_locations=self.location_expansion == "llm"),
             tool_choice={"type": "function", "function": {"name": "search_google"}},
         )
 
         search_query, locations = extract_search_arguments(query_chat_completion)
-        locations = [f'"{location}"' for location in locations] if locations else []
-
-        if locations:
+        expand_locations = self.location_expansion == "gazetteer" and bool(locations)
+        if expand_locations:
+            user_location = locations[0]
+            locations = get_gazetteer().expand(locations)
+        price_range = parse_price_range(question_text(messages[-1])) if self.price_filter else None
+
+        if self.searcher.retrieval_mode == "hybrid":
+            # Search packages_all directly, with the locations as a filter instead of query terms
+            query_text = search_query
+            search_title = "Hybrid search"
+            with observe_stage("hybrid_search"):
+                packages, is_package_found = await self.searcher.hybrid_search(
+                    query_text=search_query, locations=locations, top=3, price_range=price_range
+                )
+        elif self.searcher.retrieval_mode == "bm25":
+            query_text = search_query
+            search_title = "BM25 search"
+            with observe_stage("bm25_search"):
+                packages, is_package_found = await self.searcher.bm25_search(
+                    query_text=search_query, locations=locations, top=3, price_range=price_range
+                )
+        elif locations and self.searcher.retrieval_mode == "google_fanout":
+            # One query per location instead of one query with all of them, fused by rank
+            query_text = [query for query, _ in fanout_queries(search_query, locations)]
+            search_title = "Google Search"
+            with observe_stage("google_search"):
+                packages, is_package_found = await self.searcher.google_fanout_search(
+                    query_text=search_query, locations=locations, top=3, price_range=price_range
+                )
+        elif locations:
+            quoted_locations = [f'"{location}"' for location in locations]
             # If locations are present in query -> results are likely to be more wider -> add exactTerm to
             # ensure its still relevant
-            query_text = f"{search_query} {' OR '.join(locations)}"
-            packages, is_package_found = await self.searcher.google_search(
-                query_text=query_text, exact_term=search_query, top=3
-            )
+            query_text = f"{search_query} {' OR '.join(quoted_locations)}"
+            search_title = "Google Search"
+            with observe_stage("google_search"):
+                packages, is_package_found = await self.searcher.google_search(
+                    query_text=query_text, exact_term=search_query, top=3, price_range=price_range
+                )
         else:
             query_text = search_query
-            packages, is_package_found = await self.searcher.google_search(
-                query_text=query_text, exact_term=None, top=3
-            )
+            search_title = "Google Search"
+            with observe_stage("google_search"):
+                packages, is_package_found = await self.searcher.google_search(
+                    query_text=query_text, exact_term=None, top=3, price_range=price_range
+                )
+
+        if not is_package_found and self.searcher.fallback_mode == "bm25" and self.searcher.retrieval_mode != "bm25":
+            logger.info("%s found no packages, falling back to the BM25 index", search_title)
+            query_text = search_query
+            search_title = "BM25 search (fallback)"
+            with observe_stage("bm25_search"):
+                packages, is_package_found = await self.searcher.bm25_search(
+                    query_text=search_query, locations=locations, top=3, price_range=price_range
+                )
+
+        if is_package_found and expand_locations:
+            # Searches only match location names, order the packages found by how close they are
+            packages = get_gazetteer().rank_by_distance(packages, user_location)
 
         if is_package_found:
             first_result = packages[0]
             sources_content = [f"[{(package.url)}]:{package.to_str_for_broad_rag()}\n\n" for package in packages]
 
-            filter_url = f'https://hdmall.co.th/search?q={first_result.category.replace(" ", "+")}'
+            filter_url = self.category_search_url(first_result.category)
 
             thought_steps = [
                 ThoughtStep(title="Prompt to generate search arguments", description=query_messages, props={}),
-                ThoughtStep(title="Google Search query", description=query_text, props={}),
+                ThoughtStep(title=f"{search_title} query", description=query_text, props={}),
                 ThoughtStep(
-                    title="Google Search results", description=[result.to_dict() for result in packages], props={}
+                    title=f"{search_title} results", description=[result.to_dict() for result in packages], props={}
                 ),
                 ThoughtStep(title="Url to suggest for the filter search", description=filter_url, props={}),
             ]
@@ -257,14 +389,37 @@ class AdvancedRAGChat:
             filter_url = "https://hdmall.co.th"
             thought_steps = [
                 ThoughtStep(title="Prompt to generate search arguments", description=query_messages, props={}),
-                ThoughtStep(title="Google Search query", description=query_text, props={}),
-                ThoughtStep(title="Google Search results", description=[result for result in packages], props={}),
+                ThoughtStep(title=f"{search_title} query", description=query_text, props={}),
+                ThoughtStep(title=f"{search_title} results", description=[result for result in packages], props={}),
                 ThoughtStep(title="Url to suggest for the filter search", description=filter_url, props={}),
             ]
 
+        if is_package_found and self.category_index is not None:
+            alternatives = self.cheaper_alternatives(packages)
+            if alternatives:
+                sources_content.append(alternatives)
+                thought_steps.append(
+                    ThoughtStep(title="Cheaper alternatives in the category", description=alternatives, props={})
+                )
+        if price_range is not None:
+            thought_steps.insert(1, ThoughtStep(title="Price range", description=price_range.to_dict(), props={}))
+        if expand_locations:
+            thought_steps.insert(
+                1, ThoughtStep(title="Locations expanded with the gazetteer", description=locations, props={})
+            )
+
         return sources_content, thought_steps, filter_url, search_query
 
     async def run(self, messages: list[dict]) -> dict[str, Any] | AsyncGenerator[dict[str, Any], None]:
+        start = time.perf_counter()
+        chat_resp = await self.route_and_answer(messages)
+        usage_ledger.record(self.route, self.usage, time.perf_counter() - start)
+
+        # Usage aggregated over every completion of the request, not only the final one
+        chat_resp["choices"][0].setdefault("context", {})["usage"] = self.usage.to_dict()
+        return chat_resp
+
+    async def route_and_answer(self, messages: list[dict]) -> dict[str, Any]:
         # Normalize the message format
         for message in messages:
             if isinstance(message["content"], str):
@@ -278,6 +433,7 @@ class AdvancedRAGChat:
         specify_package_token_limit = 300
 
         specify_package_chat_completion: ChatCompletion = await self.openai_chat_completion(
+            stage="specify_package",
             messages=specify_package_messages,
             model=self.chat_deployment if self.chat_deployment else self.chat_model,
             temperature=0.0,
@@ -305,11 +461,13 @@ class AdvancedRAGChat:
         if is_welcome_intent(specify_package_chat_completion):
             # LLM to answer welcome messages
             print("Welcome triggered")
+            self.route = "welcome"
             welcome_messages = copy.deepcopy(messages)
             welcome_messages.insert(0, {"role": "system", "content": self.answer_prompt_template})
             welcome_response_token_limit = 300
 
             welcome_chat_completion: ChatCompletion = await self.openai_chat_completion(
+                stage="welcome",
                 messages=welcome_messages,
                 model=self.chat_deployment if self.chat_deployment else self.chat_model,
                 temperature=0.0,
@@ -340,11 +498,13 @@ class AdvancedRAGChat:
         if is_generic_query(specify_package_chat_completion):
             # LLM to answer generic messages
             print("Generic triggered")
+            self.route = "generic"
             generic_messages = copy.deepcopy(messages)
             generic_messages.insert(0, {"role": "system", "content": self.answer_prompt_template})
             generic_response_token_limit = 300
 
             generic_chat_completion: ChatCompletion = await self.openai_chat_completion(
+                stage="generic",
                 messages=generic_messages,
                 model=self.chat_deployment if self.chat_deployment else self.chat_model,
                 temperature=0.0,
@@ -374,11 +534,13 @@ class AdvancedRAGChat:
 
         if is_pharmacy(specify_package_chat_completion):
             # LLM to answer queries about pharmacy
+            self.route = "pharmacy"
             pharmacy_messages = copy.deepcopy(messages)
             pharmacy_messages.insert(0, {"role": "system", "content": self.pharmacy_template})
             pharmacy_response_token_limit = 300
 
             pharmacy_chat_completion: ChatCompletion = await self.openai_chat_completion(
+                stage="pharmacy",
                 messages=pharmacy_messages,
                 model=self.chat_deployment if self.chat_deployment else self.chat_model,
                 temperature=0.0,
@@ -409,14 +571,16 @@ class AdvancedRAGChat:
         if is_payment_query(specify_package_chat_completion):
             # LLM to answer queries about payment
             print("Payment Route triggered")
+            self.route = "payment"
             package_url = extract_url(specify_package_chat_completion)
             print(package_url)
-            payment_method = self.get_payment_method(package_url)
+            payment_method = await self.payment_method_of(package_url)
             messages.insert(0, {"role": "system", "content": self.payment_template})
             messages[-1]["content"].append({"type": "text", "text": "\n\Payment Method:\n" + payment_method})
             payment_response_token_limit = 300
 
             payment_chat_completion: ChatCompletion = await self.openai_chat_completion(
+                stage="payment",
                 messages=messages,
                 model=self.chat_deployment if self.chat_deployment else self.chat_model,
                 temperature=0.0,
@@ -447,8 +611,9 @@ class AdvancedRAGChat:
         if is_payment_promo(specify_package_chat_completion):
             # LLM to answer queries about payment promotions
             print("Payment Promotions route triggered")
+            self.route = "payment_promo"
             promo_messages = copy.deepcopy(messages)
-            payment_promos = self.get_payment_promos()
+            payment_promos = await asyncio.to_thread(self.get_payment_promos)
             promo_messages.insert(0, {"role": "system", "content": self.promo_template})
             payment_promos = "\n".join(payment_promos)
             promo_messages[-1]["content"].append(
@@ -457,6 +622,7 @@ class AdvancedRAGChat:
             promo_response_token_limit = 4096
 
             promo_chat_completion: ChatCompletion = await self.openai_chat_completion(
+                stage="payment_promo",
                 messages=promo_messages,
                 model=self.chat_deployment if self.chat_deployment else self.chat_model,
                 temperature=0.0,
@@ -473,11 +639,13 @@ class AdvancedRAGChat:
         if is_installments_query(specify_package_chat_completion):
             # LLM to answer queries about installments
             print("Installment route triggered")
+            self.route = "installment"
             installment_messages = copy.deepcopy(messages)
             installment_messages.insert(0, {"role": "system", "content": self.installment_template})
             installment_response_token_limit = 400
 
             installment_chat_completion: ChatCompletion = await self.openai_chat_completion(
+                stage="installment",
                 messages=installment_messages,
                 model=self.chat_deployment if self.chat_deployment else self.chat_model,
                 temperature=0.0,
@@ -492,11 +660,13 @@ class AdvancedRAGChat:
             return chat_resp
 
         if is_coupon(specify_package_chat_completion):
+            self.route = "coupon"
             coupon_messages = copy.deepcopy(messages)
             coupon_messages.insert(0, {"role": "system", "content": self.coupon_template})
             coupon_response_token_limit = 300
 
             coupon_chat_completion: ChatCompletion = await self.openai_chat_completion(
+                stage="coupon",
                 messages=coupon_messages,
                 model=self.chat_deployment if self.chat_deployment else self.chat_model,
                 temperature=0.0,
@@ -525,17 +695,20 @@ class AdvancedRAGChat:
             return chat_resp
 
         if is_clear_history(specify_package_chat_completion):
+            self.route = "QISCUS_CLEAR_HISTORY"
             specify_package_resp["choices"][0]["message"]["content"] = "QISCUS_CLEAR_HISTORY"
             return specify_package_resp
 
         if is_handover_to_cx(specify_package_chat_completion):
             # LLM to check if we have gathered the information
             logger.info("Information gathering route...")
+            self.route = "handover_to_cx"
             info_messages = copy.deepcopy(messages)
             info_messages.insert(0, {"role": "system", "content": self.gather_template})
             info_response_token_limit = 300
 
             info_chat_completion: ChatCompletion = await self.openai_chat_completion(
+                stage="gather_info",
                 messages=info_messages,
                 model=self.chat_deployment if self.chat_deployment else self.chat_model,
                 temperature=0.0,
@@ -549,6 +722,7 @@ class AdvancedRAGChat:
                 package_name, location, budget = extract_info_gathered(info_chat_completion)
 
                 # Send the following text
+                self.route = "QISCUS_INTEGRATION_TO_CX"
                 note_to_be_added = f"Package: {package_name} \nLocation: {location} \nBudget: {budget}"
                 specify_package_resp["choices"][0]["message"]["content"] = (
                     f"QISCUS_INTEGRATION_TO_CX: {note_to_be_added}"
@@ -575,6 +749,7 @@ class AdvancedRAGChat:
             response_token_limit = 4096
 
             chat_completion_response = await self.openai_chat_completion(
+                stage="gather_answer",
                 model=self.chat_deployment if self.chat_deployment else self.chat_model,
                 messages=messages,
                 temperature=0,
@@ -602,10 +777,12 @@ class AdvancedRAGChat:
             return chat_resp
 
         if is_handover_to_bk(specify_package_chat_completion):
+            self.route = "QISCUS_INTEGRATION_TO_BK"
             specify_package_resp["choices"][0]["message"]["content"] = "QISCUS_INTEGRATION_TO_BK"
             return specify_package_resp
 
         if is_immediate_handover(specify_package_chat_completion):
+            self.route = "QISCUS_INTEGRATION_TO_IMMEDIATE_CX"
             package_name = extract_package_name(specify_package_chat_completion)
             specify_package_resp["choices"][0]["message"]["content"] = (
                 "QISCUS_INTEGRATION_TO_IMMEDIATE_CX: " + package_name
@@ -618,14 +795,28 @@ class AdvancedRAGChat:
         highlight_query = ""
 
         if specify_package_filters:  # Simple SQL search
-            results = await self.searcher.simple_sql_search(filters=specify_package_filters)
+            self.route = "specify_package"
+            with observe_stage("sql_search"):
+                results = await self.searcher.simple_sql_search(filters=specify_package_filters)
             if results:
-                filter_url = [
-                    f'https://hdmall.co.th/search?q={package.category.replace(" ", "+")}' for package in results
-                ]
-
-                sources_content = [f"[{(package.url)}]:{package.to_str_for_narrow_rag()}\n\n" for package in results]
-                cash_discount = self.get_cash_discount(package_url=results[0].url)
+                filter_url = [self.category_search_url(package.category) for package in results]
+
+                selections = []
+                if self.section_token_budget:
+                    # Only the sections of the packages relevant to the question
+                    question = question_text(messages[-1])
+                    with observe_stage("section_selection"):
+                        selections = [
+                            select_sections(package, question, self.section_token_budget) for package in results
+                        ]
+                    sources_content = [
+                        f"[{(package.url)}]:{context}\n\n" for package, (context, _) in zip(results, selections)
+                    ]
+                else:
+                    sources_content = [
+                        f"[{(package.url)}]:{package.to_str_for_narrow_rag()}\n\n" for package in results
+                    ]
+                cash_discount = await self.cash_discount_of(results[0])
                 thought_steps.extend(
                     [
                         ThoughtStep(
@@ -646,14 +837,24 @@ class AdvancedRAGChat:
                         ),
                     ]
                 )
+                if selections:
+                    thought_steps.append(
+                        ThoughtStep(
+                            title="Selected package sections",
+                            description={package.url: sections for package, (_, sections) in zip(results, selections)},
+                            props={"token_budget": self.section_token_budget},
+                        )
+                    )
             else:
                 print("Google search triggered as couldnt find any packages")
+                self.route = "search"
                 # No results found with SQL search, fall back to the google search
                 sources_content, additional_thought_steps, filter_url, query = await self.google_search(messages)
                 highlight_query = query
                 thought_steps.extend(additional_thought_steps)
         else:  # Google search
             print("Google search is triggered by default")
+            self.route = "search"
             sources_content, additional_thought_steps, filter_url, query = await self.google_search(messages)
             highlight_query = query
             thought_steps.extend(additional_thought_steps)
@@ -664,7 +865,9 @@ class AdvancedRAGChat:
         print(highlight_url, highlight_name)
 
         if highlight_name or highlight_url:
-            result = self.get_highlight_info(highlight_name=highlight_name, highlight_url=highlight_url)
+            result = await asyncio.to_thread(
+                self.get_highlight_info, highlight_name=highlight_name, highlight_url=highlight_url
+            )
             if result:
                 # Found highlight content
                 highlight_content = json.dumps(result, ensure_ascii=False)
@@ -703,6 +906,7 @@ class AdvancedRAGChat:
         response_token_limit = 4096
 
         chat_completion_response = await self.openai_chat_completion(
+            stage="answer",
             model=self.chat_deployment if self.chat_deployment else self.chat_model,
             messages=messages,
             temperature=0,
@@ -0,0 +1,25 @@
+from typing import Any
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+def orjson_default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    # Anything orjson does not know natively (dataclasses, datetimes and numpy arrays it does)
+    return jsonable_encoder(obj)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered by orjson: UTF-8 left unescaped and pydantic models dumped without jsonable_encoder.
+
+    Return it directly from a route, otherwise FastAPI runs jsonable_encoder over the content first.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content, default=orjson_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
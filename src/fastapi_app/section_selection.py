@@ -0,0 +1,115 @@
+import re
+from collections import Counter
+
+import numpy as np
+import tiktoken
+
+from fastapi_app.bm25_index import tokenize
+from fastapi_app.narrow_context import NARROW_CONTEXT_FIELDS, TEXT_FIELDS, get_encoding, is_empty, normalize_line
+
+# Words of the questions each section answers, matched like its content but weighted higher
+SECTION_KEYWORDS = {
+    "package_details": "รายละเอียด รวมอะไรบ้าง ตรวจอะไร ได้อะไร details included",
+    "price_details": "ราคา ค่าใช้จ่าย จ่ายเพิ่ม price cost",
+    "important_info": "เงื่อนไข ข้อควรรู้ นัดหมาย จองคิว conditions appointment booking",
+    "hdcare_summary": "สรุป summary",
+    "common_question": "คำถาม สงสัย question",
+    "faq": "คำถาม สงสัย question faq",
+    "general_info": "ข้อมูลทั่วไป general",
+    "how_to_diagnose": "วินิจฉัย ตรวจวินิจฉัย diagnose",
+    "early_signs_for_diagnosis": "อาการ สัญญาณ symptoms signs",
+    "know_this_disease": "โรค สาเหตุ disease cause",
+    "courses_of_action": "การรักษา วิธีรักษา treatment",
+    "signals_to_proceed_surgery": "ควรผ่าตัด เมื่อไหร่ surgery when",
+    "get_to_know_this_surgery": "ผ่าตัด ขั้นตอน วิธีการ surgery procedure",
+    "comparisons": "เปรียบเทียบ ต่างกัน ดีกว่า compare difference",
+    "getting_ready": "เตรียมตัว งดน้ำ งดอาหาร ก่อน prepare fasting before",
+    "recovery": "พักฟื้น หลังผ่าตัด กี่วัน หายเมื่อไหร่ recovery after days",
+    "side_effects": "ผลข้างเคียง ความเสี่ยง เจ็บ side effects risks pain",
+    "review_4_5_stars": "รีวิว ดีไหม ประสบการณ์ reviews",
+}
+SECTION_KEYWORD_TOKENS = {section: set(tokenize(keywords)) for section, keywords in SECTION_KEYWORDS.items()}
+KEYWORD_WEIGHT = 2.0
+CONTEXT_LINE = re.compile(rf"^    ({'|'.join(NARROW_CONTEXT_FIELDS)}): ", re.M)
+
+
+def package_sections(package) -> list[tuple[str, str]]:
+    """The (field, value) sections of the narrow context of a package in priority order, read from its fields
+    rather than the precomputed context, which the token budget cut, when they were loaded."""
+    if package.narrow_context and all(is_empty(getattr(package, field)) for field in TEXT_FIELDS):
+        matches = list(CONTEXT_LINE.finditer(package.narrow_context))
+        ends = [match.start() for match in matches[1:]] + [len(package.narrow_context)]
+        return [
+            (match.group(1), package.narrow_context[match.end() : end].rstrip()) for match, end in zip(matches, ends)
+        ]
+    sections, seen = [], set()
+    for field in NARROW_CONTEXT_FIELDS:
+        value = getattr(package, field)
+        if is_empty(value):
+            continue
+        if field in TEXT_FIELDS:
+            # Lines repeated from earlier sections are left out, as in the precomputed context
+            lines = []
+            for line in str(value).splitlines():
+                key = normalize_line(line)
+                if key and key not in seen:
+                    seen.add(key)
+                    lines.append(line.rstrip())
+            if not lines:
+                continue
+            value = "\n".join(lines)
+        sections.append((field, str(value)))
+    return sections
+
+
+def score_sections(sections: list[tuple[str, str]], question: str, k1: float = 1.2, b: float = 0.75) -> np.ndarray:
+    """BM25 score of each section for the question, over the sections of the package, plus keyword matches."""
+    terms = sorted(set(tokenize(question)))
+    if not terms or not sections:
+        return np.zeros(len(sections), dtype=np.float32)
+    counts = [Counter(tokenize(value)) for _, value in sections]
+    frequencies = np.array([[section_counts[term] for term in terms] for section_counts in counts], dtype=np.float32)
+    keyword_matches = np.array(
+        [[term in SECTION_KEYWORD_TOKENS.get(field, ()) for term in terms] for field, _ in sections], dtype=np.float32
+    )
+    lengths = np.array([sum(section_counts.values()) for section_counts in counts], dtype=np.float32)
+    length_norms = k1 * (1 - b + b * lengths / max(float(lengths.mean()), 1.0))
+    document_frequencies = ((frequencies + keyword_matches) > 0).sum(axis=0)
+    idf = np.log1p((len(sections) - document_frequencies + 0.5) / (document_frequencies + 0.5))
+    weights = frequencies * (k1 + 1) / (frequencies + length_norms[:, None])
+    return (weights + KEYWORD_WEIGHT * keyword_matches) @ idf
+
+
+def select_sections(
+    package, question: str, token_budget: int, encoding: tiktoken.Encoding | None = None
+) -> tuple[str, list[str]]:
+    """The narrow context of the package reduced to the sections relevant to the question, within token_budget
+    tokens, and the names of the sections kept. The fields before the free text ones, like the name and price,
+    are always kept. Without any relevant section, the whole context is returned."""
+    sections = package_sections(package)
+    text_positions = [position for position, (field, _) in enumerate(sections) if field in TEXT_FIELDS]
+    scores = score_sections([sections[position] for position in text_positions], question)
+    if not scores.any():
+        return package.to_str_for_narrow_rag(), [field for field, _ in sections]
+
+    encoding = encoding or get_encoding()
+    parts = [f"    {field}: {value}\n" for field, value in sections]
+    kept = [position for position in range(len(sections)) if position not in text_positions]
+    used = sum(len(encoding.encode(parts[position])) for position in kept)
+    for index in np.argsort(-scores, kind="stable"):
+        if scores[index] <= 0:
+            break
+        position = text_positions[index]
+        tokens = len(encoding.encode(parts[position]))
+        if used + tokens <= token_budget:
+            kept.append(position)
+            used += tokens
+    kept.sort()
+    return "\n" + "".join(parts[position] for position in kept) + "    ", [sections[position][0] for position in kept]
+
+
+def question_text(message: dict) -> str:
+    content = message["content"]
+    if isinstance(content, str):
+        return content
+    return " ".join(part["text"] for part in content if part.get("type") == "text")
@@ -16,6 +16,7 @@ from fastapi_app.postgres_engine import (
     create_postgres_engine_from_env,
 )
 from fastapi_app.postgres_models import Package
+from fastapi_app.update_narrow_context import update_narrow_contexts
 
 logger = logging.getLogger("ragapp")
 
@@ -141,6 +142,8 @@ async def main():
     table_name = input("Insert table_name:")  # e.g. packages_all, packages_all_staging
 
     await seed_data(engine, table_name)
+    # The narrow contexts are rendered from the seeded columns, within NARROW_CONTEXT_TOKEN_BUDGET tokens
+    await update_narrow_contexts(engine)
     await engine.dispose()
 
 
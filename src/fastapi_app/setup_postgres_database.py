@@ -5,8 +5,9 @@ import logging
 from dotenv import load_dotenv
 from sqlalchemy import text
 
+from fastapi_app.catalog import CHANGES_CHANNEL
 from fastapi_app.postgres_engine import create_postgres_engine_from_args, create_postgres_engine_from_env
-from fastapi_app.postgres_models import Base
+from fastapi_app.postgres_models import EMBEDDING_DIMENSIONS, FULLTEXT_EXPRESSION, Base
 
 logger = logging.getLogger("ragapp")
 
@@ -15,12 +16,113 @@ async def create_db_schema(engine):
     async with engine.begin() as conn:
         logger.info("Enabling the pgvector extension for Postgres...")
         await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        logger.info("Enabling the pg_trgm extension for Postgres...")
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
         logger.info("Creating database tables and indexes...")
         await conn.run_sync(Base.metadata.create_all)
+        logger.info("Adding the hybrid search columns and indexes to packages_all...")
+        await add_search_columns(conn)
+        # Filled by update_narrow_context.py
+        await conn.execute(text("ALTER TABLE packages_all ADD COLUMN IF NOT EXISTS narrow_context text"))
+        # Filled by payment_sync.py
+        await conn.execute(text("ALTER TABLE packages_all ADD COLUMN IF NOT EXISTS payment_method text"))
+        await conn.execute(text("ALTER TABLE packages_all ADD COLUMN IF NOT EXISTS payment_synced_at timestamptz"))
+        logger.info("Creating the packages_all change notification trigger...")
+        await add_change_notifications(conn)
+    await check_trigram_index_usage(engine)
 
     await conn.close()
 
 
+async def add_search_columns(conn):
+    # create_all skips tables that already exist, so add the search columns to a packages_all created before them
+    await conn.execute(
+        text(f"ALTER TABLE packages_all ADD COLUMN IF NOT EXISTS embedding vector({EMBEDDING_DIMENSIONS})")
+    )
+    await conn.execute(
+        text(
+            "ALTER TABLE packages_all ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS ({FULLTEXT_EXPRESSION}) STORED"
+        )
+    )
+    await conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS hnsw_index_for_cosine_packages_all_embedding ON packages_all "
+            "USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+        )
+    )
+    await conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_packages_all_search_vector ON packages_all USING gin (search_vector)")
+    )
+    for column in ("url", "package_name"):
+        await conn.execute(
+            text(
+                f"CREATE INDEX IF NOT EXISTS ix_packages_all_{column}_trgm ON packages_all "
+                f"USING gin ({column} gin_trgm_ops)"
+            )
+        )
+    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_packages_all_price ON packages_all (price)"))
+
+
+async def check_trigram_index_usage(engine):
+    """Log whether Postgres can run the package name filter of simple_sql_search on its trigram index."""
+    async with engine.begin() as conn:
+        # The table may be too small for the planner to prefer the index, so only ask whether it can use it
+        await conn.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = (
+            await conn.execute(
+                text("EXPLAIN (FORMAT JSON) SELECT url FROM packages_all WHERE package_name ILIKE :name"),
+                {"name": "%ตรวจสุขภาพ%"},
+            )
+        ).scalar()
+    if "ix_packages_all_package_name_trgm" in str(plan):
+        logger.info("Package name filters use the trigram index.")
+    else:
+        logger.warning("Package name filters do not use the trigram index, query plan: %s", plan)
+
+
+async def add_change_notifications(conn):
+    # Every change to packages_all bumps a version number and sends the changed URL to the app's catalog snapshots
+    await conn.execute(text("CREATE SEQUENCE IF NOT EXISTS packages_all_version"))
+    await conn.execute(
+        text(
+            f"""
+            CREATE OR REPLACE FUNCTION notify_packages_all_changed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM nextval('packages_all_version');
+                IF TG_OP = 'TRUNCATE' THEN
+                    PERFORM pg_notify('{CHANGES_CHANNEL}', '*');
+                    RETURN NULL;
+                END IF;
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    PERFORM pg_notify('{CHANGES_CHANNEL}', OLD.url);
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') AND (TG_OP = 'INSERT' OR NEW.url <> OLD.url) THEN
+                    PERFORM pg_notify('{CHANGES_CHANNEL}', NEW.url);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """
+        )
+    )
+    # Dropped and created again rather than CREATE OR REPLACE TRIGGER, which needs Postgres 14
+    await conn.execute(text("DROP TRIGGER IF EXISTS packages_all_changed ON packages_all"))
+    await conn.execute(
+        text(
+            "CREATE TRIGGER packages_all_changed AFTER INSERT OR UPDATE OR DELETE ON packages_all "
+            "FOR EACH ROW EXECUTE FUNCTION notify_packages_all_changed()"
+        )
+    )
+    await conn.execute(text("DROP TRIGGER IF EXISTS packages_all_truncated ON packages_all"))
+    await conn.execute(
+        text(
+            "CREATE TRIGGER packages_all_truncated AFTER TRUNCATE ON packages_all "
+            "FOR EACH STATEMENT EXECUTE FUNCTION notify_packages_all_changed()"
+        )
+    )
+
+
 async def main():
     parser = argparse.ArgumentParser(description="Create database schema")
     parser.add_argument("--host", type=str, help="Postgres host")
@@ -0,0 +1,247 @@
+import asyncio
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import fields
+from types import SimpleNamespace
+
+import numpy as np
+import orjson
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from fastapi_app.catalog import (
+    CATALOG_SNAPSHOT_AGE,
+    CATALOG_SNAPSHOT_PACKAGES,
+    FILTERABLE_COLUMNS,
+    filter_packages,
+    get_catalog_version,
+)
+from fastapi_app.metrics import observe_stage
+from fastapi_app.package_repository import normalize_package_url
+from fastapi_app.postgres_models import Package
+
+logger = logging.getLogger("ragapp")
+
+# File layout, little endian:
+#   header: magic, catalog version (-1 if unknown), package count, embedding dimensions (0 without embeddings),
+#           offset of the embedding matrix
+#   index: one entry per package, sorted by canonical URL: URL offset and length, record offset and length,
+#          row of the package in the embedding matrix (-1 if it has none)
+#   the canonical URLs, the packages as JSON records, and the float32 embedding matrix
+MAGIC = b"RAGCAT01"
+HEADER = struct.Struct("<8sqQIQ")
+INDEX_ENTRY = struct.Struct("<QIQIq")
+PACKAGE_FIELDS = [field.name for field in fields(Package) if field.init]
+
+
+def default_catalog_path() -> str:
+    return os.getenv("CATALOG_SHARED_PATH", os.path.join(tempfile.gettempdir(), "ragapp-catalog", "catalog.bin"))
+
+
+def encode_catalog(packages: list[Package], embeddings: dict[str, list[float]], version: int | None) -> bytes:
+    entries = sorted((normalize_package_url(package.url).encode(), package) for package in packages)
+    dimensions = len(next(iter(embeddings.values()))) if embeddings else 0
+    index, urls, records, matrix = [], bytearray(), bytearray(), []
+    data_start = HEADER.size + INDEX_ENTRY.size * len(entries)
+    for url, package in entries:
+        record = orjson.dumps({name: getattr(package, name) for name in PACKAGE_FIELDS})
+        embedding_row = -1
+        if (embedding := embeddings.get(package.url)) is not None:
+            embedding_row = len(matrix)
+            matrix.append(embedding)
+        index.append((data_start + len(urls), len(url), len(records), len(record), embedding_row))
+        urls += url
+        records += record
+
+    records_start = data_start + len(urls)
+    # Align the embedding matrix so that it can be viewed as float32 without copying
+    padding = -(records_start + len(records)) % 8
+    matrix_start = records_start + len(records) + padding
+    parts = [HEADER.pack(MAGIC, -1 if version is None else version, len(entries), dimensions, matrix_start)]
+    parts += [
+        INDEX_ENTRY.pack(url_offset, url_length, records_start + record_offset, record_length, embedding_row)
+        for url_offset, url_length, record_offset, record_length, embedding_row in index
+    ]
+    parts += [bytes(urls), bytes(records), b"\0" * padding]
+    if matrix:
+        parts.append(np.asarray(matrix, dtype="<f4").tobytes())
+    return b"".join(parts)
+
+
+class SharedCatalog:
+    """The catalog snapshot as a file memory-mapped read-only by every worker, so its pages are shared.
+
+    One worker builds and publishes a new file when the catalog changes, the others map it when they notice the
+    change. Looking up a package decodes its record, so every call returns a fresh Package.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or default_catalog_path()
+        self.lock_path = self.path + ".lock"
+        self.mapped = None
+        self.inode = None
+        self.version: int | None = None
+        self.count = 0
+        self.dimensions = 0
+        self.matrix_start = 0
+        self.checked_at = 0.0
+        self._rows = None
+        self._by_category = None
+        self._by_shop = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def map_file(self) -> bool:
+        """Map the published file if it is not the one already mapped. Returns False if there is none yet."""
+        try:
+            with open(self.path, "rb") as file:
+                inode = os.fstat(file.fileno()).st_ino
+                if inode == self.inode:
+                    return True
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return False
+        magic, version, count, dimensions, matrix_start = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a catalog file")
+        # The previous mapping stays valid for the requests still using packages decoded from it
+        self.mapped, self.inode = mapped, inode
+        self.version = None if version == -1 else version
+        self.count, self.dimensions, self.matrix_start = count, dimensions, matrix_start
+        self._rows = self._by_category = self._by_shop = None
+        logger.info("Mapped the shared catalog %s (%d packages, version %s)", self.path, count, self.version)
+        return True
+
+    def entry(self, position: int) -> tuple[int, int, int, int, int]:
+        return INDEX_ENTRY.unpack_from(self.mapped, HEADER.size + INDEX_ENTRY.size * position)
+
+    def url_at(self, position: int) -> bytes:
+        url_offset, url_length, *_ = self.entry(position)
+        return self.mapped[url_offset : url_offset + url_length]
+
+    def find(self, url: str) -> int | None:
+        key = normalize_package_url(url).encode()
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.url_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < self.count and self.url_at(low) == key else None
+
+    def package_at(self, position: int) -> Package:
+        _, _, record_offset, record_length, _ = self.entry(position)
+        return Package(**orjson.loads(self.mapped[record_offset : record_offset + record_length]))
+
+    def get(self, url: str) -> Package | None:
+        if self.mapped is None:
+            return None
+        position = self.find(url)
+        return None if position is None else self.package_at(position)
+
+    def embedding(self, url: str) -> np.ndarray | None:
+        """The embedding of a package as a read-only view of the mapped file."""
+        position = self.find(url) if self.mapped is not None else None
+        if position is None or (row := self.entry(position)[4]) == -1:
+            return None
+        offset = self.matrix_start + row * self.dimensions * 4
+        return np.frombuffer(self.mapped, dtype="<f4", count=self.dimensions, offset=offset)
+
+    def rows(self) -> list[SimpleNamespace]:
+        """The filterable columns of every package, decoded once per mapped file."""
+        if self._rows is None:
+            self._rows = []
+            for position in range(self.count):
+                _, _, record_offset, record_length, _ = self.entry(position)
+                record = orjson.loads(self.mapped[record_offset : record_offset + record_length])
+                row = SimpleNamespace(**{column: record.get(column) for column in FILTERABLE_COLUMNS})
+                row.position = position
+                self._rows.append(row)
+        return self._rows
+
+    def filter(self, filters: list[dict], use_or: bool = False, limit: int = 10) -> list[Package] | None:
+        if self.mapped is None:
+            return None
+        rows = filter_packages(self.rows(), filters, use_or=use_or, limit=limit)
+        return None if rows is None else [self.package_at(row.position) for row in rows]
+
+    def in_category(self, category: str) -> list[Package]:
+        if self._by_category is None:
+            self._by_category = defaultdict(list)
+            for row in self.rows():
+                self._by_category[row.category].append(row.position)
+        return [self.package_at(position) for position in self._by_category.get(category, [])]
+
+    def of_shop(self, shop_name: str) -> list[Package]:
+        if self._by_shop is None:
+            self._by_shop = defaultdict(list)
+            for row in self.rows():
+                self._by_shop[row.shop_name].append(row.position)
+        return [self.package_at(position) for position in self._by_shop.get(shop_name, [])]
+
+    def mark_checked(self) -> None:
+        self.checked_at = time.monotonic()
+        CATALOG_SNAPSHOT_PACKAGES.set(len(self))
+        CATALOG_SNAPSHOT_AGE.set(0)
+
+    async def publish(self, engine) -> None:
+        """Build the catalog file from the database and atomically replace the published one."""
+        with observe_stage("catalog_publish"):
+            async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+                version = await get_catalog_version(session)
+                packages = (await session.scalars(select(Package))).all()
+                embeddings = {
+                    url: embedding
+                    for url, embedding in await session.execute(
+                        select(Package.url, Package.embedding).where(Package.embedding.is_not(None))
+                    )
+                }
+            data = await asyncio.to_thread(encode_catalog, packages, embeddings, version)
+            directory = os.path.dirname(self.path)
+            os.makedirs(directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(file.name, self.path)
+        logger.info("Published the shared catalog %s (%d packages, version %s)", self.path, len(packages), version)
+
+    async def load(self, engine, version: int | None = None) -> None:
+        """Map the latest catalog, building it first if no worker has published the current version yet."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.lock_path, "w") as lock_file:
+            # One worker builds while the others wait for it, then they all map its file
+            await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+            try:
+                if version is None:
+                    async with engine.connect() as conn:
+                        version = await get_catalog_version(conn)
+                published = self.map_file()
+                # Without a version sequence in the database, a published file is assumed current
+                if not published or (version is not None and self.version != version):
+                    await self.publish(engine)
+                    self.map_file()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self.mark_checked()
+
+    async def reload_urls(self, engine, urls: set[str]) -> None:
+        # The file is immutable, so any change publishes a new one
+        await self.load(engine)
+
+    async def check_version(self, engine) -> None:
+        async with engine.connect() as conn:
+            version = await get_catalog_version(conn)
+        self.map_file()
+        if version != self.version:
+            await self.load(engine, version)
+        else:
+            self.mark_checked()
@@ -0,0 +1,56 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable, Iterable
+
+from fastapi_app.metrics import record_coalesced_calls
+
+
+class SingleFlight:
+    """Coalesces identical concurrent calls: callers with the key of a call in flight await its result instead of
+    making their own. Nothing is cached, the key is forgotten as soon as the call completes.
+
+    The call runs as a task of its own, so a caller being cancelled does not cancel it for the others."""
+
+    def __init__(self, name: str):
+        # Label of the coalesced calls metric
+        self.name = name
+        self.calls: dict[Hashable, asyncio.Future] = {}
+
+    def start(self, keys: list[Hashable], awaitable: Awaitable) -> asyncio.Future:
+        task = asyncio.ensure_future(awaitable)
+        for key in keys:
+            self.calls[key] = task
+
+        def forget(task: asyncio.Future) -> None:
+            for key in keys:
+                if self.calls.get(key) is task:
+                    del self.calls[key]
+            # Mark the exception as retrieved, in case every caller was cancelled
+            if not task.cancelled():
+                task.exception()
+
+        task.add_done_callback(forget)
+        return task
+
+    async def do(self, key: Hashable, function: Callable[..., Awaitable], *args, **kwargs):
+        """The result of function(*args, **kwargs), shared with the concurrent calls with the same key."""
+        task = self.calls.get(key)
+        if task is None:
+            task = self.start([key], function(*args, **kwargs))
+        else:
+            record_coalesced_calls(self.name)
+        return await asyncio.shield(task)
+
+    async def do_many(self, keys: Iterable[Hashable], function: Callable[[list], Awaitable[dict]]) -> dict:
+        """The value of each key, function(keys) loading the keys not already in flight in one call and
+        returning a dict of them."""
+        keys = list(dict.fromkeys(keys))
+        tasks = {key: task for key in keys if (task := self.calls.get(key)) is not None}
+        if tasks:
+            record_coalesced_calls(self.name, len(tasks))
+        if missing := [key for key in keys if key not in tasks]:
+            task = self.start(missing, function(missing))
+            tasks.update(dict.fromkeys(missing, task))
+        results = {}
+        for task in set(tasks.values()):
+            results.update(await asyncio.shield(task))
+        return {key: results.get(key) for key in keys}
@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from fastapi_app.apps_script import APPS_SCRIPT_URL, AppsScriptClient
+from fastapi_app.highlight_campaigns import sync_highlight_campaigns
+from fastapi_app.postgres_engine import create_postgres_engine_from_args, create_postgres_engine_from_env
+
+logger = logging.getLogger("ragapp")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Sync the highlight campaigns from the Apps Script into Postgres")
+    parser.add_argument("--host", type=str, help="Postgres host")
+    parser.add_argument("--username", type=str, help="Postgres username")
+    parser.add_argument("--password", type=str, help="Postgres password")
+    parser.add_argument("--database", type=str, help="Postgres database")
+    parser.add_argument("--sslmode", type=str, help="Postgres sslmode")
+    parser.add_argument("--concurrency", type=int, default=4, help="Apps Script calls in flight at once")
+
+    # if no args are specified, use environment variables
+    args = parser.parse_args()
+    if args.host is None:
+        engine = await create_postgres_engine_from_env()
+    else:
+        engine = await create_postgres_engine_from_args(args)
+
+    apps_script_client = AppsScriptClient(
+        url=os.getenv("APPS_SCRIPT_URL", APPS_SCRIPT_URL),
+        timeout=float(os.getenv("APPS_SCRIPT_TIMEOUT_SECONDS", "15")),
+    )
+    await sync_highlight_campaigns(engine, apps_script_client, args.concurrency)
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    load_dotenv(override=True)
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+import argparse
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from fastapi_app.apps_script import APPS_SCRIPT_URL, AppsScriptClient
+from fastapi_app.payment_sync import sync_payment_data
+from fastapi_app.postgres_engine import create_postgres_engine_from_args, create_postgres_engine_from_env
+
+logger = logging.getLogger("ragapp")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Sync the cash discounts and payment methods of the packages")
+    parser.add_argument("--host", type=str, help="Postgres host")
+    parser.add_argument("--username", type=str, help="Postgres username")
+    parser.add_argument("--password", type=str, help="Postgres password")
+    parser.add_argument("--database", type=str, help="Postgres database")
+    parser.add_argument("--sslmode", type=str, help="Postgres sslmode")
+    parser.add_argument("--concurrency", type=int, default=8, help="Packages fetched from the Apps Script at once")
+    parser.add_argument("--batch-size", type=int, default=200, help="Packages written per transaction")
+
+    # if no args are specified, use environment variables
+    args = parser.parse_args()
+    if args.host is None:
+        engine = await create_postgres_engine_from_env()
+    else:
+        engine = await create_postgres_engine_from_args(args)
+
+    apps_script_client = AppsScriptClient(
+        url=os.getenv("APPS_SCRIPT_URL", APPS_SCRIPT_URL),
+        timeout=float(os.getenv("APPS_SCRIPT_TIMEOUT_SECONDS", "15")),
+    )
+    await sync_payment_data(engine, apps_script_client, args.concurrency, args.batch_size)
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    load_dotenv(override=True)
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from fastapi_app.postgres_models import ChatTrace
+from fastapi_app.responses import orjson_default
+
+logger = logging.getLogger("ragapp")
+
+CONTEXT_VERBOSITY_LEVELS = ("none", "summary", "full")
+
+
+def shape_context(context: dict, verbosity: str, trace_id: str) -> dict:
+    """Reduce the response context to the requested verbosity. The full context stays retrievable by trace id."""
+    if verbosity == "full":
+        return {**context, "trace_id": trace_id}
+    if verbosity == "summary":
+        return {
+            "trace_id": trace_id,
+            "usage": context.get("usage"),
+            "thoughts": [{"title": thought.title, "props": thought.props} for thought in context.get("thoughts", [])],
+        }
+    return {"trace_id": trace_id}
+
+
+class MemoryTraceStore:
+    """Keeps the most recent full traces of this worker in memory, evicting the oldest first.
+
+    Traces are kept serialized, which is both smaller than the objects and what bounds the store: a full trace
+    with its package rows can take hundreds of KB, so max_bytes rather than max_entries usually limits it, and
+    every worker holds up to max_bytes."""
+
+    def __init__(self, max_entries: int = 500, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.traces: OrderedDict[str, bytes] = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def put(self, route: str, context: dict) -> str:
+        trace_id = uuid.uuid4().hex
+        trace = {"trace_id": trace_id, "created_at": datetime.now(timezone.utc), "route": route, "context": context}
+        data = orjson.dumps(trace, default=orjson_default, option=orjson.OPT_NON_STR_KEYS)
+        with self.lock:
+            self.traces[trace_id] = data
+            self.size += len(data)
+            while len(self.traces) > self.max_entries or (self.size > self.max_bytes and len(self.traces) > 1):
+                self.size -= len(self.traces.popitem(last=False)[1])
+        return trace_id
+
+    async def get(self, trace_id: str) -> dict | None:
+        with self.lock:
+            data = self.traces.get(trace_id)
+        return None if data is None else orjson.loads(data)
+
+
+class PostgresTraceStore:
+    """Writes full traces to the chat_traces table in the background so every worker can serve them."""
+
+    def __init__(self, engine, retention: timedelta = timedelta(hours=24), prune_every: int = 500):
+        self.async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
+        self.retention = retention
+        self.prune_every = prune_every
+        self.writes = 0
+        # Keep references to the background writes so they are not garbage collected mid-flight
+        self.pending: set[asyncio.Task] = set()
+
+    def put(self, route: str, context: dict) -> str:
+        trace_id = uuid.uuid4().hex
+        task = asyncio.create_task(self.insert(trace_id, route, context))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+        return trace_id
+
+    async def insert(self, trace_id: str, route: str, context: dict) -> None:
+        try:
+            async with self.async_session_maker() as session:
+                session.add(ChatTrace(trace_id=trace_id, route=route, trace=jsonable_encoder(context)))
+                self.writes += 1
+                if self.writes % self.prune_every == 0:
+                    cutoff = datetime.now(timezone.utc) - self.retention
+                    await session.execute(delete(ChatTrace).where(ChatTrace.created_at < cutoff))
+                await session.commit()
+        except Exception as e:
+            logger.warning("Failed to store trace %s: %s", trace_id, e)
+
+    async def get(self, trace_id: str) -> dict | None:
+        async with self.async_session_maker() as session:
+            trace = (await session.scalars(select(ChatTrace).where(ChatTrace.trace_id == trace_id))).first()
+            if trace is None:
+                return None
+            return {
+                "trace_id": trace.trace_id,
+                "created_at": trace.created_at,
+                "route": trace.route,
+                "context": trace.trace,
+            }
+
+
+def create_trace_store_from_env(engine):
+    if os.getenv("TRACE_STORE") == "postgres":
+        logger.info("Storing chat traces in Postgres...")
+        return PostgresTraceStore(engine, retention=timedelta(hours=float(os.getenv("TRACE_RETENTION_HOURS", "24"))))
+    return MemoryTraceStore(
+        max_entries=int(os.getenv("TRACE_STORE_MAX_ENTRIES", "500")),
+        max_bytes=int(float(os.getenv("TRACE_STORE_MAX_MB", "32")) * 1024 * 1024),
+    )
@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import logging
+import os
+
+import azure.identity.aio
+from dotenv import load_dotenv
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from fastapi_app.embeddings import compute_text_embeddings
+from fastapi_app.openai_clients import create_openai_embed_client
+from fastapi_app.postgres_engine import create_postgres_engine_from_args, create_postgres_engine_from_env
+from fastapi_app.postgres_models import Package
+
+logger = logging.getLogger("ragapp")
+
+
+async def update_embeddings(engine, openai_embed_client, embed_model, embed_deployment, embed_dimensions, batch_size):
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+        updated = 0
+        while True:
+            # Only packages without an embedding, so the script can be re-run after new packages are seeded
+            packages = (
+                await session.scalars(select(Package).where(Package.embedding.is_(None)).limit(batch_size))
+            ).all()
+            if not packages:
+                break
+            embeddings = await compute_text_embeddings(
+                [package.to_str_for_embedding() for package in packages],
+                openai_embed_client,
+                embed_model,
+                embed_deployment=embed_deployment,
+                embedding_dimensions=embed_dimensions,
+            )
+            for package, embedding in zip(packages, embeddings):
+                await session.execute(update(Package).where(Package.url == package.url).values(embedding=embedding))
+            await session.commit()
+            updated += len(packages)
+            logger.info("Embedded %d packages", updated)
+
+    logger.info("Embeddings updated successfully.")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compute embeddings for the packages without one")
+    parser.add_argument("--host", type=str, help="Postgres host")
+    parser.add_argument("--username", type=str, help="Postgres username")
+    parser.add_argument("--password", type=str, help="Postgres password")
+    parser.add_argument("--database", type=str, help="Postgres database")
+    parser.add_argument("--sslmode", type=str, help="Postgres sslmode")
+    parser.add_argument("--batch-size", type=int, default=100, help="Packages embedded per API call")
+
+    # if no args are specified, use environment variables
+    args = parser.parse_args()
+    if args.host is None:
+        engine = await create_postgres_engine_from_env()
+    else:
+        engine = await create_postgres_engine_from_args(args)
+
+    azure_credential = None
+    if os.getenv("OPENAI_EMBED_HOST") == "azure":
+        azure_credential = azure.identity.aio.DefaultAzureCredential()
+    openai_embed_client, embed_model, embed_dimensions = await create_openai_embed_client(azure_credential)
+    embed_deployment = os.getenv("AZURE_OPENAI_EMBED_DEPLOYMENT") if os.getenv("OPENAI_EMBED_HOST") == "azure" else None
+
+    await update_embeddings(
+        engine, openai_embed_client, embed_model, embed_deployment, embed_dimensions, args.batch_size
+    )
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    load_dotenv(override=True)
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from fastapi_app.narrow_context import DEFAULT_TOKEN_BUDGET, build_narrow_context, find_boilerplate, get_encoding
+from fastapi_app.postgres_engine import create_postgres_engine_from_args, create_postgres_engine_from_env
+from fastapi_app.postgres_models import Package
+
+logger = logging.getLogger("ragapp")
+
+
+def narrow_context_changes(packages, token_budget: int, boilerplate_share: float, model=None) -> list[dict]:
+    encoding = get_encoding(model)
+    boilerplate = find_boilerplate(packages, min_share=boilerplate_share)
+    logger.info("Found %d boilerplate lines in %d packages", len(boilerplate), len(packages))
+    changes = []
+    for package in packages:
+        narrow_context = build_narrow_context(package, encoding, token_budget, boilerplate)
+        if narrow_context != package.narrow_context:
+            changes.append({"url": package.url, "narrow_context": narrow_context})
+    return changes
+
+
+async def update_narrow_contexts(engine, token_budget=None, boilerplate_share=0.5, model=None, precomputed_only=False):
+    """Precompute the narrow RAG context of every package, or with precomputed_only of the packages that already
+    have one. Boilerplate is found across the whole catalog, so all packages are recomputed, and only the changed
+    ones are written."""
+    if token_budget is None:
+        token_budget = int(os.getenv("NARROW_CONTEXT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+        packages = (await session.scalars(select(Package))).all()
+        # Tokenizing the catalog takes a while, off the event loop when the app workers run it
+        changes = await asyncio.to_thread(narrow_context_changes, packages, token_budget, boilerplate_share, model)
+        if precomputed_only:
+            precomputed = {package.url for package in packages if package.narrow_context is not None}
+            changes = [change for change in changes if change["url"] in precomputed]
+        if changes:
+            # Bulk update by primary key, one executemany
+            await session.execute(update(Package), changes)
+            await session.commit()
+    logger.info("Updated the narrow context of %d packages", len(changes))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Precompute the narrow RAG context of the packages")
+    parser.add_argument("--host", type=str, help="Postgres host")
+    parser.add_argument("--username", type=str, help="Postgres username")
+    parser.add_argument("--password", type=str, help="Postgres password")
+    parser.add_argument("--database", type=str, help="Postgres database")
+    parser.add_argument("--sslmode", type=str, help="Postgres sslmode")
+    parser.add_argument(
+        "--token-budget",
+        type=int,
+        help=f"Maximum tokens of the context of one package, NARROW_CONTEXT_TOKEN_BUDGET or {DEFAULT_TOKEN_BUDGET}",
+    )
+    parser.add_argument(
+        "--boilerplate-share",
+        type=float,
+        default=0.5,
+        help="Lines found in at least this share of the packages are dropped, 0 keeps them",
+    )
+
+    # if no args are specified, use environment variables
+    args = parser.parse_args()
+    if args.host is None:
+        engine = await create_postgres_engine_from_env()
+    else:
+        engine = await create_postgres_engine_from_args(args)
+
+    await update_narrow_contexts(engine, args.token_budget, args.boilerplate_share)
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    load_dotenv(override=True)
+    asyncio.run(main())
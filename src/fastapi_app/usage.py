@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from prometheus_client import Counter
+
+LLM_COST = Counter(
+    "ragapp_llm_estimated_cost_usd_total",
+    "Estimated LLM spend in USD by intent route and pipeline stage",
+    ["route", "stage"],
+)
+
+# USD per 1M tokens as (input, output). Cached input tokens are billed at half the input price.
+# Keys are matched as prefixes of the model name returned by the API, longest first.
+MODEL_PRICES_PER_MILLION = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (5.00, 15.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4": (30.00, 60.00),
+    "gpt-35-turbo": (0.50, 1.50),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+CACHED_INPUT_DISCOUNT = 0.5
+
+
+def get_model_prices(model: str | None) -> tuple[float, float]:
+    if os.getenv("LLM_PRICE_INPUT_PER_MILLION") and os.getenv("LLM_PRICE_OUTPUT_PER_MILLION"):
+        return float(os.environ["LLM_PRICE_INPUT_PER_MILLION"]), float(os.environ["LLM_PRICE_OUTPUT_PER_MILLION"])
+    for prefix in sorted(MODEL_PRICES_PER_MILLION, key=len, reverse=True):
+        if model and model.startswith(prefix):
+            return MODEL_PRICES_PER_MILLION[prefix]
+    return 0.0, 0.0
+
+
+def estimate_cost(model: str | None, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    input_price, output_price = get_model_prices(model)
+    uncached_tokens = prompt_tokens - cached_tokens
+    return (
+        uncached_tokens * input_price
+        + cached_tokens * input_price * CACHED_INPUT_DISCOUNT
+        + completion_tokens * output_price
+    ) / 1_000_000
+
+
+def empty_totals() -> dict:
+    return {
+        "calls": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cached_tokens": 0,
+        "total_tokens": 0,
+        "estimated_cost_usd": 0.0,
+        "latency_seconds": 0.0,
+    }
+
+
+def add_totals(totals: dict, other: dict) -> None:
+    for key, value in other.items():
+        totals[key] += value
+
+
+class RequestUsage:
+    """Token usage of every chat completion made while answering one request, keyed by stage."""
+
+    def __init__(self):
+        self.stages: dict[str, dict] = defaultdict(empty_totals)
+
+    def add(self, stage: str, model: str | None, usage, latency_seconds: float) -> None:
+        totals = self.stages[stage]
+        totals["calls"] += 1
+        totals["latency_seconds"] += latency_seconds
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) if details else None) or 0
+        totals["prompt_tokens"] += usage.prompt_tokens or 0
+        totals["completion_tokens"] += usage.completion_tokens or 0
+        totals["cached_tokens"] += cached_tokens
+        totals["total_tokens"] += usage.total_tokens or 0
+        totals["estimated_cost_usd"] += estimate_cost(
+            model, usage.prompt_tokens or 0, usage.completion_tokens or 0, cached_tokens
+        )
+
+    def total(self) -> dict:
+        totals = empty_totals()
+        for stage_totals in self.stages.values():
+            add_totals(totals, stage_totals)
+        return totals
+
+    def to_dict(self) -> dict:
+        return {"total": self.total(), "stages": dict(self.stages)}
+
+
+class UsageLedger:
+    """Rolling per-route and per-stage totals for this worker, bucketed by minute."""
+
+    def __init__(self, window_minutes: int = 60):
+        self.window_minutes = window_minutes
+        self.buckets: deque[tuple[int, dict, dict]] = deque()
+        self.lock = threading.Lock()
+
+    def _current_bucket(self, now: float) -> tuple[int, dict, dict]:
+        minute = int(now // 60)
+        if not self.buckets or self.buckets[-1][0] != minute:
+            self.buckets.append((minute, defaultdict(empty_totals), defaultdict(empty_totals)))
+        while self.buckets and self.buckets[0][0] <= minute - self.window_minutes:
+            self.buckets.popleft()
+        return self.buckets[-1]
+
+    def record(self, route: str, request_usage: RequestUsage, latency_seconds: float) -> None:
+        request_total = request_usage.total()
+        with self.lock:
+            _, routes, stages = self._current_bucket(time.time())
+            route_totals = routes[route]
+            route_totals["requests"] = route_totals.get("requests", 0) + 1
+            route_totals["request_latency_seconds"] = route_totals.get("request_latency_seconds", 0.0) + latency_seconds
+            add_totals(route_totals, request_total)
+            for stage, stage_totals in request_usage.stages.items():
+                add_totals(stages[stage], stage_totals)
+        for stage, stage_totals in request_usage.stages.items():
+            LLM_COST.labels(route, stage).inc(stage_totals["estimated_cost_usd"])
+
+    def summary(self) -> dict:
+        routes: dict[str, dict] = {}
+        stages: dict[str, dict] = defaultdict(empty_totals)
+        with self.lock:
+            self._current_bucket(time.time())
+            for _, bucket_routes, bucket_stages in self.buckets:
+                for route, totals in bucket_routes.items():
+                    route_totals = routes.setdefault(route, {})
+                    for key, value in totals.items():
+                        route_totals[key] = route_totals.get(key, 0) + value
+                for stage, totals in bucket_stages.items():
+                    add_totals(stages[stage], totals)
+        return {"window_minutes": self.window_minutes, "routes": routes, "stages": dict(stages)}
+
+
+usage_ledger = UsageLedger(window_minutes=int(os.getenv("USAGE_WINDOW_MINUTES", "60")))
@@ -1,4 +1,13 @@
 import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Workers share Prometheus samples through files in this directory, so /metrics reports all of them.
+# prometheus_client picks file-backed values when it is first imported, so this has to come before any import of it.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "ragapp-prometheus"))
+
+from prometheus_client import multiprocess  # noqa: E402
 
 max_requests = 1000
 max_requests_jitter = 50
@@ -9,3 +18,18 @@ workers = (multiprocessing.cpu_count() * 2) + 1
 worker_class = "uvicorn.workers.UvicornWorker"
 
 timeout = 600
+
+# With CATALOG_SNAPSHOT=shared, the first worker to start publishes the catalog file here and the others map it
+os.environ.setdefault("CATALOG_SHARED_PATH", os.path.join(tempfile.gettempdir(), "ragapp-catalog", "catalog.bin"))
+
+
+def on_starting(server):
+    # Samples from a previous run of the server must not leak into this one
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+    # Likewise, rebuild the shared catalog once rather than trusting a file left by a previous run
+    shutil.rmtree(os.path.dirname(os.environ["CATALOG_SHARED_PATH"]), ignore_errors=True)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,17 @@
+import dataclasses
+
+import pytest
+
+from fastapi_app.postgres_models import Package
+
+
+@pytest.fixture
+def make_package():
+    def make_package(url: str, **values) -> Package:
+        # Every constructor field is required, the ones a test does not care about are left empty
+        fields = {field.name: "" for field in dataclasses.fields(Package) if field.init}
+        fields.update(url=url, price=1000.0, cash_discount=0.0, price_after_cash_discount=1000.0)
+        fields.update(price_to_reserve_for_this_package=0.0, **values)
+        return Package(**fields)
+
+    return make_package
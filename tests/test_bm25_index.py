@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from fastapi_app.bm25_index import BM25Index, tokenize
+from fastapi_app.price_filter import PriceRange
+
+
+def test_tokenize():
+    assert tokenize("MRI Brain 3T") == ["mri", "brain", "3t"]
+    # Thai runs become overlapping bi- and trigrams
+    assert tokenize("ตรวจ") == ["ตร", "รว", "วจ", "ตรว", "รวจ"]
+    assert tokenize("ตร") == ["ตร"]
+    assert tokenize(None) == []
+
+
+@pytest.fixture
+def index():
+    records = [
+        {"url": "checkup-rangsit", "price": 2000, "package_name": "ตรวจสุขภาพ", "locations": "รังสิต"},
+        {"url": "checkup-bangna", "price": 5000, "package_name": "ตรวจสุขภาพ", "locations": "บางนา"},
+        {"url": "dental", "price": 800, "package_name": "ขูดหินปูน", "locations": "รังสิต"},
+        {"url": "mri", "price": None, "package_name": "MRI Brain", "category": "ตรวจ"},
+    ]
+    return BM25Index.build(records, fingerprint="abc")
+
+
+def test_build(index):
+    assert len(index) == 4
+    assert index.fingerprint == "abc"
+    assert np.isnan(index.prices[3])
+
+
+def test_search_ranks_matching_packages(index):
+    results = index.search("ขูดหินปูน")
+    assert [url for url, _ in results] == ["dental"]
+    assert results[0][1] > 0
+    assert index.search("ไม่มีคำนี้เลย") == []
+
+
+def test_search_boosts_the_locations(index):
+    assert index.search("ตรวจสุขภาพ", top=1, locations=["บางนา"])[0][0] == "checkup-bangna"
+    assert index.search("ตรวจสุขภาพ", top=1, locations=["รังสิต"])[0][0] == "checkup-rangsit"
+
+
+def test_search_top_and_order(index):
+    results = index.search("ตรวจ mri", top=2)
+    assert len(results) == 2
+    assert results[0][1] >= results[1][1]
+
+
+def test_search_leaves_out_prices_outside_the_range(index):
+    urls = [url for url, _ in index.search("ตรวจสุขภาพ", price_range=PriceRange(maximum=3000))]
+    assert urls == ["checkup-rangsit"]
+    # Unknown prices are outside every range
+    assert index.search("mri", price_range=PriceRange(minimum=0)) == []
@@ -0,0 +1,69 @@
+import pytest
+
+from fastapi_app.catalog import CatalogSnapshot, filter_packages, like_to_regex
+
+
+@pytest.fixture
+def packages(make_package):
+    return [
+        make_package("https://hdmall.co.th/checkup-a", package_name="ตรวจสุขภาพ Basic", category="checkup"),
+        make_package("https://hdmall.co.th/checkup-b", package_name="ตรวจสุขภาพ Premium", category="checkup"),
+        make_package("https://hdmall.co.th/dental-a", package_name="ขูดหินปูน", category="dental"),
+    ]
+
+
+def test_like_to_regex():
+    assert like_to_regex("%ตรวจ_ุขภาพ%", ignore_case=False).fullmatch("แพ็กเกจตรวจสุขภาพ")
+    assert not like_to_regex("Basic%", ignore_case=False).fullmatch("basic checkup")
+    assert like_to_regex("Basic%", ignore_case=True).fullmatch("basic checkup")
+    # Regex characters in the pattern are matched literally
+    assert not like_to_regex("a.c", ignore_case=False).fullmatch("abc")
+
+
+def test_filter_packages(packages):
+    filters = [{"column": "package_name", "comparison_operator": "like", "value": "%Premium%"}]
+    assert [package.url for package in filter_packages(packages, filters)] == ["https://hdmall.co.th/checkup-b"]
+
+
+def test_filter_packages_combines_with_or_or_and(packages):
+    filters = [
+        {"column": "category", "comparison_operator": "=", "value": "checkup"},
+        {"column": "package_name", "comparison_operator": "ILIKE", "value": "%basic%"},
+    ]
+    assert len(filter_packages(packages, filters, use_or=True)) == 2
+    assert [package.url for package in filter_packages(packages, filters)] == ["https://hdmall.co.th/checkup-a"]
+
+
+def test_filter_packages_limit(packages):
+    filters = [{"column": "url", "comparison_operator": "LIKE", "value": "https://hdmall.co.th/%"}]
+    assert len(filter_packages(packages, filters, limit=2)) == 2
+
+
+def test_filter_packages_without_filters_matches_nothing(packages):
+    assert filter_packages(packages, []) == []
+
+
+@pytest.mark.parametrize(
+    "filter",
+    [
+        {"column": "price", "comparison_operator": "=", "value": "1000"},
+        {"column": "category", "comparison_operator": ">", "value": "checkup"},
+        {"column": "category", "comparison_operator": "=", "value": 1},
+    ],
+)
+def test_filter_packages_leaves_other_filters_to_the_database(packages, filter):
+    assert filter_packages(packages, [filter]) is None
+
+
+def test_snapshot_indexes(packages):
+    snapshot = CatalogSnapshot()
+    for package in packages:
+        snapshot.put(package)
+    assert len(snapshot) == 3
+    assert snapshot.get("https://hdmall.co.th/dental-a/").package_name == "ขูดหินปูน"
+    assert [package.url for package in snapshot.in_category("checkup")] == [
+        "https://hdmall.co.th/checkup-a",
+        "https://hdmall.co.th/checkup-b",
+    ]
+    snapshot.remove("https://hdmall.co.th/checkup-a")
+    assert [package.url for package in snapshot.in_category("checkup")] == ["https://hdmall.co.th/checkup-b"]
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from fastapi_app.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("apps_script", failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    open_breaker(breaker)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.check()
+    assert error.value.dependency == "apps_script"
+    assert 0 < error.value.retry_in <= 30
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker("apps_script", failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 30
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_reopens():
+    breaker = CircuitBreaker("apps_script", failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_threshold_zero_turns_the_breaker_off():
+    breaker = CircuitBreaker("apps_script", failure_threshold=0)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_only_one_thread_takes_the_trial():
+    breaker = CircuitBreaker("apps_script", failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 30
+    barrier = threading.Barrier(8)
+    allowed = []
+
+    def call():
+        barrier.wait()
+        allowed.append(breaker.allow())
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert allowed.count(True) == 1
+
+
+def test_failures_from_threads_are_all_counted():
+    breaker = CircuitBreaker("apps_script", failure_threshold=10_000)
+
+    def fail():
+        for _ in range(1000):
+            breaker.record_failure()
+
+    threads = [threading.Thread(target=fail) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert breaker.failures == 4000
@@ -0,0 +1,53 @@
+import pytest
+
+from fastapi_app.gazetteer import get_gazetteer, normalize_place
+
+
+@pytest.fixture(scope="module")
+def gazetteer():
+    return get_gazetteer()
+
+
+def test_normalize_place():
+    assert normalize_place("อ.ธัญบุรี") == "ธัญบุรี"
+    assert normalize_place("เขต บางนา") == "บางนา"
+    assert normalize_place("Khet Bang Na") == "bangna"
+
+
+def test_resolve(gazetteer):
+    assert gazetteer.names[gazetteer.resolve("อ.ธัญบุรี")] == "ธัญบุรี"
+    assert gazetteer.names[gazetteer.resolve("กทม")] == "กรุงเทพมหานคร"
+    assert gazetteer.resolve("ไม่มีที่นี่") is None
+
+
+def test_expand_adds_the_place_and_its_neighbours(gazetteer):
+    expanded = gazetteer.expand(["รังสิต"])
+    # The location as given, the district it is in, then its nearest districts
+    assert expanded[:2] == ["รังสิต", "ธัญบุรี"]
+    assert "คลองหลวง" in expanded
+    assert len(expanded) == 2 + 4
+    assert len(expanded) == len(set(expanded))
+
+
+def test_expand_keeps_unknown_locations(gazetteer):
+    expanded = gazetteer.expand(["ไม่มีที่นี่", "บางนา"])
+    assert expanded[:2] == ["ไม่มีที่นี่", "บางนา"]
+    assert len(expanded) == 2 + 4
+
+
+def test_expand_without_neighbours(gazetteer):
+    assert gazetteer.expand(["บางนา"], neighbours=0) == ["บางนา"]
+
+
+def test_common_words_are_not_places(gazetteer):
+    # "เลย" is a province, and "at all" inside a sentence
+    assert gazetteer.places_in("ตรวจสุขภาพ ไม่ต้องเลย") == []
+    assert gazetteer.resolve("เลย") is not None
+
+
+def test_rank_by_distance(gazetteer, make_package):
+    far = make_package("far", locations="เชียงใหม่")
+    near = make_package("near", locations="คลองหลวง ปทุมธานี")
+    unknown = make_package("unknown", locations="")
+    assert gazetteer.rank_by_distance([unknown, far, near], "รังสิต") == [near, far, unknown]
+    assert gazetteer.rank_by_distance([unknown, far, near], "ไม่มีที่นี่") == [unknown, far, near]
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from fastapi_app.postgres_searcher import FANOUT_BASE_WEIGHT, MAX_FANOUT_LOCATIONS, PostgresSearcher, fanout_queries
+
+
+@pytest.fixture
+def searcher():
+    # No engine: these tests never reach the database
+    return PostgresSearcher(None)
+
+
+def test_build_filter_clause_binds_values(searcher):
+    filters = [{"column": "package_name", "comparison_operator": "ilike", "value": "%'; DROP TABLE x; --%"}]
+    clause = searcher.build_filter_clause(filters)
+    assert str(clause) == "packages_all.package_name ILIKE :package_name_1"
+    assert clause.compile().params == {"package_name_1": "%'; DROP TABLE x; --%"}
+
+
+@pytest.mark.parametrize(
+    "filter",
+    [
+        {"column": "narrow_context", "comparison_operator": "=", "value": "x"},
+        {"column": "package_name); DELETE FROM packages_all; --", "comparison_operator": "=", "value": "x"},
+        {"column": "package_name", "comparison_operator": "; DELETE", "value": "x"},
+    ],
+)
+def test_build_filter_clause_skips_unknown_columns_and_operators(searcher, filter):
+    assert searcher.build_filter_clause([filter]) is None
+
+
+def test_build_filter_clause_keeps_the_allowed_filters(searcher):
+    filters = [
+        {"column": "unknown", "comparison_operator": "=", "value": "x"},
+        {"column": "url", "comparison_operator": "=", "value": "https://hdmall.co.th/x"},
+        {"column": "category", "comparison_operator": "=", "value": "checkup"},
+    ]
+    assert str(searcher.build_filter_clause(filters, use_or=True)) == (
+        "(packages_all.url = :url_1) OR (packages_all.category = :category_1)"
+    )
+
+
+def test_simple_sql_search_without_usable_filters_finds_nothing(searcher):
+    filters = [{"column": "unknown", "comparison_operator": "=", "value": "x"}]
+    assert asyncio.run(searcher.simple_sql_search(filters)) == []
+    assert asyncio.run(searcher.simple_sql_search([])) == []
+
+
+def test_build_similarity_terms(searcher):
+    filters = [
+        {"column": "package_name", "comparison_operator": "ILIKE", "value": "%ตรวจสุขภาพ%"},
+        {"column": "category", "comparison_operator": "ILIKE", "value": "%checkup%"},
+        {"column": "url", "comparison_operator": "=", "value": "https://hdmall.co.th/x"},
+    ]
+    assert [term for _, term in searcher.build_similarity_terms(filters)] == ["ตรวจสุขภาพ"]
+
+
+def test_unknown_modes_are_rejected():
+    with pytest.raises(ValueError):
+        PostgresSearcher(None, retrieval_mode="bing")
+    with pytest.raises(ValueError):
+        PostgresSearcher(None, sql_search_mode="regex")
+
+
+def test_fanout_queries():
+    locations = ["รังสิต", "ธัญบุรี", "คลองหลวง", "ลำลูกกา", "สายไหม"]
+    queries = fanout_queries("ตรวจสุขภาพ", locations)
+    assert queries[0] == ("ตรวจสุขภาพ", FANOUT_BASE_WEIGHT)
+    assert queries[1:3] == [('ตรวจสุขภาพ "รังสิต"', 1.0), ('ตรวจสุขภาพ "ธัญบุรี"', 0.5)]
+    assert len(queries) == 1 + MAX_FANOUT_LOCATIONS
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from fastapi_app.price_filter import PriceRange, parse_price_range
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("ไม่เกิน 3,000 บาท", PriceRange(maximum=3000)),
+        ("งบ ๕๐๐๐", PriceRange(maximum=5000)),
+        ("1-2 หมื่น", PriceRange(10_000, 20_000)),
+        ("1000 ถึง 3000 บาท", PriceRange(1000, 3000)),
+        ("over 5k", PriceRange(minimum=5000)),
+        ("5000 บาทขึ้นไป", PriceRange(minimum=5000)),
+        ("ประมาณ 3000 บาท", PriceRange(2400, 3600)),
+    ],
+)
+def test_parse_price_range(text, expected):
+    assert parse_price_range(text) == expected
+
+
+@pytest.mark.parametrize(
+    "text", ["", None, "ผ่อน 10 เดือน", "ตรวจสุขภาพ อายุ 40 ปี", "https://hdmall.co.th/checkup-3000", "3000 บาท"]
+)
+def test_parse_price_range_without_price(text):
+    assert parse_price_range(text) is None
+
+
+def test_bare_amount_is_maximum():
+    assert parse_price_range("3000 บาท", bare_amount_is_maximum=True) == PriceRange(maximum=3000)
+    assert parse_price_range("ผ่อน 10 เดือน", bare_amount_is_maximum=True) is None
+
+
+def test_price_range_contains_and_mask():
+    price_range = PriceRange(1000, 2000)
+    assert price_range.contains(1500)
+    assert not price_range.contains(2500)
+    assert not price_range.contains(None)
+    assert not price_range.contains(float("nan"))
+    mask = price_range.mask(np.array([500, 1000, 2000, np.nan], dtype=np.float32))
+    assert mask.tolist() == [False, True, True, False]
+
+
+def test_sql_clause_binds_the_bounds():
+    clause, params = PriceRange(maximum=3000).sql_clause("price")
+    assert clause == " AND price <= :max_price"
+    assert params == {"max_price": 3000}
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from fastapi_app.shared_catalog import SharedCatalog, encode_catalog
+
+
+@pytest.fixture
+def catalog(tmp_path, make_package):
+    packages = [
+        make_package("https://hdmall.co.th/b", package_name="ตรวจสุขภาพ", category="checkup", shop_name="โรงพยาบาล ก"),
+        make_package("https://hdmall.co.th/a", package_name="ขูดหินปูน", category="dental", shop_name="คลินิก ข"),
+        make_package("https://hdmall.co.th/c", package_name="MRI", category="checkup", shop_name="โรงพยาบาล ก"),
+    ]
+    embeddings = {"https://hdmall.co.th/a": [0.5, -1.0, 2.0], "https://hdmall.co.th/c": [1.0, 0.0, 0.25]}
+    path = tmp_path / "catalog.bin"
+    path.write_bytes(encode_catalog(packages, embeddings, version=7))
+    catalog = SharedCatalog(str(path))
+    assert catalog.map_file()
+    return catalog
+
+
+def test_map_file(catalog):
+    assert len(catalog) == 3
+    assert catalog.version == 7
+    assert catalog.dimensions == 3
+
+
+def test_packages_round_trip(catalog, make_package):
+    package = catalog.get("https://hdmall.co.th/b/")
+    assert package == make_package(
+        "https://hdmall.co.th/b", package_name="ตรวจสุขภาพ", category="checkup", shop_name="โรงพยาบาล ก"
+    )
+    assert catalog.get("https://hdmall.co.th/missing") is None
+    # Every lookup decodes a fresh package
+    assert catalog.get("https://hdmall.co.th/b") is not package
+
+
+def test_embeddings_round_trip(catalog):
+    assert catalog.embedding("https://hdmall.co.th/a").tolist() == [0.5, -1.0, 2.0]
+    assert np.allclose(catalog.embedding("https://hdmall.co.th/c"), [1.0, 0.0, 0.25])
+    assert catalog.embedding("https://hdmall.co.th/b") is None
+
+
+def test_indexes(catalog):
+    assert [package.url for package in catalog.in_category("checkup")] == [
+        "https://hdmall.co.th/b",
+        "https://hdmall.co.th/c",
+    ]
+    assert [package.url for package in catalog.of_shop("คลินิก ข")] == ["https://hdmall.co.th/a"]
+    filters = [{"column": "package_name", "comparison_operator": "ILIKE", "value": "mri"}]
+    assert [package.url for package in catalog.filter(filters)] == ["https://hdmall.co.th/c"]
+    assert catalog.filter([]) == []
+
+
+def test_missing_or_foreign_file(tmp_path):
+    assert not SharedCatalog(str(tmp_path / "missing.bin")).map_file()
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        SharedCatalog(str(path)).map_file()
+
+
+def test_empty_catalog(tmp_path):
+    path = tmp_path / "catalog.bin"
+    path.write_bytes(encode_catalog([], {}, version=None))
+    catalog = SharedCatalog(str(path))
+    assert catalog.map_file()
+    assert len(catalog) == 0
+    assert catalog.version is None
+    assert catalog.get("https://hdmall.co.th/a") is None
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from fastapi_app.single_flight import SingleFlight
+
+
+def test_do_coalesces_concurrent_calls():
+    calls = []
+
+    async def load(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key.upper()
+
+    async def main():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(*(flight.do("a", load, "a") for _ in range(5)), flight.do("b", load, "b"))
+        # Nothing is cached once the calls completed
+        assert not flight.calls
+        assert await flight.do("a", load, "a") == "A"
+        return results
+
+    assert asyncio.run(main()) == ["A"] * 5 + ["B"]
+    assert calls == ["a", "b", "a"]
+
+
+def test_do_shares_the_exception():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("down")
+
+    async def main():
+        flight = SingleFlight("test")
+        return await asyncio.gather(flight.do("a", fail), flight.do("a", fail), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert [type(error) for error in errors] == [ValueError, ValueError]
+
+
+def test_cancelled_caller_does_not_cancel_the_call():
+    async def load():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def main():
+        flight = SingleFlight("test")
+        first = asyncio.create_task(flight.do("a", load))
+        second = asyncio.create_task(flight.do("a", load))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_do_many_loads_only_the_keys_not_in_flight():
+    batches = []
+
+    async def load_many(keys):
+        batches.append(sorted(keys))
+        await asyncio.sleep(0.01)
+        return {key: key * 2 for key in keys}
+
+    async def main():
+        flight = SingleFlight("test")
+        first = asyncio.create_task(flight.do_many(["a", "b"], load_many))
+        await asyncio.sleep(0)
+        second = await flight.do_many(["b", "c", "c"], load_many)
+        return await first, second
+
+    first, second = asyncio.run(main())
+    assert first == {"a": "aa", "b": "bb"}
+    assert second == {"b": "bb", "c": "cc"}
+    assert batches == [["a", "b"], ["c"]]
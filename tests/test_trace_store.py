@@ -0,0 +1,40 @@
+import asyncio
+
+from fastapi_app.trace_store import MemoryTraceStore, shape_context
+
+
+def test_put_and_get():
+    store = MemoryTraceStore()
+    trace_id = store.put("search", {"answer": "ตรวจสุขภาพ", "scores": {1: 0.5}})
+    trace = asyncio.run(store.get(trace_id))
+    assert trace["route"] == "search"
+    assert trace["context"] == {"answer": "ตรวจสุขภาพ", "scores": {"1": 0.5}}
+    assert asyncio.run(store.get("missing")) is None
+
+
+def test_bounded_by_entries():
+    store = MemoryTraceStore(max_entries=2)
+    trace_ids = [store.put("search", {"n": n}) for n in range(3)]
+    assert list(store.traces) == trace_ids[1:]
+
+
+def test_bounded_by_bytes():
+    store = MemoryTraceStore(max_bytes=10_000)
+    trace_ids = [store.put("search", {"text": "x" * 3000}) for _ in range(5)]
+    assert store.size <= 10_000
+    assert list(store.traces) == trace_ids[-3:]
+    assert store.size == sum(len(data) for data in store.traces.values())
+
+
+def test_keeps_the_latest_trace_even_over_the_bound():
+    store = MemoryTraceStore(max_bytes=100)
+    store.put("search", {"text": "x" * 3000})
+    trace_id = store.put("search", {"text": "y" * 3000})
+    assert list(store.traces) == [trace_id]
+
+
+def test_shape_context():
+    context = {"usage": {"total_tokens": 10}, "thoughts": [], "data_points": ["x"]}
+    assert shape_context(context, "none", "t") == {"trace_id": "t"}
+    assert shape_context(context, "summary", "t") == {"trace_id": "t", "usage": {"total_tokens": 10}, "thoughts": []}
+    assert shape_context(context, "full", "t") == {**context, "trace_id": "t"}